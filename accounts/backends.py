@@ -1,13 +1,31 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
 
+from .cache import get_cached_user
+
 class EmailBackend(ModelBackend):
+    """
+    Log in by email with one indexed lookup and one password hash.
+
+    Emails are stored lowercased (``UserManager.normalize_email``). Accounts
+    from before that may differ from another only by case, so those keep
+    their old spelling and also match the address exactly as typed.
+    """
     def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
         UserModel = get_user_model()
-        try:
-            user = UserModel.objects.get(email=email)
-        except UserModel.DoesNotExist:
+        normalized = UserModel.objects.normalize_email(email)
+        users = {user.email: user for user in UserModel.objects.filter(email__in={normalized, email})}
+        user = users.get(email) or users.get(normalized)
+        if user is None:
+            # Hash anyway, so an unknown email costs the same as a wrong password
+            UserModel().set_password(password)
             return None
-        if user.check_password(password):
+        # check_password rehashes under the current PASSWORD_HASHERS policy when needed
+        if user.check_password(password) and self.user_can_authenticate(user):
             return user
-        return None
\ No newline at end of file
+        return None
+
+    def get_user(self, user_id):
+        return get_cached_user(user_id, super().get_user)
@@ -0,0 +1,41 @@
+"""
+Cross-request cache of ``User`` rows for ``EmailBackend.get_user``.
+
+Every authenticated request loads its user. With ``ACCOUNTS_USER_CACHE``
+set to a cache alias, the row is read from that cache instead of the
+database. ``accounts.signals`` drops the entry whenever the user is saved
+or deleted. That covers a password change, a deactivation and the
+``last_login`` update on login. The session hash is still checked
+against the cached row on every request.
+
+The cache must be shared by every worker process. With a per-process
+cache, a change made in one worker reaches the others only once the
+entry expires, so a changed password would keep old sessions alive
+there until ``ACCOUNTS_USER_CACHE_TIMEOUT``. The default, ``None``,
+reads the database every time.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _key(user_id):
+    return f"accounts:user:{user_id}"
+
+
+def get_cached_user(user_id, load):
+    """Return ``load(user_id)``, served from the user cache when one is configured."""
+    alias = settings.ACCOUNTS_USER_CACHE
+    if not alias:
+        return load(user_id)
+    cache = caches[alias]
+    user = cache.get(_key(user_id))
+    if user is None:
+        user = load(user_id)
+        if user is not None:
+            cache.set(_key(user_id), user, settings.ACCOUNTS_USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_user(user_id):
+    if settings.ACCOUNTS_USER_CACHE:
+        caches[settings.ACCOUNTS_USER_CACHE].delete(_key(user_id))
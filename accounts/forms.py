@@ -1,6 +1,6 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth import get_user_model
+from django.contrib.auth import authenticate, get_user_model
 
 User = get_user_model()
 
@@ -12,7 +12,7 @@ class SignUpForm(UserCreationForm):
         fields = ('username', 'email', 'password1', 'password2')
 
     def clean_email(self):
-        email = self.cleaned_data.get('email')
+        email = User.objects.normalize_email(self.cleaned_data.get('email'))
         if User.objects.filter(email=email).exists():
             raise forms.ValidationError("This email is already in use")
         return email
@@ -29,15 +29,22 @@ class LoginForm(forms.Form):
     email = forms.EmailField(required=True)
     password = forms.CharField(widget=forms.PasswordInput, required=True)
 
+    def __init__(self, request=None, *args, **kwargs):
+        self.request = request
+        self.user_cache = None
+        super().__init__(*args, **kwargs)
+
     def clean(self):
         cleaned_data = super().clean()
         email = cleaned_data.get('email')
-        password = cleaned_data.get('password')  # Fixed typo: was cleaned_data('password')
+        password = cleaned_data.get('password')
 
         if email and password:
-            user = User.objects.filter(email=email).first()
-            if user and not user.check_password(password):
+            # The only password check of a login; the view logs in get_user()
+            self.user_cache = authenticate(self.request, email=email, password=password)
+            if self.user_cache is None:
                 raise forms.ValidationError("Invalid email or password")
-            elif not user:
-                raise forms.ValidationError("No user found with this email")
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+    def get_user(self):
+        return self.user_cache
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+Password hashers with their work factor taken from settings.
+
+``settings.PASSWORD_HASHERS`` is the policy. The first hasher hashes new
+passwords; the others only verify existing hashes. On a successful login
+``check_password`` rehashes the password with the first hasher if the
+stored hash used another algorithm or work factor. Changing the policy
+therefore moves each account over on its next login.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 with ``ACCOUNTS_PBKDF2_ITERATIONS`` rounds when set."""
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'ACCOUNTS_PBKDF2_ITERATIONS', None) or super().iterations
@@ -0,0 +1,34 @@
+from functools import partial
+
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware as DjangoAuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+
+def get_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = auth.get_user(request)
+    return request._cached_user
+
+
+async def auser(request):
+    if request.user is not request._lazy_user:
+        # Replaced by login() or logout() during this request
+        return request.user
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = await auth.aget_user(request)
+    return request._cached_user
+
+
+class AuthenticationMiddleware(DjangoAuthenticationMiddleware):
+    """
+    Django's middleware with ``request.user`` and ``request.auser()`` sharing one lookup.
+
+    In Django's version each memoises its own result, so a request that
+    uses both loads the session user twice.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = request._lazy_user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(auser, request)
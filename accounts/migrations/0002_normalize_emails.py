@@ -0,0 +1,32 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:01
+
+import accounts.models
+from django.db import migrations
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    for user in User.objects.exclude(email=Lower('email')).only('pk', 'email').iterator():
+        lowered = user.email.lower()
+        # An address that differs from another account's only by case keeps
+        # its spelling; EmailBackend still matches it exactly as typed
+        if not User.objects.filter(email=lowered).exists():
+            User.objects.filter(pk=user.pk).update(email=lowered)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', accounts.models.UserManager()),
+            ],
+        ),
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+    ]
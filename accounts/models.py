@@ -1,13 +1,24 @@
 from django.db import models
 from django.contrib.auth.models import Group, Permission
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as DjangoUserManager
 
 
 # Create your models here.
 
+class UserManager(DjangoUserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        # The whole address, not just the domain, so logins can match it
+        # with one equality lookup on the unique email index
+        return super().normalize_email(email).strip().lower()
+
+
 class User(AbstractUser):
     email = models.EmailField(max_length=254, unique=True, blank=False)
 
+    objects = UserManager()
+
     groups = models.ManyToManyField(
         Group,
         related_name='customuser_groups',
@@ -0,0 +1,152 @@
+"""
+Throttling for the login and signup endpoints.
+
+Both endpoints hash a password, which is deliberately expensive, so a
+burst of attempts can use up every worker. ``ratelimit`` rejects a POST
+with 429 before the view runs, and so before any hashing. It checks each
+rule in turn:
+
+- ``TokenBucket`` allows bursts up to ``capacity``, then ``per_minute``
+  attempts a minute. It is keyed by client IP: a shared campus IP gets a
+  burst at the start of the month without one client hogging the workers.
+- ``SlidingWindow`` allows at most ``limit`` attempts in any ``window``
+  seconds. It is keyed by the posted email, so guessing one account's
+  password from many IPs is capped too.
+
+``settings.ACCOUNTS_RATE_LIMITS`` configures each named limiter. State
+lives in the ``ACCOUNTS_RATELIMIT_CACHE`` cache. The default local-memory
+cache limits each process on its own; a shared cache such as Redis or
+Memcached limits across every worker. Window counters use the cache's
+atomic ``add`` and ``incr``. A bucket is read and written under a
+short lock taken with ``add``.
+"""
+import hashlib
+import math
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.shortcuts import render
+
+LOCK_TIMEOUT = 0.5
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded; retry in {retry_after} s")
+
+
+@contextmanager
+def _locked(cache, key):
+    lock = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # The lock expires by itself if its holder dies mid-update
+    while not cache.add(lock, 1, timeout=5):
+        if time.monotonic() > deadline:
+            # Contention this heavy on one key is itself a flood
+            raise RateLimitExceeded(1)
+        time.sleep(0.0005)
+    try:
+        yield
+    finally:
+        cache.delete(lock)
+
+
+class TokenBucket:
+    def __init__(self, name, capacity, per_minute):
+        self.name = name
+        self.capacity = capacity
+        self.rate = per_minute / 60
+
+    def hit(self, cache, key):
+        """Take a token for ``key``, or raise ``RateLimitExceeded``."""
+        cache_key = f'ratelimit:{self.name}:{key}'
+        with _locked(cache, cache_key):
+            now = time.time()
+            tokens, updated = cache.get(cache_key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            # Once full again the entry would say the same as a missing one
+            timeout = math.ceil(self.capacity / self.rate) + 1
+            cache.set(cache_key, (tokens - allowed, now), timeout)
+        if not allowed:
+            raise RateLimitExceeded(math.ceil((1 - tokens) / self.rate))
+
+
+class SlidingWindow:
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def hit(self, cache, key):
+        """Count an attempt for ``key``, or raise ``RateLimitExceeded`` when over the limit."""
+        now = time.time()
+        index, offset = divmod(now, self.window)
+        current = f'ratelimit:{self.name}:{key}:{int(index)}'
+        cache.add(current, 0, timeout=self.window * 2)
+        try:
+            count = cache.incr(current)
+        except ValueError:
+            # Expired between add and incr
+            cache.add(current, 1, timeout=self.window * 2)
+            count = 1
+        previous = cache.get(f'ratelimit:{self.name}:{key}:{int(index) - 1}', 0)
+        # Weigh the previous window by how much of it the sliding window still covers
+        if previous * (1 - offset / self.window) + count > self.limit:
+            raise RateLimitExceeded(math.ceil(self.window - offset))
+
+
+LIMITERS = {'token_bucket': TokenBucket, 'sliding_window': SlidingWindow}
+
+
+def get_limiter(name):
+    config = dict(settings.ACCOUNTS_RATE_LIMITS[name])
+    return LIMITERS[config.pop('algorithm')](name, **config)
+
+
+def client_ip(request):
+    proxies = getattr(settings, 'ACCOUNTS_RATELIMIT_PROXY_COUNT', 0)
+    if proxies:
+        # Only the entries added by our own proxies can be trusted
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def posted_email(request):
+    email = request.POST.get('email')
+    return get_user_model().objects.normalize_email(email) if email else None
+
+
+def check(request, rules):
+    """Apply ``(limiter name, key function)`` rules to ``request``; raises ``RateLimitExceeded``."""
+    cache = caches[settings.ACCOUNTS_RATELIMIT_CACHE]
+    for name, key_func in rules:
+        value = key_func(request)
+        if value is None:
+            continue
+        # Hashed so any email or IP makes a short, cache-safe key
+        get_limiter(name).hit(cache, hashlib.sha256(value.encode()).hexdigest()[:32])
+
+
+def ratelimit(*rules):
+    """Reject POSTs that break any of ``rules`` with 429 before the view runs."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST' and settings.ACCOUNTS_RATELIMIT_ENABLED:
+                try:
+                    check(request, rules)
+                except RateLimitExceeded as exc:
+                    response = render(request, 'accounts/rate_limited.html', {'retry_after': exc.retry_after}, status=429)
+                    response['Retry-After'] = str(exc.retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
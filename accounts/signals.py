@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_user
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_cache_stale(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    # A request that read the old row before the commit may have cached it
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
@@ -1,3 +1,187 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .forms import LoginForm
+from .middleware import AuthenticationMiddleware
+from .ratelimit import RateLimitExceeded, SlidingWindow, TokenBucket
+
+User = get_user_model()
+
+
+@override_settings(ACCOUNTS_PBKDF2_ITERATIONS=1000)
+class LoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='wanjiru', email='Wanjiru@Example.com', password='pass12345')
+
+    def test_emails_are_stored_lowercased(self):
+        self.assertEqual(self.user.email, 'wanjiru@example.com')
+        form_data = {'username': 'other', 'email': 'WANJIRU@example.com', 'password1': 'x7!kLm29Qz', 'password2': 'x7!kLm29Qz'}
+        response = self.client.post(reverse('accounts:signup'), form_data)
+        self.assertFormError(response.context['form'], 'email', "This email is already in use")
+
+    def test_login_hashes_the_password_once(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('accounts:login'), {'email': 'WANJIRU@example.com', 'password': 'pass12345'})
+        self.assertRedirects(response, reverse('finance:dashboard'), fetch_redirect_response=False)
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(len([q for q in queries.captured_queries if 'FROM "accounts_user"' in q['sql']]), 1)
+
+    def test_unknown_email_and_wrong_password_look_alike(self):
+        for email, password in (('nobody@example.com', 'pass12345'), ('wanjiru@example.com', 'wrong')):
+            with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode:
+                form = LoginForm(None, {'email': email, 'password': password})
+                self.assertFalse(form.is_valid())
+            self.assertEqual(form.non_field_errors(), ["Invalid email or password"])
+            self.assertEqual(encode.call_count, 1)
+
+    def test_login_rehashes_under_a_new_policy(self):
+        self.assertIn('$1000$', self.user.password)
+        with self.settings(ACCOUNTS_PBKDF2_ITERATIONS=2000):
+            form = LoginForm(None, {'email': 'wanjiru@example.com', 'password': 'pass12345'})
+            self.assertTrue(form.is_valid())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(self.user.check_password('pass12345'))
+
+
+@override_settings(ACCOUNTS_PBKDF2_ITERATIONS=1000, ACCOUNTS_RATE_LIMITS={
+    'login_ip': {'algorithm': 'token_bucket', 'capacity': 5, 'per_minute': 1},
+    'login_email': {'algorithm': 'sliding_window', 'limit': 3, 'window': 60},
+    'signup_ip': {'algorithm': 'token_bucket', 'capacity': 2, 'per_minute': 1},
+})
+class RateLimitTests(TestCase):
+    threads = 16
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _concurrently(self, func, calls_per_thread=1):
+        start = threading.Barrier(self.threads)
+        results = []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(calls_per_thread):
+                    results.append(func())
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def _allowed(self, limiter, key):
+        try:
+            limiter.hit(cache, key)
+        except RateLimitExceeded:
+            return False
+        return True
+
+    def test_limiters_admit_exactly_their_limit_under_concurrency(self):
+        bucket = TokenBucket('bucket', capacity=40, per_minute=0.001)
+        window = SlidingWindow('window', limit=50, window=3600)
+        self.assertEqual(sum(self._concurrently(lambda: self._allowed(bucket, 'ip'), 10)), 40)
+        self.assertEqual(sum(self._concurrently(lambda: self._allowed(window, 'email'), 10)), 50)
+
+    def test_bucket_refills_and_window_slides(self):
+        bucket = TokenBucket('bucket', capacity=2, per_minute=60)
+        window = SlidingWindow('window', limit=2, window=60)
+        with mock.patch('accounts.ratelimit.time.time', return_value=6000.0) as now:
+            self.assertEqual([self._allowed(bucket, 'k') for _ in range(3)], [True, True, False])
+            self.assertEqual([self._allowed(window, 'k') for _ in range(3)], [True, True, False])
+            with self.assertRaises(RateLimitExceeded) as raised:
+                window.hit(cache, 'k')
+            self.assertEqual(raised.exception.retry_after, 60)
+            now.return_value = 6001.0
+            self.assertTrue(self._allowed(bucket, 'k'))
+            now.return_value = 6180.0
+            self.assertTrue(self._allowed(window, 'k'))
+
+    def test_login_burst_is_rejected_before_hashing(self):
+        def attempt():
+            return Client().post(reverse('accounts:login'), {'email': 'guess@example.com', 'password': 'hunter22'})
+
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode:
+            responses = self._concurrently(attempt)
+        statuses = sorted(response.status_code for response in responses)
+        # The per-email window (3) binds before the per-IP bucket (5)
+        self.assertEqual(statuses, [200] * 3 + [429] * 13)
+        self.assertEqual(encode.call_count, 3)
+        self.assertTrue(all(int(r['Retry-After']) > 0 for r in responses if r.status_code == 429))
+
+    def test_limits_by_ip_and_by_email(self):
+        for i in range(4):
+            response = self.client.post(reverse('accounts:login'), {'email': 'target@example.com', 'password': f'guess{i}'},
+                                        REMOTE_ADDR=f'10.0.0.{i}')
+        self.assertEqual(response.status_code, 429)
+
+        statuses = [
+            self.client.post(reverse('accounts:signup'), {'username': f'new{i}', 'email': f'new{i}@example.com'}).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(self.client.get(reverse('accounts:signup')).status_code, 200)
+
+
+@override_settings(ACCOUNTS_PBKDF2_ITERATIONS=1000)
+class AuthLoadingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='otieno', email='otieno@example.com', password='pass12345')
+
+    def _dashboard(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('finance:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cached_sessions_and_users_save_two_queries_per_page(self):
+        self.client.force_login(self.user)
+        self._dashboard()
+        uncached = self._dashboard()
+
+        with self.settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', ACCOUNTS_USER_CACHE='default'):
+            # A new client, since the old one's middleware holds the db engine
+            self.client = Client()
+            self.client.force_login(self.user)
+            self._dashboard()
+            # Neither the session nor the user row is read from the database
+            self.assertEqual(self._dashboard(), uncached - 2)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', ACCOUNTS_USER_CACHE='default')
+    def test_saving_the_user_drops_the_cached_row(self):
+        self.client.force_login(self.user)
+        self._dashboard()
+        self.user.set_password('changed-pass-1')
+        self.user.save()
+        # The session hash no longer matches, so the session is logged out
+        response = self.client.get(reverse('finance:dashboard'))
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next=/", fetch_redirect_response=False)
+
+    def test_user_and_auser_share_one_lookup(self):
+        self.client.force_login(self.user)
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(request.user.pk, self.user.pk)
+            self.assertEqual(async_to_sync(request.auser)().pk, self.user.pk)
+        self.assertEqual(len([q for q in queries.captured_queries if 'FROM "accounts_user"' in q['sql']]), 1)
@@ -1,12 +1,14 @@
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import SignUpForm, LoginForm
+from .ratelimit import client_ip, posted_email, ratelimit
 import logging
 
 logger = logging.getLogger(__name__)
 
+@ratelimit(('signup_ip', client_ip))
 def signup_view(request):
     if request.method == 'POST':
         form = SignUpForm(request.POST)
@@ -22,19 +24,16 @@ def signup_view(request):
         form = SignUpForm()
     return render(request, 'accounts/signup.html', {'form': form})
 
+@ratelimit(('login_ip', client_ip), ('login_email', posted_email))
 def login_view(request):
     if request.method == 'POST':
-        form = LoginForm(request.POST)
+        form = LoginForm(request, request.POST)
         if form.is_valid():
-            email = form.cleaned_data.get('email')
-            password = form.cleaned_data.get('password')
-            user = authenticate(request, email=email, password=password, backend='accounts.backends.EmailBackend')
-            if user is not None:
-                login(request, user, backend='accounts.backends.EmailBackend')
-                messages.success(request, 'Logged in successfully!')
-                return redirect('finance:dashboard')
-            else:
-                messages.error(request, 'Invalid email or password.')
+            login(request, form.get_user())
+            messages.success(request, 'Logged in successfully!')
+            return redirect('finance:dashboard')
+        elif form.non_field_errors():
+            messages.error(request, 'Invalid email or password.')
         else:
             messages.error(request, 'Please correct the errors below.')
     else:
@@ -0,0 +1,102 @@
+"""
+Database-side aggregation for the finance models.
+
+Each model's default manager is built from one of these QuerySets, so
+totals and grouped sums are computed with a single ``SUM``/``GROUP BY``
+query instead of materializing every row in Python, e.g.::
+
+    IncomeSource.objects.filter(user=user).total()
+    budget.allocations.by_category()
+"""
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .periods import month_bounds, month_start
+
+ZERO = Decimal('0.00')
+
+
+def _sum(field):
+    return Coalesce(Sum(field), Value(ZERO), output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+
+class IncomeSourceQuerySet(models.QuerySet):
+    def for_months(self, start, end):
+        lower, upper = month_bounds(start, end)
+        return self.filter(created_at__gte=lower, created_at__lt=upper)
+
+    def total(self):
+        return self.aggregate(total=_sum('amount'))['total']
+
+    async def atotal(self):
+        return (await self.aaggregate(total=_sum('amount')))['total']
+
+    def by_source(self):
+        return (
+            self.values('source')
+            .annotate(total=_sum('amount'), count=Count('id'))
+            .order_by('-total', 'source')
+        )
+
+    def by_month(self):
+        return (
+            self.annotate(period=TruncMonth('created_at'))
+            .values('period')
+            .annotate(total=_sum('amount'), count=Count('id'))
+            .order_by('period')
+        )
+
+
+class AllocationQuerySet(models.QuerySet):
+    def total(self):
+        return self.aggregate(total=_sum('amount'))['total']
+
+    def by_category(self):
+        # Grouped on the integer key; finance.categories supplies the names
+        return (
+            self.values('category_id')
+            .annotate(total=_sum('amount'), count=Count('id'))
+            .order_by('-total', 'category_id')
+        )
+
+    def by_budget(self):
+        return (
+            self.values('budget_id')
+            .annotate(total=_sum('amount'), count=Count('id'))
+            .order_by()
+        )
+
+    def by_month(self):
+        return (
+            self.values('budget__month')
+            .annotate(total=_sum('amount'), count=Count('id'))
+            .order_by('budget__month')
+        )
+
+
+class BudgetQuerySet(models.QuerySet):
+    def for_months(self, start, end):
+        return self.filter(month__gte=month_start(start), month__lte=month_start(end))
+
+    def with_savings(self):
+        remaining = F('total_amount') - F('allocated_total')
+        return self.annotate(
+            remaining=ExpressionWrapper(remaining, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+    def totals(self):
+        return self.aggregate(
+            budgeted=_sum('total_amount'),
+            allocated=_sum('allocated_total'),
+            count=Count('id'),
+        )
+
+    def by_month(self):
+        return (
+            self.values('month')
+            .annotate(budgeted=_sum('total_amount'), allocated=_sum('allocated_total'), count=Count('id'))
+            .order_by('month')
+        )
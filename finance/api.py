@@ -0,0 +1,250 @@
+"""
+JSON API for budget summaries, allocation lists and income totals.
+
+Every response carries a strong ETag and a Last-Modified header taken from
+the data's last change. For budgets that is ``Budget.updated_at``, which
+the rollup writers advance on every allocation change. For income and
+the trend report it is the head of the user's ledger (``finance.ledger``),
+which every worker reads from the database. The validator is looked up
+before the view runs, so a client that already holds the current representation gets
+304 Not Modified without any aggregation being re-run.
+
+The read endpoints are async views on the async ORM. Under ASGI one
+worker can hold many slow mobile connections open without tying up a
+thread for each; under WSGI Django runs them in a per-request event loop.
+The dashboard and budget detail pages in ``finance.views`` are async
+too, and load their data through the same helpers.
+
+``bulk_allocations_api`` is the one write endpoint: it validates and
+inserts a whole batch of allocations in a single transaction.
+"""
+import json
+
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .cache import get_summary_cache
+from .decorators import async_condition, async_login_required
+from .forms import AllocationForm, resolve_categories
+from .models import Budget, IncomeSource, LedgerEntry
+from .pagination import decode_cursor
+from .rollups import BudgetExceeded, admit_allocations
+from .periods import add_months, month_start, parse_month
+from .reports import TrendReport
+from .summaries import abudget_summary, adashboard_page
+
+
+BULK_ALLOCATION_LIMIT = 100
+
+
+def money(value):
+    return f"{value:.2f}"
+
+
+async def _budget_updated_at(request, pk):
+    # The ETag and Last-Modified callables both need this; look up once
+    memo = request.__dict__.setdefault('_budget_updated_at', {})
+    if pk not in memo:
+        budgets = Budget.objects.filter(pk=pk, user=await request.auser())
+        memo[pk] = await budgets.values_list('updated_at', flat=True).afirst()
+    return memo[pk]
+
+
+async def budget_etag(request, pk):
+    updated_at = await _budget_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return f"budget-{pk}-{updated_at.timestamp():.6f}"
+
+
+async def budget_last_modified(request, pk):
+    return await _budget_updated_at(request, pk)
+
+
+def _ledger_head(user_id, kind=None):
+    """``(seq, recorded_at)`` of the user's last ledger entry, of ``kind`` if given."""
+    entries = LedgerEntry.objects.filter(user_id=user_id)
+    if kind is not None:
+        entries = entries.filter(kind=kind)
+    return entries.order_by('-seq').values_list('seq', 'recorded_at')
+
+
+def report_etag(request):
+    seq, _ = _ledger_head(request.user.pk).first() or (0, None)
+    return f"report-{request.user.pk}-{seq}"
+
+
+async def _income_head(request):
+    # The ETag and Last-Modified callables both need this; look up once
+    if not hasattr(request, '_income_head'):
+        user = await request.auser()
+        head = await _ledger_head(user.pk, LedgerEntry.Kind.INCOME).afirst()
+        request._income_head = (user.pk, *(head or (0, None)))
+    return request._income_head
+
+
+async def aincome_etag(request):
+    user_id, seq, _ = await _income_head(request)
+    return f"income-{user_id}-{seq}"
+
+
+async def aincome_last_modified(request):
+    _, _, recorded_at = await _income_head(request)
+    return recorded_at
+
+
+async def aincome_totals(user):
+    incomes = IncomeSource.objects.filter(user=user)
+    return {
+        'total': await incomes.atotal(),
+        'by_source': [
+            {'source': row['source'], 'total': row['total'], 'count': row['count']} async for row in incomes.by_source()
+        ],
+    }
+
+
+async def cached_income_totals(user):
+    return await get_summary_cache().aget_or_compute(user.pk, 'income', 'totals', lambda: aincome_totals(user))
+
+
+async def abudget_for(request, pk):
+    """The user's budget ``pk`` and its cached summary; 404s for anyone else's."""
+    user = await request.auser()
+    try:
+        budget = await Budget.objects.aget(pk=pk, user=user)
+    except Budget.DoesNotExist:
+        raise Http404("No budget matches the given query.")
+    summary = await get_summary_cache().aget_or_compute(user.pk, 'budget', budget.pk, lambda: abudget_summary(budget))
+    return budget, summary
+
+
+def _budget_json(budget):
+    return {
+        'id': budget.pk,
+        'month': f"{budget.month:%Y-%m}",
+        'total_amount': money(budget.total_amount),
+        'allocated_total': money(budget.allocated_total),
+        'allocation_count': budget.allocation_count,
+        'savings': money(budget.savings),
+    }
+
+
+@require_GET
+@async_login_required
+async def dashboard_api(request):
+    """The dashboard's budget page and latest-budget card; ``?after=`` takes the next cursor."""
+    user = await request.auser()
+    cursor = request.GET.get('after')
+    if cursor and decode_cursor(cursor) is None:
+        return JsonResponse({'error': "Invalid cursor."}, status=400)
+    page = await get_summary_cache().aget_or_compute(
+        user.pk, 'dashboard', cursor or 'first', lambda: adashboard_page(user, cursor),
+    )
+    latest_budget = page['latest_budget']
+    return JsonResponse({
+        'budgets': [_budget_json(budget) for budget in page['budgets']],
+        'next_cursor': page['next_cursor'],
+        'latest_budget': _budget_json(latest_budget) if latest_budget else None,
+    })
+
+
+@require_GET
+@async_login_required
+@async_condition(etag_func=budget_etag, last_modified_func=budget_last_modified)
+async def budget_summary_api(request, pk):
+    budget, summary = await abudget_for(request, pk)
+    return JsonResponse({
+        'id': budget.pk,
+        'month': f"{budget.month:%Y-%m}",
+        'total_amount': money(budget.total_amount),
+        'allocated_total': money(summary['total_allocated']),
+        'allocation_count': budget.allocation_count,
+        'savings': money(summary['savings']),
+        'over_budget': summary['over_budget'],
+        'near_limit': summary['near_limit'],
+        'over_budget_amount': money(summary['over_budget_amount']),
+        'chart': summary['chart_data'],
+    })
+
+
+@require_GET
+@async_login_required
+@async_condition(etag_func=budget_etag, last_modified_func=budget_last_modified)
+async def budget_allocations_api(request, pk):
+    budget, summary = await abudget_for(request, pk)
+    return JsonResponse({
+        'budget': budget.pk,
+        'allocations': [
+            {'id': alloc['id'], 'category': alloc['category'], 'amount': money(alloc['amount'])}
+            for alloc in summary['allocations']
+        ],
+    })
+
+
+@require_GET
+@async_login_required
+@async_condition(etag_func=aincome_etag, last_modified_func=aincome_last_modified)
+async def income_total_api(request):
+    totals = await cached_income_totals(await request.auser())
+    return JsonResponse({
+        'total': money(totals['total']),
+        'by_source': [
+            {'source': row['source'], 'total': money(row['total']), 'count': row['count']}
+            for row in totals['by_source']
+        ],
+    })
+
+
+@require_POST
+@login_required
+def bulk_allocations_api(request, pk):
+    """
+    Create many allocations at once from ``{"allocations": [{"category",
+    "custom_category", "amount"}, ...]}``; all items are inserted or none.
+    """
+    budget = get_object_or_404(Budget, pk=pk, user=request.user)
+    try:
+        items = json.loads(request.body)['allocations']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Expected a JSON object with an 'allocations' list."}, status=400)
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'error': "'allocations' must be a non-empty list."}, status=400)
+    if len(items) > BULK_ALLOCATION_LIMIT:
+        return JsonResponse({'error': f"At most {BULK_ALLOCATION_LIMIT} allocations per request."}, status=400)
+
+    forms = [AllocationForm(item if isinstance(item, dict) else {}, user=request.user) for item in items]
+    errors = {index: form.errors.get_json_data() for index, form in enumerate(forms) if not form.is_valid()}
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    try:
+        resolve_categories(forms)
+        created = admit_allocations(budget, [form.save(commit=False) for form in forms])
+    except BudgetExceeded as exc:
+        return JsonResponse({'error': str(exc)}, status=409)
+    return JsonResponse({
+        'budget': budget.pk,
+        'allocations': [
+            {'id': alloc.pk, 'category': alloc.category_name, 'amount': money(alloc.amount)} for alloc in created
+        ],
+    }, status=201)
+
+
+@require_GET
+@login_required
+@condition(etag_func=report_etag)
+def trend_report_api(request):
+    """Month-by-month trends; ``?start=YYYY-MM&end=YYYY-MM`` defaults to the last 24 months."""
+    try:
+        end = parse_month(request.GET['end']) if 'end' in request.GET else month_start(timezone.localdate())
+        start = parse_month(request.GET['start']) if 'start' in request.GET else add_months(end, -23)
+    except ValueError:
+        return JsonResponse({'error': "start and end must look like YYYY-MM."}, status=400)
+    report = get_summary_cache().get_or_compute(
+        request.user.pk, 'report', f"{start:%Y%m}-{end:%Y%m}",
+        lambda: TrendReport.build([request.user.pk], start, end).for_user(request.user.pk),
+    )
+    return JsonResponse(report)
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class FinanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'finance'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .categories import create_default_categories
+
+        post_migrate.connect(create_default_categories, sender=self)
@@ -0,0 +1,221 @@
+"""
+Cold storage for old months.
+
+``archive_user`` moves a user's budgets, allocations and income for every
+month before the archive horizon out of the hot tables. Each month goes
+into one gzip-compressed JSON file under ``FINANCE_ARCHIVE_DIR``, in a
+directory per user. An ``ArchivedMonth`` row keeps the month's totals,
+counts and per-category spend. The hot tables and their indexes then
+only hold the last ``FINANCE_ARCHIVE_AFTER_MONTHS`` months, however long
+a user has been around.
+
+Archiving moves rows; it does not delete them. The rows are deleted
+through querysets marked with ``ARCHIVING``, and every ``post_delete``
+receiver in ``finance.signals`` skips deletes that start from one (see
+``is_archiving``), so the rollups, suggestion statistics, snapshots and
+ledger still count the archived months. Only closed months whose
+snapshot is up to date are archived. Reports keep reading them from
+``MonthlySnapshot``, and snapshot and statistics rebuilds add the
+``ArchivedMonth`` totals to what the hot tables hold. Rows added to an
+archived month later stay hot until the next run merges them into a new
+file for the month; a budget cannot be added to a month whose budget was
+archived (``Budget.save`` refuses it and rollover skips the month).
+
+``load_month`` and ``archived_rows`` read the files back, for the archive
+views and for exports that ask for archived history.
+"""
+import datetime
+import gzip
+import json
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateField, Max
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .cache import invalidate_user
+from .categories import get_registry
+from .models import Allocation, ArchivedMonth, Budget, IncomeSource, MonthlySnapshot, SnapshotChange
+from .periods import add_months, month_bounds
+
+ARCHIVE_FORMAT = 1
+# Set on the querysets archive_month deletes; post_delete receivers see it on ``origin``
+ARCHIVING = 'finance_archiving'
+
+BUDGET_FIELDS = ('id', 'month', 'total_amount', 'allocated_total', 'allocation_count', 'created_at', 'updated_at')
+ALLOCATION_FIELDS = ('id', 'budget_id', 'category_id', 'custom_category', 'amount', 'import_hash')
+INCOME_FIELDS = ('id', 'source', 'amount', 'created_at', 'import_hash', 'recurring_id', 'recurring_month')
+
+# How each stored field is read back; the rest are kept as they are
+DECODERS = {
+    'month': datetime.date.fromisoformat,
+    'recurring_month': datetime.date.fromisoformat,
+    'created_at': datetime.datetime.fromisoformat,
+    'updated_at': datetime.datetime.fromisoformat,
+    'total_amount': Decimal,
+    'allocated_total': Decimal,
+    'amount': Decimal,
+}
+
+
+def is_archiving(origin):
+    """Whether a delete whose ``origin`` is given was started by ``archive_month``."""
+    return getattr(origin, ARCHIVING, False)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'FINANCE_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'var' / 'archive'))
+
+
+def archive_horizon():
+    """The first month that stays hot: anything earlier is archived."""
+    months = getattr(settings, 'FINANCE_ARCHIVE_AFTER_MONTHS', 24)
+    return add_months(timezone.localdate().replace(day=1), -months)
+
+
+def _encode(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+def _decode(row):
+    return {key: DECODERS[key](value) if key in DECODERS and value is not None else value for key, value in row.items()}
+
+
+def load_month(archived):
+    """Return an ``ArchivedMonth``'s ``{'budgets', 'allocations', 'income'}`` rows with their types restored."""
+    with gzip.open(archive_dir() / archived.file, 'rt', encoding='utf-8') as handle:
+        data = json.load(handle)
+    return {key: [_decode(row) for row in data[key]] for key in ('budgets', 'allocations', 'income')}
+
+
+def _write(user_id, month, data):
+    name = f"{user_id}/{month:%Y-%m}-{uuid.uuid4().hex[:12]}.json.gz"
+    path = archive_dir() / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = json.dumps({'format': ARCHIVE_FORMAT, 'user_id': user_id, 'month': month, **data}, default=_encode)
+    # A fresh name every time: the old file stays valid until the new row commits
+    partial = path.with_name(path.name + '.tmp')
+    with gzip.open(partial, 'wt', encoding='utf-8', compresslevel=9) as handle:
+        handle.write(payload)
+    partial.replace(path)
+    return name
+
+
+def remove_file(name):
+    (archive_dir() / name).unlink(missing_ok=True)
+
+
+def archivable_months(user_id, before=None):
+    """Months before ``before`` where ``user_id`` still has hot rows and an up-to-date snapshot."""
+    before = before or archive_horizon()
+    closed = MonthlySnapshot.objects.aggregate(latest=Max('month'))['latest']
+    if closed is None:
+        return []
+    # Only months whose snapshot exists and is current can leave the hot tables
+    before = min(before, add_months(closed, 1))
+    lower = month_bounds(before, before)[0]
+    months = set(Budget.objects.filter(user_id=user_id, month__lt=before).values_list('month', flat=True))
+    months.update(
+        IncomeSource.objects.filter(user_id=user_id, created_at__lt=lower)
+        .annotate(period=TruncMonth('created_at', output_field=DateField()))
+        .values_list('period', flat=True).distinct()
+    )
+    months -= set(SnapshotChange.objects.filter(user_id=user_id).values_list('month', flat=True))
+    return sorted(months)
+
+
+def _summarise(data):
+    categories = defaultdict(lambda: [Decimal('0'), 0])
+    for row in data['allocations']:
+        categories[row['category_id']][0] += row['amount']
+        categories[row['category_id']][1] += 1
+    return {
+        'budgeted': sum((row['total_amount'] for row in data['budgets']), Decimal('0')),
+        'allocated': sum((row['amount'] for row in data['allocations']), Decimal('0')),
+        'income': sum((row['amount'] for row in data['income']), Decimal('0')),
+        'budget_count': len(data['budgets']),
+        'allocation_count': len(data['allocations']),
+        'income_count': len(data['income']),
+        'categories': {str(category_id): [str(total), count] for category_id, (total, count) in categories.items()},
+    }
+
+
+def archive_month(user_id, month):
+    """Move ``user_id``'s rows for ``month`` into its archive file; returns the ``ArchivedMonth``."""
+    lower, upper = month_bounds(month, month)
+    budgets = Budget.objects.filter(user_id=user_id, month=month)
+    allocations = Allocation.objects.filter(budget__in=budgets)
+    incomes = IncomeSource.objects.filter(user_id=user_id, created_at__gte=lower, created_at__lt=upper)
+
+    with transaction.atomic():
+        existing = ArchivedMonth.objects.select_for_update().filter(user_id=user_id, month=month).first()
+        data = load_month(existing) if existing else {'budgets': [], 'allocations': [], 'income': []}
+        data['budgets'] += budgets.order_by('pk').values(*BUDGET_FIELDS)
+        data['allocations'] += allocations.order_by('pk').values(*ALLOCATION_FIELDS)
+        data['income'] += incomes.order_by('pk').values(*INCOME_FIELDS)
+        # Names as they were, so the file reads the same after a rename
+        names = get_registry().names({row['category_id'] for row in data['allocations']})
+        for row in data['allocations']:
+            row['category'] = names[row['category_id']]
+
+        archived, _ = ArchivedMonth.objects.update_or_create(
+            user_id=user_id, month=month,
+            defaults={'file': _write(user_id, month, data), 'archived_at': timezone.now(), **_summarise(data)},
+        )
+        # The rows move rather than go, so the delete receivers in
+        # finance.signals must leave the derived data alone
+        for queryset in (allocations, budgets, incomes):
+            setattr(queryset, ARCHIVING, True)
+            queryset.delete()
+        invalidate_user(user_id)
+        if existing:
+            transaction.on_commit(lambda: remove_file(existing.file))
+    return archived
+
+
+def archive_user(user_id, before=None):
+    """Archive every archivable month of ``user_id``; returns how many months were archived."""
+    months = archivable_months(user_id, before)
+    for month in months:
+        archive_month(user_id, month)
+    return len(months)
+
+
+def archived_totals(user_ids=None, month=None):
+    """``ArchivedMonth`` rows as dicts, for adding archived months to totals rebuilt from hot rows."""
+    rows = ArchivedMonth.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    if month is not None:
+        rows = rows.filter(month=month)
+    return rows.values(
+        'user_id', 'month', 'budgeted', 'allocated', 'income', 'budget_count', 'allocation_count', 'income_count',
+        'categories',
+    )
+
+
+def archived_rows(dataset, user=None):
+    """Yield archived rows shaped like ``finance.exports`` rows of ``dataset``, oldest month first."""
+    months = ArchivedMonth.objects.order_by('user_id', 'month')
+    if user is not None:
+        months = months.filter(user=user)
+    for archived in months.iterator():
+        data = load_month(archived)
+        if dataset == 'budgets':
+            for row in data['budgets']:
+                yield {**row, 'user_id': archived.user_id}
+        elif dataset == 'allocations':
+            for row in data['allocations']:
+                yield {**row, 'user_id': archived.user_id, 'month': archived.month}
+        else:
+            for row in data['income']:
+                yield {**row, 'user_id': archived.user_id}
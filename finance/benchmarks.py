@@ -0,0 +1,230 @@
+"""
+Seeded data and a load driver for benchmarking the finance and accounts flows.
+
+``seed_dataset`` creates ``users`` users. Each gets ``budgets`` monthly
+budgets ending this month, ``allocations`` allocations per budget and
+``incomes`` income sources spread over the same months. A given seed
+always produces the same rows. The rows are written with ``bulk_create``.
+The budget rollups, the suggestion statistics, the ledger and the
+closed-month snapshots are then brought up to date, the same as after an
+import.
+
+``run_scenario`` drives one entry of ``SCENARIOS`` through the Django
+test client from ``concurrency`` threads. Each thread is logged in as a
+different seeded user. The result gives latency percentiles, throughput
+and SQL queries per request. The ``benchmark`` management command runs
+them against a throwaway database and writes JSON, and ``compare``
+diffs two such runs.
+"""
+import datetime
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from pesaplan.instrumentation import install_query_recorder, measure
+
+from .categories import get_registry
+from .ledger import Action, Kind, append
+from .models import Allocation, Budget, IncomeSource
+from .periods import add_months
+from .rollups import rebuild_rollups
+from .snapshots import close_out, current_month
+from .suggestions import rebuild_stats
+
+PASSWORD = 'bench-pass-2024'
+CATEGORIES = ('Food', 'Transport', 'Rent', 'Entertainment', 'Airtime', 'Books', 'Savings Goal', 'Church')
+INCOME_SOURCES = ('M-Pesa', 'HELB', 'Part-time job', 'Mom', 'Scholarship')
+PERCENTILES = (50, 90, 95, 99)
+
+SeededUser = namedtuple('SeededUser', 'pk email budget_ids')
+Scenario = namedtuple('Scenario', 'name authenticated expected request')
+
+
+def seed_dataset(users, budgets, allocations, incomes, seed=0):
+    """Create the benchmark rows; returns a ``SeededUser`` per user."""
+    User = get_user_model()
+    rng = random.Random(seed)
+    # One hash for everyone: hashing per user would dominate seeding time
+    password = make_password(PASSWORD)
+    created = User.objects.bulk_create([
+        User(username=f'bench{seed}_{i:05d}', email=f'bench{seed}_{i:05d}@example.com', password=password)
+        for i in range(users)
+    ])
+
+    first = add_months(current_month(), 1 - budgets)
+    budget_rows, allocation_rows, income_rows = [], [], []
+    for user in created:
+        for offset in range(budgets):
+            total = Decimal(rng.randrange(20_000, 80_000))
+            # Allocate about half, leaving headroom for the allocation POSTs
+            amounts = [Decimal(rng.randrange(100, max(101, int(total) // max(allocations, 1)))) for _ in range(allocations)]
+            budget = Budget(
+                user=user, month=add_months(first, offset), total_amount=total,
+                allocated_total=sum(amounts, Decimal('0')), allocation_count=allocations,
+            )
+            budget_rows.append(budget)
+            allocation_rows.extend((budget, rng.choice(CATEGORIES), amount) for amount in amounts)
+        now = timezone.now()
+        for _ in range(incomes):
+            created_at = now - datetime.timedelta(days=rng.randrange(max(budgets, 1) * 30))
+            income_rows.append(IncomeSource(
+                user=user, source=rng.choice(INCOME_SOURCES), amount=Decimal(rng.randrange(500, 15_000)),
+                created_at=created_at,
+            ))
+
+    Budget.objects.bulk_create(budget_rows, batch_size=500)
+    # Names outside the defaults become each user's own categories, as typed in the form
+    categories = get_registry()
+    allocation_rows = Allocation.objects.bulk_create([
+        Allocation(budget=budget, category_id=categories.resolve(budget.user_id, category), amount=amount)
+        for budget, category, amount in allocation_rows
+    ], batch_size=500)
+    IncomeSource.objects.bulk_create(income_rows, batch_size=500)
+
+    # bulk_create sends no signals; rebuild what finance.signals would maintain
+    rebuild_rollups(Budget.objects.filter(user__in=created))
+    ledger = defaultdict(list)
+    for row in budget_rows:
+        ledger[row.user_id].append((Kind.BUDGET, row.pk, row.total_amount))
+    for row in allocation_rows:
+        ledger[row.budget.user_id].append((Kind.ALLOCATION, row.pk, row.amount))
+    for row in income_rows:
+        ledger[row.user_id].append((Kind.INCOME, row.pk, row.amount))
+    for user in created:
+        rebuild_stats(user)
+        append(user.pk, [(kind, Action.CREATED, pk, amount) for kind, pk, amount in ledger[user.pk]])
+    close_out()
+
+    budget_ids = {}
+    for budget in budget_rows:
+        budget_ids.setdefault(budget.user_id, []).append(budget.pk)
+    return [SeededUser(user.pk, user.email, budget_ids.get(user.pk, [])) for user in created]
+
+
+_signups = itertools.count()
+
+
+def _signup(client, user, rng):
+    n = next(_signups)
+    return client.post(reverse('accounts:signup'), {
+        'username': f'signup_{n:06d}', 'email': f'signup_{n:06d}@example.com',
+        'password1': PASSWORD, 'password2': PASSWORD,
+    })
+
+
+def _allocate(client, user, rng):
+    return client.post(reverse('finance:allocation_create', args=[rng.choice(user.budget_ids)]), {
+        'category': rng.choice(('Food', 'Transport', 'Rent', 'Entertainment')), 'amount': '1.00',
+    })
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    Scenario('dashboard', True, 200, lambda client, user, rng: client.get(reverse('finance:dashboard'))),
+    Scenario('budget_detail', True, 200, lambda client, user, rng: client.get(
+        reverse('finance:budget_detail', args=[rng.choice(user.budget_ids)]),
+    )),
+    Scenario('allocation_create', True, 302, _allocate),
+    Scenario('get_total_income', True, 200, lambda client, user, rng: client.get(reverse('finance:get_total_income'))),
+    Scenario('signup', False, 302, _signup),
+    Scenario('login', False, 302, lambda client, user, rng: client.post(
+        reverse('accounts:login'), {'email': user.email, 'password': PASSWORD},
+    )),
+)}
+
+
+def _percentile(ordered, percent):
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[rank - 1]
+
+
+def run_scenario(scenario, users, requests, concurrency=1, seed=0, warmup=1):
+    """Send ``requests`` requests for ``scenario`` from ``concurrency`` clients; returns a result row."""
+    install_query_recorder()
+    per_client = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    samples, errors = [], []
+    lock = threading.Lock()
+
+    def client_loop(index):
+        rng = random.Random(f'{seed}:{scenario.name}:{concurrency}:{index}')
+        user = users[index % len(users)]
+        client = Client()
+        if scenario.authenticated:
+            client.force_login(get_user_model().objects.get(pk=user.pk), backend='accounts.backends.EmailBackend')
+        for i in range(warmup + per_client[index]):
+            if not scenario.authenticated:
+                client = Client()
+            with measure() as metrics:
+                started = time.perf_counter()
+                response = scenario.request(client, user, rng)
+                finished = time.perf_counter()
+            if i < warmup:
+                continue
+            with lock:
+                samples.append((started, finished, metrics.queries))
+                if response.status_code != scenario.expected:
+                    errors.append(response.status_code)
+
+    def threaded(index):
+        try:
+            client_loop(index)
+        finally:
+            connections.close_all()
+
+    if concurrency == 1:
+        client_loop(0)
+    else:
+        threads = [threading.Thread(target=threaded, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Throughput over the measured requests only, not logins and warm-up
+    wall = max(end for _, end, _ in samples) - min(start for start, _, _ in samples)
+    latencies = sorted((end - start) * 1000 for start, end, _ in samples)
+    queries = [count for _, _, count in samples]
+    return {
+        'scenario': scenario.name,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_statuses': sorted(set(errors)),
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'latency_ms': {
+            **{f'p{p}': round(_percentile(latencies, p), 3) for p in PERCENTILES},
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries': {'mean': round(sum(queries) / len(queries), 2), 'max': max(queries)},
+    }
+
+
+def compare(baseline, current, threshold=20):
+    """
+    Yield ``(key, field, before, after, regressed)`` for the rows the two runs share.
+
+    p95 latency or throughput moving more than ``threshold`` percent the
+    wrong way counts as a regression. So does any increase in the mean
+    query count, because query counts do not depend on the machine.
+    """
+    before = {(row['scenario'], row['concurrency']): row for row in baseline['results']}
+    for row in current['results']:
+        key = (row['scenario'], row['concurrency'])
+        if key not in before:
+            continue
+        old = before[key]
+        limit = 1 + threshold / 100
+        yield key, 'p95_ms', old['latency_ms']['p95'], row['latency_ms']['p95'], row['latency_ms']['p95'] > old['latency_ms']['p95'] * limit
+        yield key, 'throughput_rps', old['throughput_rps'], row['throughput_rps'], row['throughput_rps'] * limit < old['throughput_rps']
+        yield key, 'queries', old['queries']['mean'], row['queries']['mean'], row['queries']['mean'] > old['queries']['mean']
@@ -0,0 +1,170 @@
+"""
+Per-user cache for dashboard and budget summaries.
+
+Entries are keyed by ``(user, name, part, version)``. Each user has a
+version number that ``finance.signals`` bumps whenever one of their
+budgets, allocations or income sources changes, so stale entries are
+never read again and simply age out of the backend.
+
+``settings.FINANCE_SUMMARY_CACHE`` selects the backend: the alias of any
+configured Django cache (``'default'``), or ``'lru'`` for a bounded
+in-process LRU (``FINANCE_SUMMARY_CACHE_SIZE`` entries). A version bump
+only reaches the workers that share the backend, so with several workers
+it must be a shared cache such as Redis or the file-based one; the
+``finance.E001`` check enforces this. The ``a``-prefixed methods serve
+the async views; they go through the backend's ``aget``/``aset`` so a
+file or network cache never blocks the event loop.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping with least-recently-used eviction."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # In-memory and never blocking, so the async API can call straight through
+    async def aget(self, key, default=None):
+        return self.get(key, default)
+
+    async def aset(self, key, value, timeout=None):
+        self.set(key, value, timeout)
+
+
+class SummaryCache:
+    def __init__(self, backend, timeout=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _version_key(self, user_id):
+        return f"finance:summary:{user_id}:version"
+
+    def version(self, user_id):
+        version = self.backend.get(self._version_key(user_id))
+        if version is None:
+            # Start from a fresh value so entries written under a version
+            # that was evicted can never match again
+            version = time.time_ns()
+            self.backend.set(self._version_key(user_id), version, self.timeout)
+        return version
+
+    def bump(self, user_id):
+        self.backend.set(self._version_key(user_id), time.time_ns(), self.timeout)
+
+    async def aversion(self, user_id):
+        version = await self.backend.aget(self._version_key(user_id))
+        if version is None:
+            version = time.time_ns()
+            await self.backend.aset(self._version_key(user_id), version, self.timeout)
+        return version
+
+    def _count(self, value):
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def get_or_compute(self, user_id, name, part, compute):
+        key = f"finance:summary:{user_id}:{self.version(user_id)}:{name}:{part}"
+        value = self.backend.get(key, _MISSING)
+        self._count(value)
+        if value is _MISSING:
+            value = compute()
+            self.backend.set(key, value, self.timeout)
+        return value
+
+    async def aget_or_compute(self, user_id, name, part, compute):
+        """Like ``get_or_compute`` with ``compute`` returning an awaitable."""
+        key = f"finance:summary:{user_id}:{await self.aversion(user_id)}:{name}:{part}"
+        value = await self.backend.aget(key, _MISSING)
+        self._count(value)
+        if value is _MISSING:
+            value = await compute()
+            await self.backend.aset(key, value, self.timeout)
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+def _build():
+    alias = getattr(settings, 'FINANCE_SUMMARY_CACHE', 'default')
+    timeout = getattr(settings, 'FINANCE_SUMMARY_CACHE_TIMEOUT', 3600)
+    if alias == 'lru':
+        backend = LRUCache(getattr(settings, 'FINANCE_SUMMARY_CACHE_SIZE', 2048))
+    else:
+        backend = caches[alias]
+    return SummaryCache(backend, timeout)
+
+
+_summary_cache = _build()
+
+
+@receiver(setting_changed)
+def _rebuild_on_settings_change(setting, **kwargs):
+    global _summary_cache
+    if setting.startswith('FINANCE_SUMMARY_CACHE') or setting == 'CACHES':
+        _summary_cache = _build()
+
+
+def get_summary_cache():
+    return _summary_cache
+
+
+def invalidate_user(user_id):
+    """Retire every cached summary for ``user_id``, now and again at commit."""
+    cache = get_summary_cache()
+    cache.bump(user_id)
+    # A reader that ran between the write and the commit may have cached
+    # pre-commit data under the new version; bump once more after commit
+    transaction.on_commit(lambda: cache.bump(user_id))
@@ -0,0 +1,209 @@
+"""
+Category dimension lookups.
+
+Allocations, category stats and snapshot lines point at ``Category`` rows
+by integer id. System categories have no user and are shared by everyone;
+a user's own entries are created the first time they type a new name.
+Names match case-insensitively, so "food" resolves to the system "Food".
+
+Every process keeps the id/name mapping in a ``CategoryRegistry``, so
+resolving a name or labelling a grouped row costs no query once warm. A
+registry is only valid for one version number, held in the
+``FINANCE_CATEGORY_CACHE`` cache, which every worker must share. Adding,
+renaming or deleting a category bumps it, and every process starts a
+fresh registry on its next lookup; adding one counts because registries
+keep each user's own categories for their forms. Rows read inside a
+transaction are only cached once it commits, so a rollback can never
+leave a dangling id behind.
+
+System categories are created by ``ensure_defaults``, which runs after
+every ``migrate``.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+DEFAULT_CATEGORIES = ('Food', 'Transport', 'Rent', 'Entertainment', 'Other')
+# The system category for anything that fits none of the others
+FALLBACK = 'Other'
+
+VERSION_KEY = 'finance:categories:version'
+
+
+def _key(name):
+    return name.strip().lower()
+
+
+def _when_committed(func):
+    if connection.in_atomic_block:
+        transaction.on_commit(func)
+    else:
+        func()
+
+
+class CategoryRegistry:
+    """One process's view of the category table at a given version."""
+
+    def __init__(self, version):
+        self.version = version
+        self._lock = threading.Lock()
+        self._names = {}
+        self._system = None
+        self._custom = {}
+
+    def _remember(self, rows, user_id=None):
+        def store():
+            with self._lock:
+                self._names.update(rows)
+                if user_id is not None:
+                    self._custom[user_id] = rows
+        _when_committed(store)
+
+    def system(self):
+        """Map lower-cased names of the system categories to their ids."""
+        if self._system is None:
+            from .models import Category
+
+            rows = list(Category.objects.filter(user=None).values_list('pk', 'name'))
+            with self._lock:
+                # Only migrations create these, so they are always committed
+                self._names.update(rows)
+                self._system = {_key(name): pk for pk, name in rows}
+        return self._system
+
+    def _custom_rows(self, user_id):
+        rows = self._custom.get(user_id)
+        if rows is None:
+            from .models import Category
+
+            rows = list(Category.objects.filter(user_id=user_id).values_list('pk', 'name'))
+            self._remember(rows, user_id)
+        return rows
+
+    def custom(self, user_id):
+        """Map lower-cased names of ``user_id``'s own categories to their ids."""
+        return {_key(name): pk for pk, name in self._custom_rows(user_id)}
+
+    def lookup(self, user_id, name):
+        """Return the id ``name`` means to ``user_id``, or None if there is no such category."""
+        key = _key(name)
+        pk = self.system().get(key)
+        if pk is None and user_id is not None:
+            pk = self.custom(user_id).get(key)
+        return pk
+
+    def resolve_many(self, user_id, names):
+        """Map each of ``names`` to its id for ``user_id``, creating their own categories in one insert."""
+        known = {**self.custom(user_id), **self.system()} if user_id is not None else self.system()
+        found = {name: known.get(_key(name)) for name in set(names)}
+        missing = {_key(name): name.strip() for name, pk in found.items() if pk is None}
+        if missing:
+            if user_id is None:
+                raise ValueError(f"No system categories named {sorted(missing.values())}")
+            from .models import Category
+
+            # A name another request added meanwhile is simply skipped
+            Category.objects.bulk_create(
+                [Category(user_id=user_id, name=name) for name in missing.values()], ignore_conflicts=True,
+            )
+            # Other processes hold this user's list without the new names
+            invalidate()
+            with self._lock:
+                self._custom.pop(user_id, None)
+            custom = self.custom(user_id)
+            found.update((name, custom[_key(name)]) for name, pk in found.items() if pk is None)
+        return found
+
+    def resolve(self, user_id, name):
+        """Like ``lookup``, creating ``user_id``'s own category when there is none."""
+        return self.resolve_many(user_id, [name])[name]
+
+    def names(self, ids):
+        """Map each of ``ids`` to its category name, loading unknown ones in one query."""
+        self.system()
+        missing = {pk for pk in ids if pk not in self._names}
+        found = {}
+        if missing:
+            from .models import Category
+
+            rows = list(Category.objects.filter(pk__in=missing).values_list('pk', 'name'))
+            self._remember(rows)
+            found = dict(rows)
+        return {pk: self._names.get(pk) or found.get(pk) for pk in ids}
+
+    def name(self, category_id):
+        return self.names([category_id])[category_id]
+
+    def choices(self, user_id):
+        """Category names ``user_id`` can pick: the defaults, then their own, alphabetically."""
+        system = self.system()
+        defaults = [name for name in DEFAULT_CATEGORIES if _key(name) in system]
+        own = [name for _, name in self._custom_rows(user_id)] if user_id is not None else []
+        return defaults + sorted(own, key=_key)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'FINANCE_CATEGORY_CACHE', 'default')]
+
+
+def get_registry():
+    """Return this process's registry, starting a new one if the shared version moved on."""
+    global _registry
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # add() so that processes racing here agree on one version
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    registry = _registry
+    if registry is None or registry.version != version:
+        with _registry_lock:
+            if _registry is None or _registry.version != version:
+                _registry = CategoryRegistry(version)
+            registry = _registry
+    return registry
+
+
+def invalidate():
+    """Retire every process's registry, now and again at commit."""
+    _cache().set(VERSION_KEY, time.time_ns(), None)
+    transaction.on_commit(lambda: _cache().set(VERSION_KEY, time.time_ns(), None))
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    global _registry
+    if setting in ('FINANCE_CATEGORY_CACHE', 'CACHES'):
+        _registry = None
+
+
+def ensure_defaults(using='default'):
+    """Create any missing system categories; returns how many were added."""
+    from .models import Category
+
+    existing = set(Category.objects.using(using).filter(user=None).values_list('name', flat=True))
+    missing = [Category(name=name) for name in DEFAULT_CATEGORIES if name not in existing]
+    Category.objects.using(using).bulk_create(missing, ignore_conflicts=True)
+    if missing:
+        invalidate()
+    return len(missing)
+
+
+def create_default_categories(app_config, using='default', apps=None, **kwargs):
+    """``post_migrate`` receiver; also restores the defaults after a test database flush."""
+    if apps is not None:
+        try:
+            apps.get_model('finance', 'Category')
+        except LookupError:
+            # Migrated back to before the category table existed
+            return
+    ensure_defaults(using)
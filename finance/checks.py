@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries live inside one process
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+# Settings naming a cache whose invalidations every worker must see
+SHARED_CACHE_SETTINGS = {'FINANCE_SUMMARY_CACHE': 'default', 'FINANCE_CATEGORY_CACHE': 'default'}
+
+
+def _per_process(alias):
+    if alias == 'lru':
+        return True
+    return settings.CACHES.get(alias, {}).get('BACKEND') in PER_PROCESS_CACHES
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    workers = getattr(settings, 'WORKER_PROCESSES', 1)
+    if workers <= 1:
+        return []
+    return [
+        Error(
+            f"{setting} uses the per-process cache {alias!r}, but {workers} workers serve the app: "
+            "changes made in one worker would leave the others serving stale data.",
+            hint="Set PESAPLAN_REDIS_URL, or point it at a cache every worker shares such as 'finance_files'.",
+            id='finance.E001',
+        )
+        for setting, default in SHARED_CACHE_SETTINGS.items()
+        if _per_process(alias := getattr(settings, setting, default))
+    ]
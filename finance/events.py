@@ -0,0 +1,18 @@
+"""
+Signals for finance writes that bypass ``post_save``.
+
+``bulk_create`` does not send model signals, so the batch write paths
+(bulk allocation entry, statement import, month rollover) send these
+instead. Receivers that keep derived data in step live in
+``finance.signals``.
+"""
+from django.dispatch import Signal
+
+# Sent with ``budget`` and the created ``allocations``.
+allocations_bulk_created = Signal()
+
+# Sent with ``user`` and the created ``incomes``.
+income_bulk_created = Signal()
+
+# Sent with the created ``budgets``, which may belong to many users.
+budgets_bulk_created = Signal()
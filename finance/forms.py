@@ -1,7 +1,13 @@
+import codecs
+import datetime
+
 from django import forms
-from .models import Budget, Allocation, IncomeSource
+from .categories import FALLBACK, get_registry
+from .models import ArchivedMonth, Budget, Allocation, IncomeSource
 
 class IncomeForm(forms.ModelForm):
+    recurring = forms.BooleanField(required=False, label="Add this again every month")
+
     class Meta:
         model = IncomeSource
         fields = ['source', 'amount']
@@ -20,13 +26,13 @@ class BudgetForm(forms.ModelForm):
             'total_amount': forms.NumberInput(attrs={'min': 0.01, 'step': 0.01}),
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, user=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.user = user
         self.fields['month'] = forms.CharField(widget=forms.HiddenInput(), required=False)
         if self.instance and self.instance.month:
-            year, month = self.instance.month.split('-')
-            self.initial['year_choice'] = year
-            self.initial['month_choice'] = f"{int(month):02d}"
+            self.initial['year_choice'] = str(self.instance.month.year)
+            self.initial['month_choice'] = f"{self.instance.month.month:02d}"
 
     def clean(self):
         cleaned_data = super().clean()
@@ -37,7 +43,15 @@ class BudgetForm(forms.ModelForm):
         if not month_choice or not year_choice:
             raise forms.ValidationError("Please select both a month and a year.")
         
-        cleaned_data['month'] = f"{year_choice}-{month_choice.zfill(2)}"
+        month = datetime.date(int(year_choice), int(month_choice), 1)
+        cleaned_data['month'] = month
+
+        if self.user is not None:
+            existing = Budget.objects.filter(user=self.user, month=month).exclude(pk=self.instance.pk)
+            if existing.exists():
+                raise forms.ValidationError(f"You already have a budget for {month:%B %Y}.")
+            if ArchivedMonth.objects.filter(user=self.user, month=month, budget_count__gt=0).exists():
+                raise forms.ValidationError(f"Your budget for {month:%B %Y} has been archived.")
 
         if total_amount is not None and total_amount <= 0:
             raise forms.ValidationError("Total amount must be positive.")
@@ -52,22 +66,25 @@ class BudgetForm(forms.ModelForm):
         return instance
 
 class AllocationForm(forms.ModelForm):
-    category = forms.ChoiceField(choices=[
-        ('Food', 'Food'), ('Transport', 'Transport'), ('Rent', 'Rent'),
-        ('Entertainment', 'Entertainment'), ('Other', 'Other (Custom)'),
-    ], required=True)
+    # Posted by name; clean() resolves it to a Category id for the owner
+    category = forms.ChoiceField(required=True, initial='Food')
     custom_category = forms.CharField(max_length=50, required=False, help_text="Enter custom category if 'Other' is selected")
+    field_order = ['category', 'custom_category', 'amount']
 
     class Meta:
         model = Allocation
-        fields = ['category', 'custom_category', 'amount']
+        fields = ['custom_category', 'amount']
         widgets = {
             'amount': forms.NumberInput(attrs={'min': 0, 'step': 0.01}),
         }
 
-    def __init__(self, *args, budget=None, **kwargs):
+    def __init__(self, *args, budget=None, user=None, category_choices=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.budget = budget
+        # Whose custom categories to offer, and to create a new one for
+        self.owner_id = user.pk if user is not None else budget.user_id if budget is not None else None
+        self.category_name = self.category_id = None
+        self.fields['category'].choices = category_choices or category_choices_for(self.owner_id)
 
     def clean(self):
         cleaned_data = super().clean()
@@ -75,25 +92,98 @@ class AllocationForm(forms.ModelForm):
         custom_category = cleaned_data.get('custom_category')
         amount = cleaned_data.get('amount')
 
-        if category == 'Other' and not custom_category:
+        if category == FALLBACK and not custom_category:
             raise forms.ValidationError("Please specify a custom category when selecting 'Other'")
-        if category != 'Other' and custom_category:
-            cleaned_data['custom_category'] = ''
+        # The custom text becomes a category of its own, not a second copy on the row
+        cleaned_data['custom_category'] = ''
 
         if amount and amount <= 0:
             raise forms.ValidationError("Amount must be positive")
 
         if self.budget and amount:
-            total_allocated = sum(alloc.amount for alloc in self.budget.allocations.all())
+            total_allocated = self.budget.allocated_total
             if total_allocated + amount > self.budget.total_amount:
                 raise forms.ValidationError(f"Total allocations ({total_allocated + amount} KSH) exceed budget ({self.budget.total_amount} KSH)")
 
+        self.category_name = custom_category if category == FALLBACK else category
         return cleaned_data
 
     def save(self, commit=True):
         instance = super().save(commit=False)
-        if self.cleaned_data['category'] == 'Other':
-            instance.category = self.cleaned_data['custom_category']
+        # Resolved only now, so a form that fails validation never creates a category
+        if self.category_id is None:
+            self.category_id = get_registry().resolve(self.owner_id, self.category_name)
+        instance.category_id = self.category_id
         if commit:
             instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+def category_choices_for(user_id):
+    names = [name for name in get_registry().choices(user_id) if name != FALLBACK]
+    return [(name, name) for name in names] + [(FALLBACK, 'Other (Custom)')]
+
+def resolve_categories(forms):
+    """Resolve the categories of valid ``AllocationForm``s with one lookup per owner."""
+    owners = {}
+    for form in forms:
+        owners.setdefault(form.owner_id, []).append(form)
+    for owner_id, owned in owners.items():
+        ids = get_registry().resolve_many(owner_id, [form.category_name for form in owned])
+        for form in owned:
+            form.category_id = ids[form.category_name]
+
+class StatementImportForm(forms.Form):
+    statement = forms.FileField(help_text="CSV export of a bank or M-Pesa statement")
+
+    def clean_statement(self):
+        statement = self.cleaned_data['statement']
+        # Chunks commit as the import goes, so decode the whole file first:
+        # a bad byte near the end must not leave it half imported
+        decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        try:
+            for chunk in statement.chunks():
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise forms.ValidationError("The statement is not UTF-8 text. Export it as CSV (UTF-8) and try again.")
+        statement.seek(0)
+        return statement
+
+class BaseAllocationFormSet(forms.BaseFormSet):
+    """Validates a batch of allocations against the budget in a single pass."""
+
+    def __init__(self, *args, budget=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        # Every row offers the same categories; look them up once
+        if 'category_choices' not in self.form_kwargs:
+            user = kwargs.get('user')
+            self.form_kwargs['category_choices'] = category_choices_for(user.pk if user is not None else None)
+        return {**kwargs, 'category_choices': self.form_kwargs['category_choices']}
+
+    def filled_forms(self):
+        return [form for form in self.forms if form.has_changed() and form.cleaned_data]
+
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        total = sum(form.cleaned_data['amount'] for form in self.filled_forms())
+        if not total:
+            raise forms.ValidationError("Enter at least one allocation.")
+        if self.budget and self.budget.allocated_total + total > self.budget.total_amount:
+            raise forms.ValidationError(
+                f"Total allocations ({self.budget.allocated_total + total} KSH) exceed budget ({self.budget.total_amount} KSH)"
+            )
+
+    def allocations(self):
+        forms = self.filled_forms()
+        resolve_categories(forms)
+        return [form.save(commit=False) for form in forms]
+
+AllocationFormSet = forms.formset_factory(
+    AllocationForm, formset=BaseAllocationFormSet, extra=10, max_num=50, validate_max=True,
+)
@@ -0,0 +1,228 @@
+"""
+Bulk import of bank / M-Pesa statement CSV exports.
+
+The file is read as a stream with ``csv.DictReader`` and processed in
+chunks of ``IMPORT_CHUNK_SIZE`` rows. Each chunk runs in its own
+transaction: it drops rows whose content hash was already imported, then
+inserts credits as ``IncomeSource`` rows and debits as ``Allocation`` rows
+with one ``bulk_create`` each. Only one chunk is held in memory at a time,
+and a failing chunk is rolled back without losing the chunks before it.
+
+Recognised layouts are M-Pesa statements (``Receipt No``, ``Completion
+Time``, ``Details``, ``Paid In``, ``Withdrawn``) and generic bank exports
+with a date, a description and either a signed ``Amount`` or separate
+credit/debit columns.
+"""
+import csv
+import datetime
+import hashlib
+import itertools
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .categories import FALLBACK, get_registry
+from .events import allocations_bulk_created, income_bulk_created
+from .models import Allocation, Budget, IncomeSource
+from .periods import month_start
+from .rollups import apply_allocation_delta
+
+IMPORT_CHUNK_SIZE = 1000
+
+COLUMN_ALIASES = {
+    'date': ('completion time', 'date', 'transaction date', 'value date', 'posting date'),
+    'description': ('details', 'description', 'narration', 'particulars'),
+    'amount': ('amount',),
+    'credit': ('paid in', 'credit', 'money in'),
+    'debit': ('withdrawn', 'debit', 'money out'),
+    'reference': ('receipt no.', 'receipt no', 'reference', 'ref'),
+    'status': ('transaction status', 'status'),
+}
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d-%m-%Y')
+
+# Keywords that route a debit to one of the AllocationForm categories
+CATEGORY_KEYWORDS = {
+    'Food': ('supermarket', 'restaurant', 'cafe', 'food', 'grocer', 'naivas', 'carrefour', 'quickmart'),
+    'Transport': ('uber', 'bolt', 'matatu', 'fuel', 'petrol', 'shell', 'total', 'fare', 'transport'),
+    'Rent': ('rent', 'landlord', 'housing', 'hostel'),
+    'Entertainment': ('netflix', 'showmax', 'cinema', 'spotify', 'bet', 'club'),
+}
+
+
+class StatementFormatError(ValueError):
+    pass
+
+
+@dataclass
+class ChunkReport:
+    index: int
+    rows: int = 0
+    incomes: int = 0
+    allocations: int = 0
+    duplicates: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+
+    def __str__(self):
+        return (
+            f"Chunk {self.index}: {self.rows} rows, {self.incomes} income, {self.allocations} allocations, "
+            f"{self.duplicates} duplicates, {len(self.errors)} errors"
+        )
+
+
+def resolve_columns(fieldnames):
+    """Map our column roles to the header names used by this statement."""
+    by_name = {name.strip().lower(): name for name in fieldnames or [] if name}
+    columns = {}
+    for role, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in by_name:
+                columns[role] = by_name[alias]
+                break
+    if 'date' not in columns or 'description' not in columns:
+        raise StatementFormatError("Statement needs a date and a description column.")
+    if 'amount' not in columns and not ('credit' in columns or 'debit' in columns):
+        raise StatementFormatError("Statement needs an amount column or credit/debit columns.")
+    return columns
+
+
+def parse_amount(value):
+    value = (value or '').strip().replace(',', '').replace('KES', '').replace('KSH', '').strip()
+    if not value:
+        return Decimal('0')
+    negative = value.startswith('(') and value.endswith(')')
+    amount = Decimal(value.strip('()'))
+    return -amount if negative else amount
+
+
+def parse_date(value):
+    value = (value or '').strip()
+    try:
+        # Fast path for ISO dates, which most statement exports use
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date '{value}'")
+
+
+def categorize(description):
+    lowered = description.lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return FALLBACK
+
+
+class StatementImporter:
+    def __init__(self, user, chunk_size=IMPORT_CHUNK_SIZE):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.tz = timezone.get_current_timezone()
+        self._budgets = None
+        # Identical lines are told apart by how many came before them in the
+        # file. The key includes the date, and statements need not be sorted
+        # by it, so the counts are kept for the whole run
+        self._occurrences = defaultdict(int)
+
+    def run(self, lines):
+        """Import an iterable of CSV text lines, yielding a ChunkReport per chunk."""
+        reader = csv.DictReader(lines)
+        columns = resolve_columns(reader.fieldnames)
+        self._budgets = {budget.month: budget for budget in Budget.objects.filter(user=self.user)}
+        numbered = enumerate(reader, start=2)  # line 1 is the header
+        for index in itertools.count(1):
+            chunk = list(itertools.islice(numbered, self.chunk_size))
+            if not chunk:
+                break
+            yield self._import_chunk(index, chunk, columns)
+
+    def _content_hash(self, row, columns, when, description, amount):
+        reference = (row.get(columns.get('reference')) or '').strip() if 'reference' in columns else ''
+        base = f"{self.user.pk}|{reference}|{when.isoformat()}|{description}|{amount}"
+        self._occurrences[base] += 1
+        return hashlib.sha256(f"{base}|{self._occurrences[base]}".encode()).hexdigest()
+
+    def _parse(self, row, columns):
+        if 'status' in columns and (row.get(columns['status']) or '').strip().lower() not in ('', 'completed'):
+            return None
+        when = parse_date(row.get(columns['date']))
+        description = (row.get(columns['description']) or '').strip()
+        if 'amount' in columns:
+            amount = parse_amount(row.get(columns['amount']))
+        else:
+            amount = parse_amount(row.get(columns.get('credit'))) - parse_amount(row.get(columns.get('debit')))
+        if not amount:
+            return None
+        return when, description, amount
+
+    def _import_chunk(self, index, chunk, columns):
+        report = ChunkReport(index=index, rows=len(chunk))
+        incomes, allocations = {}, {}
+        categories = get_registry()
+        for line, row in chunk:
+            try:
+                parsed = self._parse(row, columns)
+            except (ValueError, InvalidOperation) as exc:
+                report.errors.append((line, str(exc)))
+                continue
+            if parsed is None:
+                continue
+            when, description, amount = parsed
+            digest = self._content_hash(row, columns, when, description, amount)
+            created_at = when.replace(tzinfo=self.tz) if when.tzinfo is None else when
+            if amount > 0:
+                incomes[digest] = IncomeSource(
+                    user=self.user, source=description[:50] or 'Statement credit', amount=amount,
+                    created_at=created_at, import_hash=digest,
+                )
+                continue
+            budget = self._budgets.get(month_start(when))
+            if budget is None:
+                report.errors.append((line, f"No budget for {when:%B %Y}"))
+                continue
+            category = categorize(description)
+            allocations[digest] = Allocation(
+                budget_id=budget.pk, category_id=categories.resolve(self.user.pk, category), amount=-amount,
+                import_hash=digest, custom_category=description[:50] if category == FALLBACK else '',
+            )
+
+        try:
+            with transaction.atomic():
+                self._insert(report, incomes, allocations)
+        except DatabaseError as exc:
+            report.incomes = report.allocations = report.duplicates = 0
+            report.errors.append((chunk[0][0], f"Chunk rolled back: {exc}"))
+        return report
+
+    def _insert(self, report, incomes, allocations):
+        if incomes:
+            seen = set(IncomeSource.objects.filter(user=self.user, import_hash__in=list(incomes))
+                       .values_list('import_hash', flat=True))
+            new = [income for digest, income in incomes.items() if digest not in seen]
+            created = IncomeSource.objects.bulk_create(new, batch_size=self.chunk_size)
+            report.incomes, report.duplicates = len(created), report.duplicates + len(seen)
+            if created:
+                income_bulk_created.send(sender=IncomeSource, user=self.user, incomes=created)
+
+        if allocations:
+            seen = set(Allocation.objects.filter(budget__user=self.user, import_hash__in=list(allocations))
+                       .values_list('import_hash', flat=True))
+            new = [allocation for digest, allocation in allocations.items() if digest not in seen]
+            created = Allocation.objects.bulk_create(new, batch_size=self.chunk_size)
+            report.allocations, report.duplicates = len(created), report.duplicates + len(seen)
+            by_budget = defaultdict(list)
+            for allocation in created:
+                by_budget[allocation.budget_id].append(allocation)
+            budgets = {budget.pk: budget for budget in self._budgets.values()}
+            for budget_id, rows in by_budget.items():
+                # Statement debits record real spending, so they are not capped by admission control
+                apply_allocation_delta(budget_id, sum(row.amount for row in rows), len(rows))
+                allocations_bulk_created.send(sender=Allocation, budget=budgets[budget_id], allocations=rows)
@@ -0,0 +1,222 @@
+"""
+Append-only ledger of every change to a user's money.
+
+The receivers in ``finance.signals`` append a ``LedgerEntry`` whenever an
+income source, budget or allocation is created, changed or deleted, in
+the same transaction as the write. An entry holds the signed change to
+the user's total of its kind, so summing a user's entries gives their
+totals at any point in their history. Entries are numbered 1, 2, 3, ...
+per user. The unique ``(user, seq)`` constraint turns two concurrent
+appends into a retry, so the numbering has no gaps.
+
+Every ``FINANCE_LEDGER_CHECKPOINT_EVERY`` entries a ``LedgerCheckpoint``
+records the running totals. ``balance`` reads the nearest checkpoint
+plus the entries after it, so the current or any past balance costs two
+queries over at most one interval of entries, however long the history.
+Checkpoints are written after the entry that completes an interval
+commits. A checkpoint that is missed, e.g. because the process died, is
+written with the next one.
+
+``replay`` sums the whole ledger without checkpoints, and ``find_drift``
+compares it with the live rows. Entries are stamped when they are
+written; imported income keeps its statement date on the row, not here.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import Allocation, ArchivedMonth, Budget, IncomeSource, LedgerCheckpoint, LedgerEntry
+
+Kind = LedgerEntry.Kind
+Action = LedgerEntry.Action
+
+# Attempts made when another request takes the same sequence number
+APPEND_RETRIES = 5
+
+ZERO = Decimal('0.00')
+
+
+class Balance(namedtuple('Balance', 'seq recorded_at income allocated budgeted')):
+    """A user's totals as of ledger entry ``seq``."""
+
+    @property
+    def savings(self):
+        return self.income - self.allocated
+
+    def apply(self, kind, amount):
+        field = {Kind.INCOME: 'income', Kind.ALLOCATION: 'allocated', Kind.BUDGET: 'budgeted'}[kind]
+        return self._replace(**{field: getattr(self, field) + amount})
+
+
+OPENING = Balance(0, None, ZERO, ZERO, ZERO)
+
+
+def checkpoint_interval():
+    return getattr(settings, 'FINANCE_LEDGER_CHECKPOINT_EVERY', 256)
+
+
+def append(user_id, changes):
+    """
+    Append ``changes``, ``(kind, action, object_id, amount)`` tuples, to
+    ``user_id``'s ledger and return the new entries.
+    """
+    changes = list(changes)
+    if not changes:
+        return []
+    for attempt in range(APPEND_RETRIES):
+        try:
+            with transaction.atomic():
+                last = (
+                    LedgerEntry.objects.filter(user_id=user_id)
+                    .order_by('-seq').values_list('seq', 'recorded_at').first()
+                )
+                seq, previous = last or (0, None)
+                recorded_at = timezone.now()
+                if previous is not None and previous > recorded_at:
+                    recorded_at = previous
+                entries = LedgerEntry.objects.bulk_create([
+                    LedgerEntry(
+                        user_id=user_id, seq=seq + offset, kind=kind, action=action,
+                        object_id=object_id, amount=amount, recorded_at=recorded_at,
+                    )
+                    for offset, (kind, action, object_id, amount) in enumerate(changes, 1)
+                ])
+            break
+        except IntegrityError:
+            if attempt == APPEND_RETRIES - 1:
+                raise
+    every = checkpoint_interval()
+    if (seq + len(entries)) // every > seq // every:
+        transaction.on_commit(partial(write_checkpoints, user_id))
+    return entries
+
+
+def recorded_amount(user_id, kind, object_id):
+    """The amount the ledger holds for one row: the sum of its entries."""
+    total = LedgerEntry.objects.filter(user_id=user_id, kind=kind, object_id=object_id).aggregate(total=Sum('amount'))
+    return total['total'] or ZERO
+
+
+def record_saved(user_id, kind, instance, amount, created):
+    """Append the entry for a saved row whose amount is now ``amount``."""
+    if created:
+        change = (kind, Action.CREATED, instance.pk, amount)
+    else:
+        previous = getattr(instance, '_ledger_amount', None)
+        if previous is None:
+            # Saved without having been loaded; the ledger knows what it was
+            previous = recorded_amount(user_id, kind, instance.pk)
+        if amount == previous:
+            instance._ledger_amount = amount
+            return
+        change = (kind, Action.CHANGED, instance.pk, amount - previous)
+    append(user_id, [change])
+    instance._ledger_amount = amount
+
+
+def record_deleted(user_id, kind, instance, amount):
+    previous = getattr(instance, '_ledger_amount', amount)
+    append(user_id, [(kind, Action.DELETED, instance.pk, -previous)])
+
+
+def record_created(user_id, kind, instances, field='amount'):
+    """Append one entry per row of a ``bulk_create``, whose amounts are in ``field``."""
+    append(user_id, [(kind, Action.CREATED, instance.pk, getattr(instance, field)) for instance in instances])
+    for instance in instances:
+        instance._ledger_amount = getattr(instance, field)
+
+
+def _checkpoint_balance(checkpoint):
+    return Balance(checkpoint.seq, checkpoint.recorded_at, checkpoint.income, checkpoint.allocated, checkpoint.budgeted)
+
+
+def write_checkpoints(user_id):
+    """Write every checkpoint due after ``user_id``'s latest one; returns how many."""
+    every = checkpoint_interval()
+    latest = LedgerCheckpoint.objects.filter(user_id=user_id).order_by('-seq').first()
+    running = _checkpoint_balance(latest) if latest else OPENING
+    entries = (
+        LedgerEntry.objects.filter(user_id=user_id, seq__gt=running.seq)
+        .order_by('seq').values_list('seq', 'recorded_at', 'kind', 'amount')
+    )
+    checkpoints = []
+    for seq, recorded_at, kind, amount in entries.iterator():
+        if seq != running.seq + 1:
+            # Never fold past a gap
+            break
+        running = running.apply(kind, amount)._replace(seq=seq, recorded_at=recorded_at)
+        if seq % every == 0:
+            checkpoints.append(LedgerCheckpoint(user_id=user_id, **running._asdict()))
+    # A concurrent writer may have written the same ones
+    LedgerCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
+    return len(checkpoints)
+
+
+def rebuild_checkpoints(user_id):
+    """Drop ``user_id``'s checkpoints and write them again from the entries."""
+    with transaction.atomic():
+        LedgerCheckpoint.objects.filter(user_id=user_id).delete()
+        return write_checkpoints(user_id)
+
+
+def _fold(result, entries):
+    """Add ``entries`` to the ``Balance`` ``result`` in one grouped query."""
+    rows = entries.values('kind').annotate(total=Sum('amount'), last=Max('seq'), at=Max('recorded_at')).order_by()
+    for row in rows:
+        result = result.apply(row['kind'], row['total'])
+        if row['last'] > result.seq:
+            result = result._replace(seq=row['last'], recorded_at=row['at'])
+    return result
+
+
+def balance(user_id, at=None):
+    """
+    Return ``user_id``'s ``Balance`` now, or as of the datetime ``at``.
+
+    Reads the nearest checkpoint and sums the entries after it.
+    """
+    checkpoints = LedgerCheckpoint.objects.filter(user_id=user_id)
+    entries = LedgerEntry.objects.filter(user_id=user_id)
+    if at is not None:
+        checkpoints = checkpoints.filter(recorded_at__lte=at)
+        entries = entries.filter(recorded_at__lte=at)
+    latest = checkpoints.order_by('-seq').first()
+    result = OPENING
+    if latest is not None:
+        result = _checkpoint_balance(latest)
+        # Entries are in time order too, so this bounds the scan to the tail
+        entries = entries.filter(seq__gt=latest.seq, recorded_at__gte=latest.recorded_at)
+    return _fold(result, entries)
+
+
+def replay(user_id, upto=None):
+    """Sum ``user_id``'s whole ledger, up to entry ``upto``, ignoring checkpoints."""
+    entries = LedgerEntry.objects.filter(user_id=user_id)
+    if upto is not None:
+        entries = entries.filter(seq__lte=upto)
+    return _fold(OPENING, entries)
+
+
+def live_totals(user_id):
+    """``(income, allocated, budgeted)`` summed from the rows themselves, archived months included."""
+    def total(queryset, field):
+        return queryset.aggregate(total=Sum(field))['total'] or ZERO
+
+    archived = ArchivedMonth.objects.filter(user_id=user_id)
+    return (
+        total(IncomeSource.objects.filter(user_id=user_id), 'amount') + total(archived, 'income'),
+        total(Allocation.objects.filter(budget__user_id=user_id), 'amount') + total(archived, 'allocated'),
+        total(Budget.objects.filter(user_id=user_id), 'total_amount') + total(archived, 'budgeted'),
+    )
+
+
+def find_drift(user_id):
+    """Return ``{field: (ledger, live)}`` for every total the ledger disagrees with the rows on."""
+    ledger = replay(user_id)
+    live = dict(zip(('income', 'allocated', 'budgeted'), live_totals(user_id)))
+    return {field: (getattr(ledger, field), value) for field, value in live.items() if getattr(ledger, field) != value}
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from finance.archive import archive_horizon, archive_user
+from finance.periods import add_months, parse_month
+
+
+class Command(BaseCommand):
+    help = (
+        "Move closed months older than the archive horizon out of the budget, allocation and income tables "
+        "into compressed per-user archive files. Safe to re-run; run several at once over disjoint "
+        "--from-user/--to-user ranges."
+    )
+
+    def add_arguments(self, parser):
+        horizon = parser.add_mutually_exclusive_group()
+        horizon.add_argument('--before', help="Archive months before this one, as YYYY-MM.")
+        horizon.add_argument('--months', type=int, help="Keep this many recent months hot. "
+                             "Defaults to FINANCE_ARCHIVE_AFTER_MONTHS.")
+        parser.add_argument('--user', type=int, help="Only archive this user id.")
+        parser.add_argument('--from-user', type=int, help="Lowest user id of this shard.")
+        parser.add_argument('--to-user', type=int, help="Highest user id of this shard.")
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = parse_month(options['before'])
+            except ValueError:
+                raise CommandError(f"Invalid --before {options['before']!r}; expected YYYY-MM")
+        elif options['months'] is not None:
+            before = add_months(timezone.localdate().replace(day=1), -options['months'])
+        else:
+            before = archive_horizon()
+
+        users = get_user_model().objects.order_by('pk')
+        if options['user'] is not None:
+            users = users.filter(pk=options['user'])
+        if options['from_user'] is not None:
+            users = users.filter(pk__gte=options['from_user'])
+        if options['to_user'] is not None:
+            users = users.filter(pk__lte=options['to_user'])
+
+        archived = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            months = archive_user(user_id, before)
+            if months:
+                self.stdout.write(f"User {user_id}: archived {months} month(s).")
+            archived += months
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} month(s) before {before:%Y-%m}."))
@@ -0,0 +1,129 @@
+import json
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.utils import timezone
+
+from finance.benchmarks import SCENARIOS, compare, run_scenario, seed_dataset
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and measure latency percentiles, throughput and queries per request "
+        "for the main finance and accounts flows. Writes the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--budgets', type=int, default=12, help="Monthly budgets per user.")
+        parser.add_argument('--allocations', type=int, default=8, help="Allocations per budget.")
+        parser.add_argument('--incomes', type=int, default=24, help="Income sources per user.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                            help="Flow to measure; repeat for several. Defaults to all of them.")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario and concurrency level.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], help="Concurrent clients; one run per level.")
+        parser.add_argument('--warmup', type=int, default=1, help="Unmeasured requests per client before timing starts.")
+        parser.add_argument('--output', help="JSON file to write. Defaults to var/benchmarks/<time>-<commit>.json.")
+        parser.add_argument('--compare', metavar='BASELINE', help="Earlier results file to diff against.")
+        parser.add_argument('--threshold', type=float, default=20,
+                            help="Percent change in p95 latency or throughput counted as a regression.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read {options['compare']}: {exc}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+                # The default in-memory test database takes table-level locks
+                # across threads; use a file so concurrency behaves as in production
+                connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+            old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'}, serialized_aliases=set())
+            try:
+                # Production-like: no query log, no sampling, and the test client's host
+                # allowed. Login throttling is off since every client shares one address
+                with override_settings(
+                    DEBUG=False, PERF_SAMPLE_RATE=0, ACCOUNTS_RATELIMIT_ENABLED=False,
+                    ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                ):
+                    results = self.run(options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        output = Path(options['output'] or settings.BASE_DIR / 'var' / 'benchmarks' / (
+            f"{results['meta']['started']:%Y%m%d-%H%M%S}-{results['meta']['commit'] or 'nogit'}.json"
+        ))
+        results['meta']['started'] = results['meta']['started'].isoformat()
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output}"))
+
+        if baseline:
+            self.report_changes(baseline, results, options['threshold'])
+
+    def run(self, options):
+        started = timezone.now()
+        users = seed_dataset(options['users'], options['budgets'], options['allocations'], options['incomes'], options['seed'])
+        self.stdout.write(f"Seeded {len(users)} users in {(timezone.now() - started).total_seconds():.1f}s")
+
+        rows = []
+        for name in options['scenario'] or SCENARIOS:
+            for concurrency in options['concurrency']:
+                row = run_scenario(SCENARIOS[name], users, options['requests'], concurrency, options['seed'], options['warmup'])
+                latency = row['latency_ms']
+                self.stdout.write(
+                    f"{name:18} x{concurrency:<3} {row['throughput_rps']:8.1f} req/s  p50 {latency['p50']:8.2f} ms  "
+                    f"p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms  queries {row['queries']['mean']:5.1f}  "
+                    f"errors {row['errors']}"
+                )
+                rows.append(row)
+
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'started': started,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'session_engine': settings.SESSION_ENGINE.rsplit('.', 1)[-1],
+                'user_cache': settings.ACCOUNTS_USER_CACHE,
+                'dataset': {key: options[key] for key in ('users', 'budgets', 'allocations', 'incomes', 'seed')},
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+            },
+            'results': rows,
+        }
+
+    def report_changes(self, baseline, results, threshold):
+        self.stdout.write(f"Compared with {baseline['meta'].get('commit') or 'baseline'}:")
+        regressions = 0
+        for (name, concurrency), field, before, after, regressed in compare(baseline, results, threshold):
+            change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+            line = f"  {name:18} x{concurrency:<3} {field:15} {before:>10} -> {after:<10} {change}"
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f"{line}  REGRESSION"))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"{regressions} regression(s) beyond {threshold:g}%")
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.exports import DATASETS, EXPORT_CHUNK_SIZE, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream budgets, allocations and income to CSV or JSONL files without loading them into memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--dataset', choices=sorted(DATASETS), action='append',
+                            help="Dataset to export; repeat for several. Defaults to all of them.")
+        parser.add_argument('--user', type=int, help="Only export this user id.")
+        parser.add_argument('--output-dir', default='.', help="Directory the export files are written to.")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--archived', action='store_true', help="Include the rows of archived months.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user'] is not None:
+            try:
+                user = get_user_model().objects.get(pk=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        prefix = f"user-{user.pk}-" if user else ''
+        fmt = options['format']
+
+        for dataset in options['dataset'] or list(DATASETS):
+            path = output_dir / f"{prefix}{dataset}.{fmt}"
+            rows = 0
+            with path.open('w', newline='', encoding='utf-8') as handle:
+                for line in export_lines(
+                    dataset, fmt, user=user, chunk_size=options['chunk_size'], archived=options['archived'],
+                ):
+                    handle.write(line)
+                    rows += 1
+            if fmt == 'csv':
+                rows -= 1  # header
+            self.stdout.write(f"Wrote {rows} {dataset} rows to {path}")
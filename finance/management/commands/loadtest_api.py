@@ -0,0 +1,140 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+
+DEFAULT_PATHS = ('finance:api_dashboard', 'finance:api_income_total', 'finance:get_total_income')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the finance read endpoints under the WSGI and ASGI handlers in-process, with every client "
+        "holding its connection for --latency ms while the response drains, as a slow mobile network would."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help="Id or email of the user the requests log in as.")
+        parser.add_argument('--path', action='append', help="URL to request; repeat for several. Defaults to the JSON read endpoints.")
+        parser.add_argument('--clients', type=int, default=200, help="Concurrent clients.")
+        parser.add_argument('--requests', type=int, default=5, help="Requests per client.")
+        parser.add_argument('--latency', type=float, default=200, help="Milliseconds each client takes to read a response.")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument('--host', default='localhost')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'email__iexact': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        client = Client()
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        paths = options['path'] or [reverse(name) for name in DEFAULT_PATHS]
+        total = options['clients'] * options['requests']
+        plan = [paths[i % len(paths)] for i in range(total)]
+        latency = options['latency'] / 1000
+
+        for name, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+            started = time.perf_counter()
+            timings, statuses, peak_threads = run(plan, cookie, latency, options)
+            elapsed = time.perf_counter() - started
+            timings.sort()
+            bad = sum(status != 200 for status in statuses)
+            self.stdout.write(
+                f"{name}: {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s), "
+                f"p50 {statistics.median(timings) * 1000:.0f} ms, p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.0f} ms, "
+                f"peak server threads {peak_threads}, non-200 responses {bad}"
+            )
+
+    def run_wsgi(self, plan, cookie, latency, options):
+        handler = get_wsgi_application()
+
+        def serve(path):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': options['host'],
+                'SERVER_PORT': '80', 'HTTP_HOST': options['host'], 'HTTP_COOKIE': cookie, 'wsgi.input': BytesIO(),
+                'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+            }
+            status = []
+            b''.join(handler(environ, lambda s, headers: status.append(int(s.split()[0]))))
+            # A sync worker is held while the response trickles out to the client
+            time.sleep(latency)
+            return status[0]
+
+        # Clients queue for the fixed pool of worker threads, as behind gunicorn
+        with ThreadPoolExecutor(max_workers=options['threads']) as workers:
+            def client(paths):
+                results = []
+                for path in paths:
+                    started = time.perf_counter()
+                    status = workers.submit(serve, path).result()
+                    results.append((time.perf_counter() - started, status))
+                return results
+
+            with ThreadPoolExecutor(max_workers=options['clients']) as clients:
+                results = [r for chunk in clients.map(client, self.per_client(plan, options)) for r in chunk]
+        return [r[0] for r in results], [r[1] for r in results], options['threads']
+
+    def run_asgi(self, plan, cookie, latency, options):
+        application = get_asgi_application()
+        peak = [0]
+
+        async def request(path):
+            started = time.perf_counter()
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', options['host'].encode()), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 50000), 'server': (options['host'], 80),
+            }
+            done = asyncio.Event()
+            sent = [False]
+            status = []
+
+            async def receive():
+                if not sent[0]:
+                    sent[0] = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    # The event loop serves other clients while this one reads
+                    await asyncio.sleep(latency)
+                    done.set()
+
+            await application(scope, receive, send)
+            peak[0] = max(peak[0], threading.active_count())
+            return time.perf_counter() - started, status[0]
+
+        async def client(paths):
+            return [await request(path) for path in paths]
+
+        async def main():
+            chunks = self.per_client(plan, options)
+            return [result for results in await asyncio.gather(*(client(chunk) for chunk in chunks)) for result in results]
+
+        baseline = threading.active_count()
+        results = asyncio.run(main())
+        # Django runs sync middleware and ORM calls in per-request executor threads
+        return [r[0] for r in results], [r[1] for r in results], peak[0] - baseline
+
+    @staticmethod
+    def per_client(plan, options):
+        return [plan[i:i + options['requests']] for i in range(0, len(plan), options['requests'])]
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.models import Budget
+from finance.rollups import find_drift, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute Budget.allocated_total / allocation_count from the allocation rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Report drifted budgets without fixing them.")
+        parser.add_argument('--user', type=int, help="Only process budgets owned by this user id.")
+
+    def handle(self, *args, **options):
+        budgets = Budget.objects.all()
+        if options['user']:
+            budgets = budgets.filter(user_id=options['user'])
+
+        if options['check']:
+            drifted = list(find_drift(budgets))
+            for budget, total, count in drifted:
+                self.stdout.write(
+                    f"Budget {budget.pk}: stored {budget.allocated_total}/{budget.allocation_count}, "
+                    f"expected {total}/{count}"
+                )
+            if drifted:
+                raise CommandError(f"{len(drifted)} budget rollup(s) out of date")
+            self.stdout.write(self.style.SUCCESS("All budget rollups are consistent."))
+            return
+
+        fixed = rebuild_rollups(budgets)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {fixed} budget rollup(s)."))
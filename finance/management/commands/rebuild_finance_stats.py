@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from finance.suggestions import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute UserFinanceStats / CategoryStat rows behind budget suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only process this user id.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['user']:
+            users = users.filter(pk=options['user'])
+        count = 0
+        for user in users.iterator():
+            rebuild_stats(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt finance stats for {count} user(s)."))
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.ledger import find_drift, rebuild_checkpoints
+
+
+class Command(BaseCommand):
+    help = "Rewrite ledger checkpoints from the ledger entries, or check the ledger against the live rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Report users whose ledger disagrees with their rows.")
+        parser.add_argument('--user', type=int, help="Only process this user id.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+        if options['user']:
+            users = users.filter(pk=options['user'])
+
+        if options['check']:
+            drifted = 0
+            for user_id in users.iterator():
+                drift = find_drift(user_id)
+                for field, (ledger, live) in drift.items():
+                    self.stdout.write(f"User {user_id}: ledger {field} {ledger}, rows {live}")
+                drifted += bool(drift)
+            if drifted:
+                raise CommandError(f"{drifted} user ledger(s) disagree with their rows")
+            self.stdout.write(self.style.SUCCESS("Every ledger matches its rows."))
+            return
+
+        written = sum(rebuild_checkpoints(user_id) for user_id in users.iterator())
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} ledger checkpoint(s)."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.periods import parse_month
+from finance.rollover import ROLLOVER_BATCH_SIZE, roll_over
+from finance.snapshots import current_month
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a month's budgets, allocations and income from users' recurring templates, in batches. "
+        "Safe to re-run; run several at once over disjoint --from-user/--to-user ranges."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Month to create, as YYYY-MM. Defaults to the current month.")
+        parser.add_argument('--from-user', type=int, help="Lowest user id of this shard.")
+        parser.add_argument('--to-user', type=int, help="Highest user id of this shard.")
+        parser.add_argument('--after', type=int, help="Resume after this user id, as last reported by a stopped run.")
+        parser.add_argument('--batch-size', type=int, default=ROLLOVER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            month = parse_month(options['month']) if options['month'] else current_month()
+        except ValueError:
+            raise CommandError(f"Invalid --month {options['month']!r}; expected YYYY-MM")
+
+        totals = [0, 0, 0, 0]
+        batches = roll_over(
+            month, options['from_user'], options['to_user'], options['after'], options['batch_size'],
+        )
+        for batch in batches:
+            totals = [total + value for total, value in zip(totals, batch[:4])]
+            self.stdout.write(
+                f"Up to user {batch.last_user_id}: {batch.budgets} budget(s), "
+                f"{batch.allocations} allocation(s), {batch.incomes} income(s) for {batch.users} user(s)."
+            )
+        users, budgets, allocations, incomes = totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled {month:%Y-%m} over for {users} user(s): {budgets} budget(s), "
+            f"{allocations} allocation(s), {incomes} income(s)."
+        ))
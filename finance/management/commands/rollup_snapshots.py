@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finance.models import MonthlySnapshot
+from finance.snapshots import DRAIN_BATCH_SIZE, close_out, drain_changes
+
+
+class Command(BaseCommand):
+    help = "Snapshot ended months and rebuild snapshots queued as stale, once or on a polling loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help="Keep running, polling the change queue at this interval.")
+        parser.add_argument('--batch-size', type=int, default=DRAIN_BATCH_SIZE)
+        parser.add_argument('--rebuild', action='store_true', help="Drop every snapshot and close out all months again.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            MonthlySnapshot.objects.all().delete()
+        while True:
+            months, built = close_out()
+            if months:
+                self.stdout.write(f"Closed out {months} month(s) into {built} snapshot(s).")
+            drained = 0
+            while handled := drain_changes(options['batch_size']):
+                drained += handled
+            if drained:
+                self.stdout.write(f"Rebuilt snapshots for {drained} queued change(s).")
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
+        self.stdout.write(self.style.SUCCESS("Snapshots are up to date."))
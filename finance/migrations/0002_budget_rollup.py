@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:09
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rollups(apps, schema_editor):
+    Allocation = apps.get_model('finance', 'Allocation')
+    Budget = apps.get_model('finance', 'Budget')
+    rows = Allocation.objects.values('budget_id').annotate(total=Sum('amount'), count=Count('id')).order_by()
+    for row in rows.iterator():
+        Budget.objects.filter(pk=row['budget_id']).update(
+            allocated_total=row['total'], allocation_count=row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='allocated_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='allocation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def parse_month(budget):
+    try:
+        year, month = budget.month.strip().split('-')[:2]
+        return datetime.date(int(year), int(month), 1)
+    except (AttributeError, ValueError):
+        # Unparseable legacy value: fall back to the month it was created in
+        return budget.created_at.date().replace(day=1)
+
+
+def months_to_dates(apps, schema_editor):
+    Budget = apps.get_model('finance', 'Budget')
+    Allocation = apps.get_model('finance', 'Allocation')
+
+    for budget in Budget.objects.only('pk', 'month', 'created_at').iterator():
+        Budget.objects.filter(pk=budget.pk).update(period=parse_month(budget))
+
+    # (user, month) becomes unique: fold older duplicates into the newest
+    # budget. Their totals add up and their allocations move across, so no
+    # money goes missing even though the merge itself cannot be undone
+    duplicates = (
+        Budget.objects.values('user_id', 'period')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        budgets = list(
+            Budget.objects.filter(user_id=row['user_id'], period=row['period']).order_by('-created_at', '-pk')
+        )
+        keep, stale = budgets[0], budgets[1:]
+        Allocation.objects.filter(budget__in=stale).update(budget=keep)
+        Budget.objects.filter(pk__in=[b.pk for b in stale]).delete()
+        totals = Allocation.objects.filter(budget=keep).aggregate(total=Sum('amount'), count=Count('id'))
+        Budget.objects.filter(pk=keep.pk).update(
+            total_amount=sum(budget.total_amount for budget in budgets),
+            allocated_total=totals['total'] or 0, allocation_count=totals['count'],
+        )
+
+
+def dates_to_months(apps, schema_editor):
+    Budget = apps.get_model('finance', 'Budget')
+    for budget in Budget.objects.only('pk', 'period').iterator():
+        Budget.objects.filter(pk=budget.pk).update(month=budget.period.strftime('%Y-%m'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_budget_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='period',
+            field=models.DateField(null=True),
+        ),
+        # Nullable so that unapplying RemoveField can restore the column before it is refilled
+        migrations.AlterField(
+            model_name='budget',
+            name='month',
+            field=models.CharField(max_length=7, null=True),
+        ),
+        migrations.RunPython(months_to_dates, dates_to_months),
+        migrations.RemoveField(
+            model_name='budget',
+            name='month',
+        ),
+        migrations.RenameField(
+            model_name='budget',
+            old_name='period',
+            new_name='month',
+        ),
+        migrations.AlterField(
+            model_name='budget',
+            name='month',
+            field=models.DateField(help_text='First day of the budgeted month'),
+        ),
+        migrations.AddConstraint(
+            model_name='budget',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='finance_budget_user_month_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['user', '-created_at'], name='budget_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incomesource',
+            index=models.Index(fields=['user', 'created_at'], name='income_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:18
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0004_budget_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocation',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='incomesource',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='incomesource',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='allocation',
+            constraint=models.UniqueConstraint(fields=('budget', 'import_hash'), name='finance_allocation_import_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='incomesource',
+            constraint=models.UniqueConstraint(fields=('user', 'import_hash'), name='finance_income_import_uniq'),
+        ),
+    ]
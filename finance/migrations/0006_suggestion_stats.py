@@ -0,0 +1,78 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    Budget = apps.get_model('finance', 'Budget')
+    Allocation = apps.get_model('finance', 'Allocation')
+    IncomeSource = apps.get_model('finance', 'IncomeSource')
+    UserFinanceStats = apps.get_model('finance', 'UserFinanceStats')
+    CategoryStat = apps.get_model('finance', 'CategoryStat')
+
+    stats = {}
+
+    def row(user_id):
+        return stats.setdefault(user_id, UserFinanceStats(user_id=user_id))
+
+    for item in Budget.objects.values('user_id').annotate(total=Sum('total_amount'), count=Count('id')):
+        row(item['user_id']).budget_total = item['total']
+        row(item['user_id']).budget_count = item['count']
+    for item in IncomeSource.objects.values('user_id').annotate(total=Sum('amount'), count=Count('id')):
+        row(item['user_id']).income_total = item['total']
+        row(item['user_id']).income_count = item['count']
+    categories = []
+    for item in Allocation.objects.values('budget__user_id', 'category').annotate(
+        total=Sum('amount'), count=Count('id'),
+    ):
+        stat = row(item['budget__user_id'])
+        stat.allocated_total += item['total']
+        categories.append(CategoryStat(
+            user_id=item['budget__user_id'], category=item['category'], total=item['total'], count=item['count'],
+        ))
+    UserFinanceStats.objects.bulk_create(stats.values(), batch_size=500)
+    CategoryStat.objects.bulk_create(categories, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_import_hashes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserFinanceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('budget_count', models.PositiveIntegerField(default=0)),
+                ('budget_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('income_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('income_count', models.PositiveIntegerField(default=0)),
+                ('allocated_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='finance_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CategoryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-total'], name='categorystat_user_total_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='categorystat',
+            constraint=models.UniqueConstraint(fields=('user', 'category'), name='finance_categorystat_user_category_uniq'),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.14 on 2026-10-18 13:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_suggestion_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('budgeted', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('allocated', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('savings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlySnapshotCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='finance.monthlysnapshot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SnapshotChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlysnapshot',
+            index=models.Index(fields=['month'], name='snapshot_month_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysnapshot',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='finance_snapshot_user_month_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysnapshotcategory',
+            constraint=models.UniqueConstraint(fields=('snapshot', 'category'), name='finance_snapshotcat_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='snapshotchange',
+            index=models.Index(fields=['queued_at'], name='snapshotchange_queued_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='snapshotchange',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='finance_snapshotchange_uniq'),
+        ),
+    ]
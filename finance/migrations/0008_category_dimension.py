@@ -0,0 +1,187 @@
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+# The system categories as of this migration; later ones come from finance.categories
+DEFAULT_CATEGORIES = ('Food', 'Transport', 'Rent', 'Entertainment', 'Other')
+
+
+def intern_categories(apps, schema_editor):
+    Category = apps.get_model('finance', 'Category')
+    Allocation = apps.get_model('finance', 'Allocation')
+    CategoryStat = apps.get_model('finance', 'CategoryStat')
+    MonthlySnapshotCategory = apps.get_model('finance', 'MonthlySnapshotCategory')
+
+    system = {name.lower(): Category.objects.create(name=name).pk for name in DEFAULT_CATEGORIES}
+    custom = {}
+
+    def intern(user_id, name):
+        # Case variants of one name become one category; the first spelling seen wins
+        name = (name or '').strip() or 'Other'
+        key = name.lower()
+        if key in system:
+            return system[key]
+        if (user_id, key) not in custom:
+            custom[user_id, key] = Category.objects.create(user_id=user_id, name=name).pk
+        return custom[user_id, key]
+
+    # The allocation form copied custom text into category as well; keep one copy
+    Allocation.objects.filter(custom_category=F('category')).update(custom_category='')
+    pairs = Allocation.objects.values_list('budget__user_id', 'category').distinct().order_by('budget__user_id', 'category')
+    for user_id, name in pairs:
+        Allocation.objects.filter(budget__user_id=user_id, category=name).update(category_ref=intern(user_id, name))
+
+    # Merged case variants would collide on (user, category): recount from the allocations
+    CategoryStat.objects.all().delete()
+    CategoryStat.objects.bulk_create([
+        CategoryStat(user_id=row['budget__user_id'], category_ref_id=row['category_ref'], total=row['total'], count=row['count'])
+        for row in Allocation.objects.values('budget__user_id', 'category_ref').annotate(
+            total=Sum('amount'), count=Count('id'),
+        ).order_by()
+    ], batch_size=500)
+
+    merged = defaultdict(Decimal)
+    lines = MonthlySnapshotCategory.objects.values_list('snapshot_id', 'snapshot__user_id', 'category', 'amount')
+    for snapshot_id, user_id, name, amount in lines.iterator():
+        merged[snapshot_id, intern(user_id, name)] += amount
+    MonthlySnapshotCategory.objects.all().delete()
+    MonthlySnapshotCategory.objects.bulk_create([
+        MonthlySnapshotCategory(snapshot_id=snapshot_id, category_ref_id=category_id, amount=amount)
+        for (snapshot_id, category_id), amount in merged.items()
+    ], batch_size=500)
+
+
+def restore_category_names(apps, schema_editor):
+    Category = apps.get_model('finance', 'Category')
+    for model_name in ('Allocation', 'CategoryStat', 'MonthlySnapshotCategory'):
+        model = apps.get_model('finance', model_name)
+        for pk, name in Category.objects.values_list('pk', 'name'):
+            model.objects.filter(category_ref_id=pk).update(category=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0007_monthly_snapshots'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='categories', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'categories',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='finance_category_user_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('name',), name='finance_category_system_name_uniq'),
+        ),
+        migrations.AddField(
+            model_name='allocation',
+            name='category_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='finance.category'),
+        ),
+        migrations.AddField(
+            model_name='categorystat',
+            name='category_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='finance.category'),
+        ),
+        migrations.AddField(
+            model_name='monthlysnapshotcategory',
+            name='category_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='finance.category'),
+        ),
+        # Nullable so that unapplying RemoveField can restore the columns before they are refilled
+        migrations.AlterField(
+            model_name='allocation',
+            name='category',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='categorystat',
+            name='category',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='monthlysnapshotcategory',
+            name='category',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.RemoveConstraint(
+            model_name='categorystat',
+            name='finance_categorystat_user_category_uniq',
+        ),
+        migrations.RemoveConstraint(
+            model_name='monthlysnapshotcategory',
+            name='finance_snapshotcat_uniq',
+        ),
+        migrations.RunPython(intern_categories, restore_category_names),
+        migrations.RemoveField(
+            model_name='allocation',
+            name='category',
+        ),
+        migrations.RemoveField(
+            model_name='categorystat',
+            name='category',
+        ),
+        migrations.RemoveField(
+            model_name='monthlysnapshotcategory',
+            name='category',
+        ),
+        migrations.RenameField(
+            model_name='allocation',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.RenameField(
+            model_name='categorystat',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.RenameField(
+            model_name='monthlysnapshotcategory',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.AlterField(
+            model_name='allocation',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='finance.category'),
+        ),
+        migrations.AlterField(
+            model_name='categorystat',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='finance.category'),
+        ),
+        migrations.AlterField(
+            model_name='monthlysnapshotcategory',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='finance.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorystat',
+            constraint=models.UniqueConstraint(fields=('user', 'category'), name='finance_categorystat_user_category_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysnapshotcategory',
+            constraint=models.UniqueConstraint(fields=('snapshot', 'category'), name='finance_snapshotcat_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='allocation',
+            index=models.Index(fields=['budget', 'category'], name='allocation_budget_category_idx'),
+        ),
+    ]
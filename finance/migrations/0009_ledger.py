@@ -0,0 +1,101 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:36
+
+from collections import defaultdict
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    Budget = apps.get_model('finance', 'Budget')
+    Allocation = apps.get_model('finance', 'Allocation')
+    IncomeSource = apps.get_model('finance', 'IncomeSource')
+    LedgerEntry = apps.get_model('finance', 'LedgerEntry')
+    LedgerCheckpoint = apps.get_model('finance', 'LedgerCheckpoint')
+    every = getattr(settings, 'FINANCE_LEDGER_CHECKPOINT_EVERY', 256)
+
+    # Each existing row becomes a 'created' entry, stamped with the best time
+    # known for it; allocations have none of their own, so they follow their budget
+    history = defaultdict(list)
+    for pk, user_id, amount, created_at in Budget.objects.values_list('pk', 'user_id', 'total_amount', 'created_at'):
+        history[user_id].append((created_at, 0, pk, 'budget', amount))
+    allocations = Allocation.objects.values_list('pk', 'budget__user_id', 'amount', 'budget__created_at')
+    for pk, user_id, amount, created_at in allocations.iterator():
+        history[user_id].append((created_at, 1, pk, 'allocation', amount))
+    for pk, user_id, amount, created_at in IncomeSource.objects.values_list('pk', 'user_id', 'amount', 'created_at').iterator():
+        history[user_id].append((created_at, 2, pk, 'income', amount))
+
+    for user_id, events in history.items():
+        events.sort()
+        entries, checkpoints = [], []
+        totals = {'income': 0, 'allocation': 0, 'budget': 0}
+        for seq, (recorded_at, _, pk, kind, amount) in enumerate(events, 1):
+            entries.append(LedgerEntry(
+                user_id=user_id, seq=seq, kind=kind, action='created', object_id=pk, amount=amount, recorded_at=recorded_at,
+            ))
+            totals[kind] += amount
+            if seq % every == 0:
+                checkpoints.append(LedgerCheckpoint(
+                    user_id=user_id, seq=seq, recorded_at=recorded_at,
+                    income=totals['income'], allocated=totals['allocation'], budgeted=totals['budget'],
+                ))
+        LedgerEntry.objects.bulk_create(entries, batch_size=500)
+        LedgerCheckpoint.objects.bulk_create(checkpoints, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0008_category_dimension'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(choices=[('income', 'Income'), ('allocation', 'Allocation'), ('budget', 'Budget')], max_length=10)),
+                ('action', models.CharField(choices=[('created', 'Created'), ('changed', 'Changed'), ('deleted', 'Deleted')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('recorded_at', models.DateTimeField()),
+                ('income', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('allocated', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('budgeted', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'recorded_at'], name='ledgercheckpoint_time_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ledgercheckpoint',
+            constraint=models.UniqueConstraint(fields=('user', 'seq'), name='finance_ledgercheckpoint_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'recorded_at'], name='ledger_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'kind', 'object_id'], name='ledger_user_object_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.UniqueConstraint(fields=('user', 'seq'), name='finance_ledger_user_seq_uniq'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 14:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0010_recurring_templates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('file', models.CharField(max_length=200)),
+                ('budgeted', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('allocated', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('budget_count', models.PositiveIntegerField(default=0)),
+                ('allocation_count', models.PositiveIntegerField(default=0)),
+                ('income_count', models.PositiveIntegerField(default=0)),
+                ('categories', models.JSONField(default=dict)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_months', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='archivedmonth',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='finance_archivedmonth_uniq'),
+        ),
+    ]
@@ -1,29 +1,390 @@
-from django.db import models
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+
+from .aggregates import AllocationQuerySet, BudgetQuerySet, IncomeSourceQuerySet
+from .categories import get_registry
 
 class Budget(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    month = models.CharField(max_length=7)  # YYYY-MM format
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    month = models.DateField(help_text="First day of the budgeted month")
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also advanced by rollup updates, so it reflects allocation changes too
+    updated_at = models.DateTimeField(auto_now=True)
+    # Rollup of this budget's allocations, kept in step by finance.signals
+    allocated_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    allocation_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BudgetQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='finance_budget_user_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='budget_user_recent_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.month} - {self.total_amount} KSH"
+        return f"{self.month:%Y-%m} - {self.total_amount} KSH"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'total_amount' in loaded:
+            instance._stats_total = loaded['total_amount']
+            instance._ledger_amount = loaded['total_amount']
+        if 'month' in loaded:
+            instance._snapshot_month = loaded['month']
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The ledger entry written by finance.signals must commit together with the row
+        with transaction.atomic(using=kwargs.get('using')):
+            if self._moves_into_archived_month():
+                raise ValidationError(f"Your budget for {self.month:%B %Y} has been archived.")
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
+    def _moves_into_archived_month(self):
+        # An archived month's budget lives on in its archive file, so this would be a second one
+        month = self.__dict__.get('month')
+        if month is None or (not self._state.adding and month == getattr(self, '_snapshot_month', month)):
+            return False
+        return ArchivedMonth.objects.filter(user_id=self.user_id, month=month, budget_count__gt=0).exists()
+
+    @property
+    def savings(self):
+        return self.total_amount - self.allocated_total
+
+    @property
+    def is_over_budget(self):
+        return self.allocated_total > self.total_amount
+
+    @property
+    def over_budget_amount(self):
+        return abs(self.savings) if self.savings < 0 else 0
+
+class Category(models.Model):
+    """A spending category: system-wide when ``user`` is null, else one user's own. See finance.categories."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='categories',
+    )
+    name = models.CharField(max_length=50)
+
+    class Meta:
+        verbose_name_plural = 'categories'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='finance_category_user_name_uniq'),
+            # NULLs never collide in a unique constraint, so system names need their own
+            models.UniqueConstraint(
+                fields=['name'], condition=models.Q(user__isnull=True), name='finance_category_system_name_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
 
 class Allocation(models.Model):
     budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='allocations')
-    category = models.CharField(max_length=50)
+    # RESTRICT: a category in use can only go together with its allocations
+    category = models.ForeignKey(Category, on_delete=models.RESTRICT, related_name='+')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Free text kept alongside 'Other', e.g. the statement line of an import
     custom_category = models.CharField(max_length=50, blank=True)
+    # Content hash of the statement line an imported allocation came from
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    objects = AllocationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'import_hash'], name='finance_allocation_import_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['budget', 'category'], name='allocation_budget_category_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.category} - {self.amount} KSH"
+        return f"{self.category_name} - {self.amount} KSH"
+
+    @property
+    def category_name(self):
+        return get_registry().name(self.category_id)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'budget_id' in loaded and 'amount' in loaded:
+            instance._rollup_state = (loaded['budget_id'], loaded['amount'])
+        if 'budget_id' in loaded:
+            instance._snapshot_budget = loaded['budget_id']
+        if 'category_id' in loaded and 'amount' in loaded:
+            instance._stats_state = (loaded['category_id'], loaded['amount'])
+        if 'amount' in loaded:
+            instance._ledger_amount = loaded['amount']
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The rollup update in finance.signals must commit together with the row
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
 
 class IncomeSource(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     source = models.CharField(max_length=50, help_text="e.g., Mom, Scholarship, Part-time job")
     amount = models.DecimalField(max_digits=10, decimal_places=2, help_text="Amount in KSH")
+    # A default rather than auto_now_add so imported rows keep their statement date
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # The template and month finance.rollover added this row for
+    recurring = models.ForeignKey(
+        'RecurringIncome', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+',
+    )
+    recurring_month = models.DateField(null=True, blank=True, editable=False)
+
+    objects = IncomeSourceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='income_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'import_hash'], name='finance_income_import_uniq'),
+            models.UniqueConstraint(fields=['recurring', 'recurring_month'], name='finance_income_recurring_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} - {self.amount} KSH"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'amount' in loaded:
+            instance._stats_amount = loaded['amount']
+            instance._ledger_amount = loaded['amount']
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
+
+class UserFinanceStats(models.Model):
+    """Running per-user totals behind the budget suggestions in finance.suggestions."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='finance_stats')
+    budget_count = models.PositiveIntegerField(default=0)
+    budget_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    income_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    income_count = models.PositiveIntegerField(default=0)
+    allocated_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Stats for user {self.user_id}"
+
+
+class CategoryStat(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='category_stats')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='finance_categorystat_user_category_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-total'], name='categorystat_user_total_idx'),
+        ]
+
+    def __str__(self):
+        return f"{get_registry().name(self.category_id)}: {self.total} KSH"
+
+
+class MonthlySnapshot(models.Model):
+    """Frozen totals for one user's closed month, written by finance.snapshots."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='monthly_snapshots')
+    month = models.DateField()
+    budgeted = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    allocated = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    savings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='finance_snapshot_user_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='snapshot_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} snapshot for user {self.user_id}"
+
+
+class MonthlySnapshotCategory(models.Model):
+    snapshot = models.ForeignKey(MonthlySnapshot, on_delete=models.CASCADE, related_name='categories')
+    category = models.ForeignKey(Category, on_delete=models.RESTRICT, related_name='+')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'category'], name='finance_snapshotcat_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{get_registry().name(self.category_id)}: {self.amount} KSH"
+
+
+class SnapshotChange(models.Model):
+    """Queue of closed months whose snapshot is stale, fed by finance.signals."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    month = models.DateField()
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='finance_snapshotchange_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['queued_at'], name='snapshotchange_queued_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} for user {self.user_id}"
+
+
+class LedgerEntry(models.Model):
+    """One change to a user's money, appended by finance.ledger and never edited."""
+
+    class Kind(models.TextChoices):
+        INCOME = 'income'
+        ALLOCATION = 'allocation'
+        BUDGET = 'budget'
+
+    class Action(models.TextChoices):
+        CREATED = 'created'
+        CHANGED = 'changed'
+        DELETED = 'deleted'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    # Position in the user's ledger: 1, 2, 3, ... with no gaps
+    seq = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    action = models.CharField(max_length=10, choices=Action.choices)
+    # Pk of the IncomeSource, Allocation or Budget; kept after the row is deleted
+    object_id = models.PositiveBigIntegerField()
+    # Signed change to the user's total of this kind
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    # Never earlier than the entry before, so seq order is also time order
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='finance_ledger_user_seq_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'recorded_at'], name='ledger_user_time_idx'),
+            models.Index(fields=['user', 'kind', 'object_id'], name='ledger_user_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.seq} {self.kind} {self.object_id} {self.action}: {self.amount:+} KSH"
+
+
+class LedgerCheckpoint(models.Model):
+    """A user's running totals as of ledger entry ``seq``, written every few hundred entries."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    seq = models.PositiveBigIntegerField()
+    # recorded_at of entry ``seq``
+    recorded_at = models.DateTimeField()
+    income = models.DecimalField(max_digits=14, decimal_places=2)
+    allocated = models.DecimalField(max_digits=14, decimal_places=2)
+    budgeted = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='finance_ledgercheckpoint_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'recorded_at'], name='ledgercheckpoint_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ledger checkpoint #{self.seq} for user {self.user_id}"
+
+
+class RecurringIncome(models.Model):
+    """Income that finance.rollover adds for its user at the start of every month."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recurring_incomes')
+    source = models.CharField(max_length=50)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.source} - {self.amount} KSH"
\ No newline at end of file
+        return f"{self.source} - {self.amount} KSH monthly"
+
+
+class RecurringBudget(models.Model):
+    """The budget, and its ``allocations``, that finance.rollover creates for its user every month."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recurring_budget')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.total_amount} KSH monthly for user {self.user_id}"
+
+
+class RecurringAllocation(models.Model):
+    template = models.ForeignKey(RecurringBudget, on_delete=models.CASCADE, related_name='allocations')
+    category = models.ForeignKey(Category, on_delete=models.RESTRICT, related_name='+')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    custom_category = models.CharField(max_length=50, blank=True)
+
+    def __str__(self):
+        return f"{get_registry().name(self.category_id)} - {self.amount} KSH monthly"
+
+
+class ArchivedMonth(models.Model):
+    """One user's month moved out of the hot tables by finance.archive, with its totals."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_months')
+    month = models.DateField()
+    # Relative to FINANCE_ARCHIVE_DIR
+    file = models.CharField(max_length=200)
+    budgeted = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    allocated = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    budget_count = models.PositiveIntegerField(default=0)
+    allocation_count = models.PositiveIntegerField(default=0)
+    income_count = models.PositiveIntegerField(default=0)
+    # {category id: [total, count]} of the archived allocations
+    categories = models.JSONField(default=dict)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='finance_archivedmonth_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} archive for user {self.user_id}"
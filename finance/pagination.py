@@ -0,0 +1,54 @@
+"""
+Keyset pagination for newest-first listings.
+
+Pages are addressed by the ``(created_at, pk)`` of the last row shown
+rather than an offset, so every page costs one indexed query and no
+``COUNT(*)`` no matter how deep the user scrolls.
+"""
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj):
+    return f"{obj.created_at.isoformat()}_{obj.pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = cursor.rsplit('_', 1)
+        created_at = parse_datetime(timestamp)
+        pk = int(pk)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if created_at is None:
+        return None
+    return created_at, pk
+
+
+def keyset_page(queryset, cursor, size):
+    """
+    Return ``(rows, next_cursor)`` for the page following ``cursor``.
+
+    ``queryset`` must be ordered by ``('-created_at', '-pk')``. One extra
+    row is fetched to find out whether another page exists.
+    """
+    rows = list(_after(queryset, cursor)[:size + 1])
+    return _page(rows, size)
+
+
+async def akeyset_page(queryset, cursor, size):
+    rows = [row async for row in _after(queryset, cursor)[:size + 1]]
+    return _page(rows, size)
+
+
+def _after(queryset, cursor):
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    return queryset
+
+
+def _page(rows, size):
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    return rows[:size], next_cursor
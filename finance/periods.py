@@ -0,0 +1,45 @@
+"""
+Helpers for the month periods used by ``Budget.month``.
+
+A month is stored as the ``date`` of its first day, which sorts and
+range-scans natively in every database backend.
+"""
+import datetime
+
+from django.utils import timezone
+
+
+def month_start(value):
+    """Return the first day of the month containing ``value`` (date or datetime)."""
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        value = value.date()
+    return value.replace(day=1)
+
+
+def parse_month(value):
+    """Parse ``'YYYY-MM'`` (or a full ISO date) into the month's first day."""
+    year, month = str(value).strip().split('-')[:2]
+    return datetime.date(int(year), int(month), 1)
+
+
+def month_index(month):
+    """Number of months since year 0; consecutive months differ by one."""
+    return month.year * 12 + month.month - 1
+
+
+def month_from_index(index):
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def add_months(month, count):
+    return month_from_index(month_index(month) + count)
+
+
+def month_bounds(start, end):
+    """Return aware datetimes ``[start, end + 1 month)`` for filtering timestamp columns."""
+    tz = timezone.get_current_timezone()
+    lower = datetime.datetime.combine(month_start(start), datetime.time.min, tzinfo=tz)
+    upper = datetime.datetime.combine(add_months(month_start(end), 1), datetime.time.min, tzinfo=tz)
+    return lower, upper
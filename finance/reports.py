@@ -0,0 +1,251 @@
+"""
+Multi-month trend reports over budgets, allocations and income.
+
+``monthly_totals`` pulls everything in a single ``UNION ALL`` query. The
+query returns one grouped row per (user, month, kind, category), where
+kind is budget, income or allocation, and only allocations carry a
+category id. ``TrendReport`` scatters
+those rows into NumPy arrays indexed by (user, month). Category spend,
+savings rate, rolling averages and allocation-vs-income drift are then
+whole-array operations, so one call can report on every user at once.
+
+Months up to the latest closed-out snapshot are read from
+``MonthlySnapshot`` unless they are queued for a rebuild; only later
+months and the queued ones are aggregated from the raw rows. Archived
+months (``finance.archive``) are always read from their snapshot, since
+most of their rows have left the tables. Which months
+those are is looked up first, so every branch of the union filters on
+plain indexed ranges.
+"""
+import operator
+from collections import defaultdict, namedtuple
+from functools import reduce
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import BigIntegerField, CharField, DateField, F, Max, Q, Sum, Value
+from django.db.models.functions import TruncMonth
+
+from .categories import get_registry
+from .models import (
+    Allocation, ArchivedMonth, Budget, IncomeSource, MonthlySnapshot, MonthlySnapshotCategory, SnapshotChange,
+)
+from .periods import add_months, month_bounds, month_from_index, month_index
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+ROLLING_WINDOW = 3
+
+Row = namedtuple('Row', 'user_id month kind category_id total')
+
+
+def snapshot_coverage(user_ids=None):
+    """
+    Return ``(closed_through, pending)`` for the snapshot-backed read path.
+
+    ``closed_through`` is the last month frozen into snapshots (None when
+    nothing is), ``pending`` maps each queued month at or before it to the
+    users whose snapshot for that month is stale.
+    """
+    closed = MonthlySnapshot.objects.aggregate(latest=Max('month'))['latest']
+    pending = defaultdict(set)
+    if closed is not None:
+        changes = SnapshotChange.objects.filter(month__lte=closed)
+        if user_ids is not None:
+            changes = changes.filter(user_id__in=user_ids)
+        for user_id, month in changes.values_list('user_id', 'month'):
+            pending[month].add(user_id)
+    if pending:
+        # Rows added to an archived month show once its snapshot is rebuilt
+        archived = ArchivedMonth.objects.filter(month__in=list(pending), user_id__in=set().union(*pending.values()))
+        for user_id, month in archived.values_list('user_id', 'month'):
+            pending[month].discard(user_id)
+        pending = defaultdict(set, {month: users for month, users in pending.items() if users})
+    return closed, pending
+
+
+def _any(conditions):
+    return reduce(operator.or_, conditions, Q(pk__in=[]))
+
+
+def _income_in(month, user_ids):
+    lower, upper = month_bounds(month, month)
+    return Q(user_id__in=user_ids, created_at__gte=lower, created_at__lt=upper)
+
+
+def monthly_totals(user_ids=None, start=None, end=None, snapshots=True):
+    """
+    Return grouped ``Row`` tuples for the given users and month range.
+
+    Snapshot coverage is looked up first; the totals themselves come from
+    one query. With ``snapshots=False`` every month is aggregated from the
+    raw rows, which is how the snapshots themselves are built.
+    """
+    closed, pending = snapshot_coverage(user_ids) if snapshots else (None, {})
+
+    allocations = Allocation.objects.all()
+    budgets = Budget.objects.all()
+    incomes = IncomeSource.objects.all()
+    frozen = MonthlySnapshot.objects.all()
+    if user_ids is not None:
+        allocations = allocations.filter(budget__user_id__in=user_ids)
+        budgets = budgets.filter(user_id__in=user_ids)
+        incomes = incomes.filter(user_id__in=user_ids)
+        frozen = frozen.filter(user_id__in=user_ids)
+    if start and end:
+        allocations = allocations.filter(budget__month__gte=start, budget__month__lte=end)
+        budgets = budgets.for_months(start, end)
+        incomes = incomes.for_months(start, end)
+        frozen = frozen.filter(month__gte=start, month__lte=end)
+    if closed is not None:
+        # Live rows: anything after the watermark plus the queued months
+        stale = [Q(month=month, user_id__in=users) for month, users in pending.items()]
+        budgets = budgets.filter(Q(month__gt=closed) | _any(stale))
+        allocations = allocations.filter(
+            Q(budget__month__gt=closed) | _any(Q(budget__month=month, budget__user_id__in=users) for month, users in pending.items())
+        )
+        incomes = incomes.filter(
+            Q(created_at__gte=month_bounds(add_months(closed, 1), add_months(closed, 1))[0])
+            | _any(_income_in(month, users) for month, users in pending.items())
+        )
+        frozen = frozen.filter(month__lte=closed).exclude(_any(stale))
+
+    label = CharField()
+    none = Value(None, BigIntegerField())
+    queries = [
+        allocations.values(
+            uid=F('budget__user_id'), period=F('budget__month'), kind=Value('allocation', label), category_pk=F('category_id'),
+        ).annotate(total=Sum('amount')).order_by(),
+        budgets.values(
+            uid=F('user_id'), period=F('month'), kind=Value('budget', label), category_pk=none,
+        ).annotate(total=Sum('total_amount')).order_by(),
+        incomes.values(
+            uid=F('user_id'), period=TruncMonth('created_at', output_field=DateField()),
+            kind=Value('income', label), category_pk=none,
+        ).annotate(total=Sum('amount')).order_by(),
+    ]
+    if closed is not None:
+        queries += [
+            MonthlySnapshotCategory.objects.filter(snapshot__in=frozen.values('pk')).values(
+                uid=F('snapshot__user_id'), period=F('snapshot__month'), kind=Value('allocation', label),
+                category_pk=F('category_id'), total=F('amount'),
+            ).order_by(),
+            frozen.values(
+                uid=F('user_id'), period=F('month'), kind=Value('budget', label), category_pk=none,
+                total=F('budgeted'),
+            ).order_by(),
+            frozen.values(
+                uid=F('user_id'), period=F('month'), kind=Value('income', label), category_pk=none,
+                total=F('income'),
+            ).order_by(),
+        ]
+    query = queries[0].union(*queries[1:], all=True)
+    return [Row(*row) for row in query.values_list('uid', 'period', 'kind', 'category_pk', 'total')]
+
+
+def rolling_mean(values, window=ROLLING_WINDOW):
+    """Trailing mean over the last ``window`` months along the last axis."""
+    cumulative = np.cumsum(values, axis=-1)
+    shifted = np.zeros_like(cumulative)
+    shifted[..., window:] = cumulative[..., :-window]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window)
+    return (cumulative - shifted) / counts
+
+
+class TrendReport:
+    def __init__(self, rows, window=ROLLING_WINDOW, start=None, end=None):
+        """
+        Lay ``rows`` out on a grid of months from ``start`` to ``end``. Either
+        bound defaults to the first or last month that has data, so empty
+        months are only dropped at the ends that were left open.
+        """
+        if np is None:
+            raise ImproperlyConfigured("finance reports require numpy; install it with 'pip install numpy'.")
+        self.window = window
+        self.user_ids = sorted({row.user_id for row in rows})
+        indexes = [month_index(row.month) for row in rows]
+        first = month_index(start) if start is not None else min(indexes, default=0)
+        last = month_index(end) if end is not None else max(indexes, default=-1)
+        self.months = [month_from_index(index) for index in range(first, last + 1)]
+
+        self._user_pos = user_pos = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        kinds = np.array([row.kind for row in rows], dtype=object)
+        users = np.fromiter((user_pos[row.user_id] for row in rows), dtype=np.int64, count=len(rows))
+        months = np.fromiter((month_index(row.month) - first for row in rows), dtype=np.int64, count=len(rows))
+        totals = np.fromiter((row.total for row in rows), dtype=np.float64, count=len(rows))
+        shape = (len(self.user_ids), len(self.months))
+
+        def scatter(mask):
+            grid = np.zeros(shape)
+            np.add.at(grid, (users[mask], months[mask]), totals[mask])
+            return grid
+
+        self.budgeted = scatter(kinds == 'budget')
+        self.income = scatter(kinds == 'income')
+        allocation_mask = kinds == 'allocation'
+        self.allocated = scatter(allocation_mask)
+
+        # Category spend stays as flat (user, month, category) triples: users
+        # have their own custom categories, so a dense cube would be mostly empty
+        categories = np.fromiter((row.category_id or 0 for row in rows), dtype=np.int64, count=len(rows))
+        self._category_ids = categories[allocation_mask]
+        self._category_users = users[allocation_mask]
+        self._category_months = months[allocation_mask]
+        self._category_totals = totals[allocation_mask]
+
+        self.savings = self.income - self.allocated
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.savings_rate = np.where(self.income > 0, self.savings / self.income, np.nan)
+            self.drift = np.where(self.income > 0, (self.allocated - self.income) / self.income, np.nan)
+        self.rolling_allocated = rolling_mean(self.allocated, window)
+        self.rolling_income = rolling_mean(self.income, window)
+
+    @classmethod
+    def build(cls, user_ids=None, start=None, end=None, window=ROLLING_WINDOW):
+        return cls(monthly_totals(user_ids, start, end), window, start, end)
+
+    def category_spend(self, user_id):
+        """Return ``(categories, matrix)`` with one row per month and one column per category."""
+        if user_id not in self._user_pos:
+            return [], np.zeros((len(self.months), 0))
+        mask = self._category_users == self._user_pos[user_id]
+        ids, columns = np.unique(self._category_ids[mask], return_inverse=True)
+        matrix = np.zeros((len(self.months), len(ids)))
+        np.add.at(matrix, (self._category_months[mask], columns), self._category_totals[mask])
+        # Columns in name order, as the report shows them
+        labels = list(get_registry().names(ids.tolist()).values())
+        order = sorted(range(len(labels)), key=labels.__getitem__)
+        return [labels[k] for k in order], matrix[:, order]
+
+    def for_user(self, user_id):
+        """Plain-Python rows for one user, ready for a template or JSON."""
+        if user_id not in self._user_pos:
+            return {'months': [], 'categories': []}
+        i = self._user_pos[user_id]
+        categories, spend = self.category_spend(user_id)
+
+        def value(array, j):
+            number = array[i, j]
+            return None if np.isnan(number) else round(float(number), 4)
+
+        return {
+            'categories': categories,
+            'months': [
+                {
+                    'month': month.strftime('%Y-%m'),
+                    'budgeted': round(float(self.budgeted[i, j]), 2),
+                    'income': round(float(self.income[i, j]), 2),
+                    'allocated': round(float(self.allocated[i, j]), 2),
+                    'savings': round(float(self.savings[i, j]), 2),
+                    'savings_rate': value(self.savings_rate, j),
+                    'drift': value(self.drift, j),
+                    'rolling_allocated': round(float(self.rolling_allocated[i, j]), 2),
+                    'rolling_income': round(float(self.rolling_income[i, j]), 2),
+                    'by_category': {name: round(float(spend[j, k]), 2) for k, name in enumerate(categories)},
+                }
+                for j, month in enumerate(self.months)
+            ],
+        }
+
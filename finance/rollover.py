@@ -0,0 +1,143 @@
+"""
+Month rollover from recurring templates.
+
+A user's ``RecurringBudget`` (with its ``RecurringAllocation`` lines) and
+their ``RecurringIncome`` rows describe what they would otherwise enter
+by hand at the start of every month. ``roll_over`` creates a month's
+budgets, allocations and income for every user with active templates.
+It works through users in ascending id order, ``ROLLOVER_BATCH_SIZE`` at a
+time, and commits each batch with one ``bulk_create`` per model. The
+derived data is then brought up to date through ``finance.events``.
+Users stop a template from the recurring page, which clears its
+``active`` flag; inactive templates are skipped.
+
+Re-running is safe. A user who already has a budget for the month keeps
+it, and so does one whose budget for it has been archived. Each income
+template adds at most one row per month, enforced by
+``finance_income_recurring_uniq``. If a user creates their own budget
+while a batch is being written, the batch is retried without them. A
+stopped run can start again after the last user id it reported. Ranges
+of user ids can run side by side, e.g. one shard per worker.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+
+from .events import allocations_bulk_created, budgets_bulk_created, income_bulk_created
+from .models import Allocation, ArchivedMonth, Budget, IncomeSource, RecurringAllocation, RecurringBudget, RecurringIncome
+from .periods import month_bounds
+
+ROLLOVER_BATCH_SIZE = 500
+# Attempts at a batch that keeps colliding with users' own entries
+ROLLOVER_RETRIES = 3
+
+RolloverBatch = namedtuple('RolloverBatch', 'users budgets allocations incomes last_user_id')
+
+
+def _in_range(queryset, first_user, last_user, after):
+    if first_user is not None:
+        queryset = queryset.filter(user_id__gte=first_user)
+    if last_user is not None:
+        queryset = queryset.filter(user_id__lte=last_user)
+    if after is not None:
+        queryset = queryset.filter(user_id__gt=after)
+    return queryset
+
+
+def next_users(first_user=None, last_user=None, after=None, batch_size=ROLLOVER_BATCH_SIZE):
+    """The next ``batch_size`` ids of users with an active template, in ascending order."""
+    ids = set()
+    for model in (RecurringBudget, RecurringIncome):
+        templates = _in_range(model.objects.filter(active=True), first_user, last_user, after)
+        ids.update(templates.order_by('user_id').values_list('user_id', flat=True).distinct()[:batch_size])
+    return sorted(ids)[:batch_size]
+
+
+def _roll_over_users(month, user_ids):
+    templates = list(
+        RecurringBudget.objects.filter(user_id__in=user_ids, active=True)
+        .exclude(Exists(Budget.objects.filter(user_id=OuterRef('user_id'), month=month)))
+        .exclude(Exists(ArchivedMonth.objects.filter(user_id=OuterRef('user_id'), month=month, budget_count__gt=0)))
+        .prefetch_related('allocations')
+    )
+    budgets, lines = [], []
+    for template in templates:
+        allocations = list(template.allocations.all())
+        budget = Budget(
+            user_id=template.user_id, month=month, total_amount=template.total_amount,
+            # Written with the budget, as admit_allocations would have reserved them
+            allocated_total=sum((line.amount for line in allocations), Decimal('0')), allocation_count=len(allocations),
+        )
+        budgets.append(budget)
+        lines.append((budget, allocations))
+    Budget.objects.bulk_create(budgets)
+    created = Allocation.objects.bulk_create([
+        Allocation(budget=budget, category_id=line.category_id, amount=line.amount, custom_category=line.custom_category)
+        for budget, allocations in lines
+        for line in allocations
+    ])
+
+    paid_at = month_bounds(month, month)[0]
+    incomes = IncomeSource.objects.bulk_create([
+        IncomeSource(
+            user_id=template.user_id, source=template.source, amount=template.amount, created_at=paid_at,
+            recurring=template, recurring_month=month,
+        )
+        for template in RecurringIncome.objects.filter(user_id__in=user_ids, active=True).exclude(
+            Exists(IncomeSource.objects.filter(recurring=OuterRef('pk'), recurring_month=month)),
+        ).order_by('pk')
+    ])
+
+    budgets_bulk_created.send(sender=Budget, budgets=budgets)
+    by_budget = defaultdict(list)
+    for allocation in created:
+        by_budget[allocation.budget_id].append(allocation)
+    for budget in budgets:
+        if by_budget[budget.pk]:
+            allocations_bulk_created.send(sender=Allocation, budget=budget, allocations=by_budget[budget.pk])
+    by_user = defaultdict(list)
+    for income in incomes:
+        by_user[income.user_id].append(income)
+    for user in get_user_model().objects.filter(pk__in=by_user).only('pk'):
+        income_bulk_created.send(sender=IncomeSource, user=user, incomes=by_user[user.pk])
+    return len(budgets), len(created), len(incomes)
+
+
+def roll_over_users(month, user_ids, retries=ROLLOVER_RETRIES):
+    """Create ``month``'s rows for ``user_ids`` in one transaction; returns ``(budgets, allocations, incomes)``."""
+    for attempt in range(retries):
+        try:
+            with transaction.atomic():
+                return _roll_over_users(month, user_ids)
+        except IntegrityError:
+            # Someone added their own budget for the month meanwhile; it is
+            # excluded on the next attempt
+            if attempt == retries - 1:
+                raise
+
+
+def roll_over(month, first_user=None, last_user=None, after=None, batch_size=ROLLOVER_BATCH_SIZE):
+    """Roll ``month`` over for users ``first_user..last_user``, yielding a ``RolloverBatch`` per batch."""
+    while user_ids := next_users(first_user, last_user, after, batch_size):
+        budgets, allocations, incomes = roll_over_users(month, user_ids)
+        after = user_ids[-1]
+        yield RolloverBatch(len(user_ids), budgets, allocations, incomes, after)
+
+
+def template_from_budget(budget):
+    """Make ``budget`` and its allocations the owner's recurring budget, replacing any earlier one."""
+    with transaction.atomic():
+        template, _ = RecurringBudget.objects.update_or_create(
+            user_id=budget.user_id, defaults={'total_amount': budget.total_amount, 'active': True},
+        )
+        template.allocations.all().delete()
+        RecurringAllocation.objects.bulk_create([
+            RecurringAllocation(template=template, category_id=category_id, amount=amount, custom_category=custom)
+            for category_id, amount, custom in budget.allocations.order_by('pk').values_list(
+                'category_id', 'amount', 'custom_category',
+            )
+        ])
+    return template
@@ -0,0 +1,147 @@
+"""
+Per-budget allocation rollup.
+
+``Budget.allocated_total`` and ``Budget.allocation_count`` mirror the
+budget's allocations so views and forms can read them without fetching
+every ``Allocation`` row. The signal handlers in ``finance.signals`` apply
+deltas with a single ``UPDATE`` per change; ``rebuild_rollups`` recomputes
+them from scratch for repair and verification.
+
+``admit_allocation`` is the write path for new allocations: it reserves
+room on the budget with a conditional ``UPDATE`` and inserts the row in
+the same transaction, so concurrent submits cannot over-commit a budget.
+``admit_allocations`` does the same for a batch with one reservation and
+one ``bulk_create``.
+"""
+import random
+import time
+from decimal import Decimal
+
+from django.db import OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import allocations_bulk_created
+from .models import Allocation, Budget
+
+# Attempts made when the database reports lock contention (SQLite raises
+# "database is locked" instead of queueing writers like PostgreSQL does).
+ADMISSION_RETRIES = 10
+ADMISSION_BACKOFF = 0.005
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, budget, amount):
+        self.budget = budget
+        self.amount = amount
+        super().__init__(f"Allocating {amount} KSH would exceed the budget ({budget.total_amount} KSH)")
+
+
+def apply_allocation_delta(budget_id, amount, count=0):
+    """
+    Shift a budget's rollup by ``amount`` and ``count`` in one UPDATE.
+
+    Runs even when both are zero: ``updated_at`` is the budget's ETag, and
+    an edit that keeps the amount, e.g. a new category, still changes it.
+    """
+    Budget.objects.filter(pk=budget_id).update(
+        allocated_total=F('allocated_total') + amount,
+        allocation_count=F('allocation_count') + count,
+        updated_at=timezone.now(),
+    )
+
+
+def compute_rollups(budgets):
+    """Return ``{budget_id: (total, count)}`` computed from the allocation rows."""
+    rows = Allocation.objects.filter(budget__in=budgets).by_budget()
+    return {row['budget_id']: (row['total'], row['count']) for row in rows}
+
+
+def find_drift(budgets=None):
+    """Yield ``(budget, expected_total, expected_count)`` for every stale rollup."""
+    if budgets is None:
+        budgets = Budget.objects.all()
+    expected = compute_rollups(budgets)
+    for budget in budgets.only('pk', 'allocated_total', 'allocation_count').iterator():
+        total, count = expected.get(budget.pk, (Decimal('0.00'), 0))
+        if budget.allocated_total != total or budget.allocation_count != count:
+            yield budget, total, count
+
+
+def rebuild_rollups(budgets=None):
+    """Rewrite stale rollups from the allocation rows; returns the number fixed."""
+    fixed = 0
+    with transaction.atomic():
+        for budget, total, count in list(find_drift(budgets)):
+            Budget.objects.filter(pk=budget.pk).update(
+                allocated_total=total, allocation_count=count, updated_at=timezone.now(),
+            )
+            fixed += 1
+    return fixed
+
+
+def reserve_headroom(budget_id, amount, count=1):
+    """
+    Add ``amount`` to the budget's rollup only if it still fits.
+
+    The bound is part of the UPDATE's WHERE clause, so the check and the
+    increment happen under the row's write lock on every backend.
+    """
+    return Budget.objects.filter(
+        pk=budget_id,
+        allocated_total__lte=F('total_amount') - amount,
+    ).update(
+        allocated_total=F('allocated_total') + amount,
+        allocation_count=F('allocation_count') + count,
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def with_lock_retries(func, retries=None, backoff=None):
+    """Run ``func`` and retry it with jittered backoff on lock contention."""
+    retries = ADMISSION_RETRIES if retries is None else retries
+    backoff = ADMISSION_BACKOFF if backoff is None else backoff
+    for attempt in range(retries):
+        try:
+            return func()
+        except OperationalError as exc:
+            if 'locked' not in str(exc) or attempt == retries - 1:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def admit_allocation(allocation, retries=None):
+    """Insert an unsaved allocation if its budget has room, else raise BudgetExceeded."""
+    def attempt():
+        with transaction.atomic():
+            if not reserve_headroom(allocation.budget_id, allocation.amount):
+                raise BudgetExceeded(allocation.budget, allocation.amount)
+            # The rollup already counts this row; tell the post_save handler
+            allocation._rollup_reserved = True
+            try:
+                allocation.save()
+            finally:
+                allocation._rollup_reserved = False
+        return allocation
+
+    return with_lock_retries(attempt, retries=retries)
+
+
+def admit_allocations(budget, allocations, retries=None):
+    """Insert unsaved allocations in one transaction if they all fit in ``budget``."""
+    allocations = list(allocations)
+    if not allocations:
+        return []
+    total = sum(allocation.amount for allocation in allocations)
+    for allocation in allocations:
+        allocation.budget = budget
+
+    def attempt():
+        with transaction.atomic():
+            if not reserve_headroom(budget.pk, total, len(allocations)):
+                raise BudgetExceeded(budget, total)
+            created = Allocation.objects.bulk_create(allocations)
+            allocations_bulk_created.send(sender=Allocation, budget=budget, allocations=created)
+        return created
+
+    return with_lock_retries(attempt, retries=retries)
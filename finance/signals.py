@@ -0,0 +1,305 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .archive import is_archiving, remove_file
+from .cache import invalidate_user
+from .categories import invalidate as invalidate_categories
+from .events import allocations_bulk_created, budgets_bulk_created, income_bulk_created
+from .ledger import Kind, record_created, record_deleted, record_saved
+from .models import Allocation, ArchivedMonth, Budget, Category, IncomeSource
+from .periods import month_start
+from .rollups import apply_allocation_delta, rebuild_rollups
+from .snapshots import queue_months
+from .suggestions import record_allocations, record_budget, record_income
+
+
+def _budget_owner(budget_id):
+    return Budget.objects.filter(pk=budget_id).values_list('user_id', flat=True).first()
+
+
+def _deleting_user(origin):
+    # Rows queued while a user's data cascades away would outlive the user
+    return isinstance(origin, get_user_model()) or getattr(origin, 'model', None) is get_user_model()
+
+
+@receiver(post_save, sender=Allocation)
+def allocation_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_state', None)
+    if created:
+        if not getattr(instance, '_rollup_reserved', False):
+            apply_allocation_delta(instance.budget_id, instance.amount, 1)
+    elif previous is None:
+        # Saved without having been loaded, so the old amount is unknown
+        rebuild_rollups(Budget.objects.filter(pk=instance.budget_id))
+    elif previous[0] != instance.budget_id:
+        apply_allocation_delta(previous[0], -previous[1], -1)
+        apply_allocation_delta(instance.budget_id, instance.amount, 1)
+    else:
+        apply_allocation_delta(instance.budget_id, instance.amount - previous[1])
+    instance._rollup_state = (instance.budget_id, instance.amount)
+
+
+@receiver(post_delete, sender=Allocation)
+def allocation_deleted(sender, instance, origin=None, **kwargs):
+    if is_archiving(origin):
+        return
+    budget_id, amount = getattr(instance, '_rollup_state', (instance.budget_id, instance.amount))
+    apply_allocation_delta(budget_id, -amount, -1)
+
+
+@receiver(post_save, sender=Allocation)
+@receiver(post_delete, sender=Allocation)
+def allocation_changed(sender, instance, raw=False, origin=None, **kwargs):
+    # finance.archive invalidates once for the whole month
+    if raw or is_archiving(origin):
+        return
+    if Allocation.budget.is_cached(instance):
+        user_id = instance.budget.user_id
+    else:
+        user_id = _budget_owner(instance.budget_id)
+    if user_id is not None:
+        invalidate_user(user_id)
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+@receiver(post_save, sender=IncomeSource)
+@receiver(post_delete, sender=IncomeSource)
+def owner_data_changed(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not is_archiving(origin):
+        invalidate_user(instance.user_id)
+
+
+@receiver(allocations_bulk_created)
+def allocations_bulk_added(sender, budget, allocations, **kwargs):
+    invalidate_user(budget.user_id)
+
+
+@receiver(income_bulk_created)
+def income_bulk_added(sender, user, incomes, **kwargs):
+    invalidate_user(user.pk)
+
+
+@receiver(budgets_bulk_created)
+def budgets_bulk_added(sender, budgets, **kwargs):
+    for user_id in {budget.user_id for budget in budgets}:
+        invalidate_user(user_id)
+
+
+@receiver(post_save, sender=Budget)
+def budget_stats_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_budget(instance.user_id, instance.total_amount, 1)
+    elif getattr(instance, '_stats_total', None) is not None:
+        record_budget(instance.user_id, instance.total_amount - instance._stats_total, 0)
+    instance._stats_total = instance.total_amount
+
+
+@receiver(post_delete, sender=Budget)
+def budget_stats_deleted(sender, instance, origin=None, **kwargs):
+    if not is_archiving(origin):
+        record_budget(instance.user_id, -getattr(instance, '_stats_total', instance.total_amount), -1)
+
+
+@receiver(post_save, sender=IncomeSource)
+def income_stats_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_income(instance.user_id, instance.amount, 1)
+    elif getattr(instance, '_stats_amount', None) is not None:
+        record_income(instance.user_id, instance.amount - instance._stats_amount, 0)
+    instance._stats_amount = instance.amount
+
+
+@receiver(post_delete, sender=IncomeSource)
+def income_stats_deleted(sender, instance, origin=None, **kwargs):
+    if not is_archiving(origin):
+        record_income(instance.user_id, -getattr(instance, '_stats_amount', instance.amount), -1)
+
+
+@receiver(income_bulk_created)
+def income_bulk_stats(sender, user, incomes, **kwargs):
+    if incomes:
+        record_income(user.pk, sum(income.amount for income in incomes), len(incomes))
+        for income in incomes:
+            income._stats_amount = income.amount
+
+
+@receiver(budgets_bulk_created)
+def budgets_bulk_stats(sender, budgets, **kwargs):
+    for budget in budgets:
+        record_budget(budget.user_id, budget.total_amount, 1)
+        budget._stats_total = budget.total_amount
+
+
+def _by_category(allocations):
+    grouped = {}
+    for allocation in allocations:
+        amount, count = grouped.get(allocation.category_id, (0, 0))
+        grouped[allocation.category_id] = (amount + allocation.amount, count + 1)
+    return grouped
+
+
+@receiver(post_save, sender=Allocation)
+def allocation_stats_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.budget.user_id if Allocation.budget.is_cached(instance) else _budget_owner(instance.budget_id)
+    if user_id is None:
+        return
+    previous = getattr(instance, '_stats_state', None)
+    if not created and previous is not None:
+        record_allocations(user_id, {previous[0]: (-previous[1], -1)}, adding=False)
+    if created or previous is not None:
+        record_allocations(user_id, {instance.category_id: (instance.amount, 1)})
+    instance._stats_state = (instance.category_id, instance.amount)
+
+
+@receiver(post_delete, sender=Allocation)
+def allocation_stats_deleted(sender, instance, origin=None, **kwargs):
+    if is_archiving(origin):
+        return
+    user_id = instance.budget.user_id if Allocation.budget.is_cached(instance) else _budget_owner(instance.budget_id)
+    if user_id is not None:
+        category_id, amount = getattr(instance, '_stats_state', (instance.category_id, instance.amount))
+        record_allocations(user_id, {category_id: (-amount, -1)}, adding=False)
+
+
+@receiver(allocations_bulk_created)
+def allocations_bulk_stats(sender, budget, allocations, **kwargs):
+    if allocations:
+        record_allocations(budget.user_id, _by_category(allocations))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    # Registries cache users' category lists, so a new one retires them too
+    invalidate_categories()
+    if instance.user_id is not None and not created:
+        # Cached summaries carry category names
+        invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def budget_snapshot_stale(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or _deleting_user(origin) or is_archiving(origin):
+        return
+    months = {instance.month, getattr(instance, '_snapshot_month', instance.month)}
+    queue_months(instance.user_id, months)
+    instance._snapshot_month = instance.month
+
+
+@receiver(post_save, sender=Allocation)
+@receiver(post_delete, sender=Allocation)
+def allocation_snapshot_stale(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or _deleting_user(origin) or is_archiving(origin):
+        return
+    budget_ids = {instance.budget_id, getattr(instance, '_snapshot_budget', instance.budget_id)}
+    if Allocation.budget.is_cached(instance) and budget_ids == {instance.budget_id}:
+        keys = [(instance.budget.user_id, instance.budget.month)]
+    else:
+        keys = Budget.objects.filter(pk__in=budget_ids).values_list('user_id', 'month')
+    for user_id, month in keys:
+        queue_months(user_id, [month])
+    instance._snapshot_budget = instance.budget_id
+
+
+@receiver(post_save, sender=IncomeSource)
+@receiver(post_delete, sender=IncomeSource)
+def income_snapshot_stale(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _deleting_user(origin) and not is_archiving(origin):
+        queue_months(instance.user_id, [month_start(instance.created_at)])
+
+
+@receiver(allocations_bulk_created)
+def allocations_bulk_snapshot_stale(sender, budget, allocations, **kwargs):
+    queue_months(budget.user_id, [budget.month])
+
+
+@receiver(income_bulk_created)
+def income_bulk_snapshot_stale(sender, user, incomes, **kwargs):
+    queue_months(user.pk, [month_start(income.created_at) for income in incomes])
+
+
+@receiver(budgets_bulk_created)
+def budgets_bulk_snapshot_stale(sender, budgets, **kwargs):
+    for budget in budgets:
+        queue_months(budget.user_id, [budget.month])
+        budget._snapshot_month = budget.month
+
+
+@receiver(post_save, sender=Budget)
+def budget_ledger_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_saved(instance.user_id, Kind.BUDGET, instance, instance.total_amount, created)
+
+
+@receiver(post_save, sender=IncomeSource)
+def income_ledger_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_saved(instance.user_id, Kind.INCOME, instance, instance.amount, created)
+
+
+@receiver(post_save, sender=Allocation)
+def allocation_ledger_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.budget.user_id if Allocation.budget.is_cached(instance) else _budget_owner(instance.budget_id)
+    if user_id is not None:
+        record_saved(user_id, Kind.ALLOCATION, instance, instance.amount, created)
+
+
+@receiver(post_delete, sender=Budget)
+def budget_ledger_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_user(origin) and not is_archiving(origin):
+        record_deleted(instance.user_id, Kind.BUDGET, instance, instance.total_amount)
+
+
+@receiver(post_delete, sender=IncomeSource)
+def income_ledger_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_user(origin) and not is_archiving(origin):
+        record_deleted(instance.user_id, Kind.INCOME, instance, instance.amount)
+
+
+@receiver(post_delete, sender=Allocation)
+def allocation_ledger_deleted(sender, instance, origin=None, **kwargs):
+    if _deleting_user(origin) or is_archiving(origin):
+        return
+    user_id = instance.budget.user_id if Allocation.budget.is_cached(instance) else _budget_owner(instance.budget_id)
+    if user_id is not None:
+        record_deleted(user_id, Kind.ALLOCATION, instance, instance.amount)
+
+
+@receiver(allocations_bulk_created)
+def allocations_bulk_ledger(sender, budget, allocations, **kwargs):
+    record_created(budget.user_id, Kind.ALLOCATION, allocations)
+
+
+@receiver(income_bulk_created)
+def income_bulk_ledger(sender, user, incomes, **kwargs):
+    record_created(user.pk, Kind.INCOME, incomes)
+
+
+@receiver(budgets_bulk_created)
+def budgets_bulk_ledger(sender, budgets, **kwargs):
+    by_user = {}
+    for budget in budgets:
+        by_user.setdefault(budget.user_id, []).append(budget)
+    for user_id, owned in by_user.items():
+        record_created(user_id, Kind.BUDGET, owned, 'total_amount')
+
+
+@receiver(post_delete, sender=ArchivedMonth)
+def archived_month_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: remove_file(instance.file))
@@ -0,0 +1,127 @@
+"""
+Closed-month snapshots and the queue that keeps them fresh.
+
+Once a month has ended its totals only change when someone edits old data.
+``close_out`` freezes every ended month into ``MonthlySnapshot`` rows.
+``finance.signals`` queues a ``SnapshotChange`` whenever a write touches
+an ended month. ``drain_changes`` then rebuilds just those snapshots.
+Until a queued month is rebuilt, ``finance.reports.monthly_totals`` reads
+it from the raw rows, so readers never see stale totals. The
+``rollup_snapshots`` management command runs both steps, once or on a
+polling loop.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .archive import archived_totals
+from .models import ArchivedMonth, Budget, IncomeSource, MonthlySnapshot, MonthlySnapshotCategory, SnapshotChange
+from .periods import add_months, month_index, month_start
+from .reports import monthly_totals
+
+DRAIN_BATCH_SIZE = 500
+
+
+def current_month():
+    return month_start(timezone.localdate())
+
+
+def queue_months(user_id, months):
+    """Mark a user's ended ``months`` as needing a snapshot rebuild."""
+    current = current_month()
+    now = timezone.now()
+    changes = [SnapshotChange(user_id=user_id, month=month, queued_at=now) for month in set(months) if month < current]
+    if changes:
+        # Re-queueing bumps queued_at so a drain already in flight keeps the row
+        SnapshotChange.objects.bulk_create(
+            changes, update_conflicts=True, unique_fields=['user', 'month'], update_fields=['queued_at'],
+        )
+
+
+def build_snapshots(month, user_ids=None):
+    """Recompute the snapshots of ``month`` for ``user_ids`` (every user when None)."""
+    totals = defaultdict(lambda: {'budget': Decimal('0'), 'income': Decimal('0'), 'allocation': {}})
+    for row in monthly_totals(user_ids, month, month, snapshots=False):
+        entry = totals[row.user_id]
+        if row.kind == 'allocation':
+            entry['allocation'][row.category_id] = row.total
+        else:
+            entry[row.kind] += row.total
+    # Archived rows are no longer in the tables monthly_totals reads
+    for row in archived_totals(user_ids, month):
+        entry = totals[row['user_id']]
+        entry['budget'] += row['budgeted']
+        entry['income'] += row['income']
+        for category_id, (total, _) in row['categories'].items():
+            entry['allocation'][int(category_id)] = entry['allocation'].get(int(category_id), 0) + Decimal(total)
+
+    with transaction.atomic():
+        stale = MonthlySnapshot.objects.filter(month=month)
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        stale.delete()
+        snapshots = []
+        for user_id, entry in totals.items():
+            allocated = sum(entry['allocation'].values(), Decimal('0'))
+            snapshots.append(MonthlySnapshot(
+                user_id=user_id, month=month, budgeted=entry['budget'], income=entry['income'],
+                allocated=allocated, savings=entry['income'] - allocated,
+            ))
+        MonthlySnapshot.objects.bulk_create(snapshots)
+        MonthlySnapshotCategory.objects.bulk_create([
+            MonthlySnapshotCategory(snapshot=snapshot, category_id=category_id, amount=amount)
+            for snapshot in snapshots
+            for category_id, amount in totals[snapshot.user_id]['allocation'].items()
+        ])
+    return len(snapshots)
+
+
+def _first_data_month():
+    budgets = Budget.objects.aggregate(first=Min('month'))['first']
+    incomes = IncomeSource.objects.aggregate(first=Min('created_at'))['first']
+    archived = ArchivedMonth.objects.aggregate(first=Min('month'))['first']
+    months = [month for month in (budgets, incomes and month_start(incomes), archived) if month]
+    return min(months) if months else None
+
+
+def close_out():
+    """Snapshot every ended month after the last closed one; returns ``(months, snapshots)``."""
+    latest = MonthlySnapshot.objects.aggregate(latest=Max('month'))['latest']
+    first = add_months(latest, 1) if latest else _first_data_month()
+    last = add_months(current_month(), -1)
+    if first is None or first > last:
+        return 0, 0
+    built = 0
+    # Oldest first: each month is committed whole, so the watermark never
+    # passes a month that is only partly snapshotted
+    for offset in range(month_index(last) - month_index(first) + 1):
+        built += build_snapshots(add_months(first, offset))
+    return month_index(last) - month_index(first) + 1, built
+
+
+def drain_changes(batch_size=DRAIN_BATCH_SIZE):
+    """
+    Rebuild the snapshots behind one batch of queued changes; returns the number handled.
+
+    A change is only dropped once its snapshot has been rebuilt. Changes to
+    months past the watermark stay queued until ``close_out`` has reached
+    them, and are rebuilt by a later drain.
+    """
+    latest = MonthlySnapshot.objects.aggregate(latest=Max('month'))['latest']
+    if latest is None:
+        return 0
+    changes = list(SnapshotChange.objects.filter(month__lte=latest).order_by('queued_at')[:batch_size])
+    if not changes:
+        return 0
+    by_month = defaultdict(set)
+    for change in changes:
+        by_month[change.month].add(change.user_id)
+    for month, user_ids in sorted(by_month.items()):
+        build_snapshots(month, user_ids)
+    SnapshotChange.objects.filter(
+        pk__in=[change.pk for change in changes], queued_at__lte=max(change.queued_at for change in changes),
+    ).delete()
+    return len(changes)
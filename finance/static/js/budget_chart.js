@@ -0,0 +1,97 @@
+// /static/js/budget_chart.js
+// Draws the budget detail pie chart on its canvas; no chart library needed.
+
+document.addEventListener('DOMContentLoaded', function() {
+  const chartCanvas = document.getElementById('budgetChart');
+
+  // Only run the chart script if the canvas element exists
+  if (!chartCanvas || typeof window.chartData === 'undefined') {
+    return;
+  }
+
+  // New color palette for the chart
+  const chartColors = [
+      '#3DDC97', // Accent Green
+      '#415A77', // Muted Blue
+      '#778DA9', // Lighter Blue
+      '#FFC107', // Warning Yellow
+      '#0D1B2A', // Very Dark Blue
+      '#E53935'  // Error Red
+  ];
+  const labels = window.chartData.labels;
+  const values = window.chartData.data.map(Number);
+  const total = values.reduce(function(sum, value) { return sum + value; }, 0);
+  const height = 320;
+  let slices = [];
+
+  function draw() {
+    const width = chartCanvas.parentElement.clientWidth;
+    const scale = window.devicePixelRatio || 1;
+    chartCanvas.style.width = width + 'px';
+    chartCanvas.style.height = height + 'px';
+    chartCanvas.width = Math.round(width * scale);
+    chartCanvas.height = Math.round(height * scale);
+    const ctx = chartCanvas.getContext('2d');
+    ctx.setTransform(scale, 0, 0, scale, 0, 0);
+    ctx.clearRect(0, 0, width, height);
+
+    // Legend across the top, wrapping onto as many rows as it needs
+    ctx.font = '14px sans-serif';
+    ctx.textBaseline = 'middle';
+    let x = 0;
+    let y = 10;
+    labels.forEach(function(label, i) {
+      const itemWidth = 26 + ctx.measureText(label).width + 16;
+      if (x > 0 && x + itemWidth > width) {
+        x = 0;
+        y += 22;
+      }
+      ctx.fillStyle = chartColors[i % chartColors.length];
+      ctx.fillRect(x, y - 6, 18, 12);
+      ctx.fillStyle = '#0D1B2A'; // Dark text for legend
+      ctx.fillText(label, x + 26, y);
+      x += itemWidth;
+    });
+
+    const top = y + 20;
+    const radius = Math.max(0, Math.min(width, height - top) / 2 - 4);
+    const cx = width / 2;
+    const cy = top + (height - top) / 2;
+    let start = -Math.PI / 2;
+    slices = [];
+    values.forEach(function(value, i) {
+      const end = start + (total > 0 ? value / total : 0) * 2 * Math.PI;
+      ctx.beginPath();
+      ctx.moveTo(cx, cy);
+      ctx.arc(cx, cy, radius, start, end);
+      ctx.closePath();
+      ctx.fillStyle = chartColors[i % chartColors.length];
+      ctx.fill();
+      ctx.strokeStyle = '#ffffff';
+      ctx.lineWidth = 2;
+      ctx.stroke();
+      slices.push({start: start, end: end, cx: cx, cy: cy, radius: radius});
+      start = end;
+    });
+  }
+
+  // The hovered slice's label and amount, in place of a tooltip
+  chartCanvas.addEventListener('mousemove', function(event) {
+    const box = chartCanvas.getBoundingClientRect();
+    chartCanvas.title = '';
+    slices.forEach(function(slice, i) {
+      const dx = event.clientX - box.left - slice.cx;
+      const dy = event.clientY - box.top - slice.cy;
+      let angle = Math.atan2(dy, dx);
+      if (angle < -Math.PI / 2) {
+        angle += 2 * Math.PI;
+      }
+      if (Math.hypot(dx, dy) <= slice.radius && angle >= slice.start && angle < slice.end) {
+        chartCanvas.title = labels[i] + ': ' + values[i] + ' KSH (' + Math.round(values[i] / total * 100) + '%)';
+      }
+    });
+  });
+
+  draw();
+  window.addEventListener('resize', draw);
+});
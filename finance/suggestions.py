@@ -0,0 +1,160 @@
+"""
+Budget suggestions from precomputed per-user statistics.
+
+``UserFinanceStats`` and ``CategoryStat`` hold running totals that the
+receivers in ``finance.signals`` shift with single ``UPDATE`` statements
+whenever a budget, allocation or income source changes. ``suggest_budget``
+therefore reads one stats row, the user's latest month of income and
+their top categories; it never scans their history. ``rebuild_stats``
+recomputes everything from the raw rows for repair.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Min, Subquery, Sum, Value, When
+from django.db.models.functions import TruncMonth
+
+from .archive import archived_totals
+from .categories import get_registry
+from .models import Allocation, Budget, CategoryStat, IncomeSource, UserFinanceStats
+from .periods import month_start
+
+SUGGESTED_CATEGORIES = 8
+
+
+def _upsert(model, lookup, create, deltas, extra_updates=None):
+    """Add ``deltas`` to an existing row, creating it only when ``create`` is set."""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    updates.update(extra_updates or {})
+    if model.objects.filter(**lookup).update(**updates) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Created concurrently by another request; apply on top of it
+        model.objects.filter(**lookup).update(**updates)
+
+
+def record_budget(user_id, total_delta, count_delta):
+    _upsert(UserFinanceStats, {'user_id': user_id}, count_delta >= 0,
+            {'budget_total': total_delta, 'budget_count': count_delta})
+
+
+def record_income(user_id, amount, count_delta):
+    _upsert(UserFinanceStats, {'user_id': user_id}, count_delta >= 0,
+            {'income_total': amount, 'income_count': count_delta})
+
+
+def record_allocations(user_id, by_category, adding=True):
+    """Apply ``{category id: (amount, count)}`` deltas to the user's category stats."""
+    total = sum((amount for amount, _ in by_category.values()), Decimal('0'))
+    _upsert(UserFinanceStats, {'user_id': user_id}, adding, {'allocated_total': total})
+    if not adding:
+        _shift_categories(user_id, by_category)
+    # A single category usually has its row already; a batch creates any
+    # missing rows up front so it costs two statements however many are new
+    elif len(by_category) > 1 or not _shift_categories(user_id, by_category):
+        _create_categories(user_id, by_category)
+        _shift_categories(user_id, by_category)
+
+
+def _create_categories(user_id, categories):
+    # Zeroed rows plus a shift keep the delta of a row created concurrently
+    CategoryStat.objects.bulk_create(
+        [CategoryStat(user_id=user_id, category_id=category_id) for category_id in categories], ignore_conflicts=True,
+    )
+
+
+def _shift_categories(user_id, by_category):
+    """Add every category's delta with one UPDATE; returns the number of rows touched."""
+    def delta(position):
+        return Case(
+            *[When(category_id=category_id, then=Value(values[position])) for category_id, values in by_category.items()],
+            output_field=CategoryStat._meta.get_field('total' if position == 0 else 'count'),
+        )
+    return CategoryStat.objects.filter(user_id=user_id, category_id__in=by_category).update(
+        total=F('total') + delta(0), count=F('count') + delta(1),
+    )
+
+
+def rebuild_stats(user):
+    """Recompute a user's statistics from their budgets, allocations and income, archived ones included."""
+    budgets = Budget.objects.filter(user=user).aggregate(total=Sum('total_amount'), count=Count('id'))
+    incomes = IncomeSource.objects.filter(user=user).aggregate(total=Sum('amount'), count=Count('id'))
+    categories = {row['category_id']: [row['total'], row['count']] for row in Allocation.objects.filter(budget__user=user).by_category()}
+    budget_total, budget_count = budgets['total'] or Decimal('0'), budgets['count']
+    income_total, income_count = incomes['total'] or Decimal('0'), incomes['count']
+    for row in archived_totals([user.pk]):
+        budget_total += row['budgeted']
+        budget_count += row['budget_count']
+        income_total += row['income']
+        income_count += row['income_count']
+        for category_id, (total, count) in row['categories'].items():
+            stat = categories.setdefault(int(category_id), [Decimal('0'), 0])
+            stat[0] += Decimal(total)
+            stat[1] += count
+    with transaction.atomic():
+        CategoryStat.objects.filter(user=user).delete()
+        CategoryStat.objects.bulk_create([
+            CategoryStat(user=user, category_id=category_id, total=total, count=count)
+            for category_id, (total, count) in categories.items()
+        ])
+        UserFinanceStats.objects.update_or_create(user=user, defaults={
+            'budget_count': budget_count,
+            'budget_total': budget_total,
+            'income_total': income_total,
+            'income_count': income_count,
+            'allocated_total': sum((total for total, _ in categories.values()), Decimal('0')),
+        })
+
+
+def _whole_shillings(value):
+    return Decimal(value).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+
+
+def monthly_income(user):
+    """``(month, total)`` of the latest month in which ``user`` has income, or ``None``."""
+    latest = IncomeSource.objects.filter(user=user).order_by('-created_at').values('created_at')[:1]
+    # One range scan of the (user, created_at) index, however long the history
+    row = IncomeSource.objects.filter(user=user, created_at__gte=TruncMonth(Subquery(latest))).aggregate(
+        total=Sum('amount'), first=Min('created_at'),
+    )
+    if row['first'] is None:
+        return None
+    return month_start(row['first']), row['total']
+
+
+def suggest_budget(user, total=None):
+    """
+    Suggest next month's total and a per-category split.
+
+    The total is the user's average budget, capped at their monthly income:
+    what they received in their latest month with income (``monthly_income``).
+    With no budgets yet it is that income alone. The split follows the
+    user's historical share of spending per category. Passing ``total``
+    scales the split to an amount already chosen.
+    """
+    stats = UserFinanceStats.objects.filter(user=user).first()
+    if stats is None:
+        return None
+
+    income_month, income = monthly_income(user) or (None, None)
+    if total is None:
+        if stats.budget_count:
+            total = stats.budget_total / stats.budget_count
+            if income and income > 0:
+                total = min(total, income)
+        elif income and income > 0:
+            total = income
+        else:
+            return None
+    total = _whole_shillings(total)
+
+    split = []
+    if stats.allocated_total > 0:
+        top = list(CategoryStat.objects.filter(user=user, total__gt=0).order_by('-total')[:SUGGESTED_CATEGORIES])
+        names = get_registry().names([stat.category_id for stat in top])
+        for stat in top:
+            split.append((names[stat.category_id], _whole_shillings(total * stat.total / stats.allocated_total)))
+    return {'total': total, 'split': split, 'income': income, 'income_month': income_month}
@@ -0,0 +1,71 @@
+"""
+Summary and chart data shared by the dashboard, budget detail and API views.
+
+These functions always hit the database; views reach them through
+``finance.cache.get_summary_cache()`` so repeat loads are served from cache.
+Each has an ``a``-prefixed twin on the async ORM for the ASGI endpoints.
+"""
+from asgiref.sync import sync_to_async
+
+from .categories import get_registry
+from .models import Budget
+from .pagination import akeyset_page, keyset_page
+
+DASHBOARD_PAGE_SIZE = 12
+
+
+def _dashboard_budgets(user):
+    return Budget.objects.filter(user=user).with_savings().order_by('-created_at', '-pk')
+
+
+def dashboard_page(user, cursor=None, size=DASHBOARD_PAGE_SIZE):
+    budgets = _dashboard_budgets(user)
+    page, next_cursor = keyset_page(budgets, cursor, size)
+    if cursor:
+        # Older pages still show the current budget in the summary card
+        latest_budget = budgets.first()
+    else:
+        latest_budget = page[0] if page else None
+    return {'budgets': page, 'next_cursor': next_cursor, 'latest_budget': latest_budget}
+
+
+async def adashboard_page(user, cursor=None, size=DASHBOARD_PAGE_SIZE):
+    budgets = _dashboard_budgets(user)
+    page, next_cursor = await akeyset_page(budgets, cursor, size)
+    if cursor:
+        latest_budget = await budgets.afirst()
+    else:
+        latest_budget = page[0] if page else None
+    return {'budgets': page, 'next_cursor': next_cursor, 'latest_budget': latest_budget}
+
+
+def budget_summary(budget):
+    allocations = list(budget.allocations.order_by('pk').values('id', 'category_id', 'amount'))
+    return _summary(budget, allocations, list(budget.allocations.by_category()))
+
+
+async def abudget_summary(budget):
+    allocations = [row async for row in budget.allocations.order_by('pk').values('id', 'category_id', 'amount')]
+    by_category = [row async for row in budget.allocations.by_category()]
+    # Labelling may need to load categories this process has not seen yet
+    return await sync_to_async(_summary)(budget, allocations, by_category)
+
+
+def _summary(budget, allocations, by_category):
+    names = get_registry().names({row['category_id'] for row in allocations})
+    for row in allocations:
+        row['category'] = names[row.pop('category_id')]
+    total_allocated = budget.allocated_total
+    savings = budget.savings
+    return {
+        'total_allocated': total_allocated,
+        'savings': savings,
+        'over_budget': budget.is_over_budget,
+        'near_limit': total_allocated / budget.total_amount > 0.8 if budget.total_amount > 0 else False,
+        'over_budget_amount': budget.over_budget_amount,
+        'allocations': allocations,
+        'chart_data': {
+            'labels': [names[row['category_id']] for row in by_category] + (['Savings'] if savings > 0 else []),
+            'data': [float(row['total']) for row in by_category] + ([float(savings)] if savings > 0 else []),
+        },
+    }
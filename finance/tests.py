@@ -1,3 +1,1117 @@
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .archive import archive_dir, archive_user, load_month
+from .benchmarks import SCENARIOS, compare, run_scenario, seed_dataset
+from .cache import get_summary_cache
+from .categories import get_registry, invalidate as invalidate_categories
+from .checks import check_shared_caches
+from .exports import export_lines
+from .forms import BudgetForm
+from .imports import StatementImporter
+from .ledger import balance, find_drift as find_ledger_drift, replay
+from .reports import TrendReport, monthly_totals
+from .models import (
+    Allocation, ArchivedMonth, Budget, Category, CategoryStat, IncomeSource, LedgerCheckpoint, LedgerEntry, MonthlySnapshot,
+    RecurringBudget, RecurringIncome, SnapshotChange, UserFinanceStats,
+)
+from .periods import add_months, month_start
+from .rollover import roll_over, template_from_budget
+from .rollups import BudgetExceeded, admit_allocation, admit_allocations, find_drift, with_lock_retries
+from .snapshots import drain_changes
+from .suggestions import rebuild_stats, suggest_budget
+
+User = get_user_model()
+
+
+def category_named(name, user=None):
+    """The ``Category`` that ``user`` picking ``name`` in the allocation form ends up with."""
+    return Category.objects.get(pk=get_registry().resolve(user and user.pk, name))
+
+
+class BudgetRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='amina', email='amina@example.com', password='pass12345')
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 5, 1), total_amount=Decimal('1000.00'))
+
+    def test_rollup_follows_create_edit_and_delete(self):
+        food = Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('300.00'))
+        Allocation.objects.create(budget=self.budget, category=category_named('Rent'), amount=Decimal('500.00'))
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('800.00'))
+        self.assertEqual(self.budget.allocation_count, 2)
+        self.assertEqual(self.budget.savings, Decimal('200.00'))
+
+        food.amount = Decimal('650.00')
+        food.save()
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('1150.00'))
+        self.assertTrue(self.budget.is_over_budget)
+        self.assertEqual(self.budget.over_budget_amount, Decimal('150.00'))
+
+        food.delete()
+        Allocation.objects.filter(category__name='Rent').delete()
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('0.00'))
+        self.assertEqual(self.budget.allocation_count, 0)
+
+    def test_rebuild_command_repairs_drift(self):
+        Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('120.00'))
+        Budget.objects.filter(pk=self.budget.pk).update(allocated_total=Decimal('999.00'), allocation_count=7)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_budget_rollups', '--check', stdout=StringIO())
+        call_command('rebuild_budget_rollups', stdout=StringIO())
+        call_command('rebuild_budget_rollups', '--check', stdout=StringIO())
+
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('120.00'))
+        self.assertEqual(self.budget.allocation_count, 1)
+
+
+class AggregationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+
+    def test_income_total_and_groupings(self):
+        self.assertEqual(IncomeSource.objects.filter(user=self.user).total(), Decimal('0.00'))
+        IncomeSource.objects.create(user=self.user, source='Mom', amount=Decimal('1500.00'))
+        IncomeSource.objects.create(user=self.user, source='Mom', amount=Decimal('500.00'))
+        IncomeSource.objects.create(user=self.user, source='Scholarship', amount=Decimal('4000.00'))
+
+        incomes = IncomeSource.objects.filter(user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(incomes.total(), Decimal('6000.00'))
+        by_source = {row['source']: row['total'] for row in incomes.by_source()}
+        self.assertEqual(by_source, {'Mom': Decimal('2000.00'), 'Scholarship': Decimal('4000.00')})
+        self.assertEqual([row['total'] for row in incomes.by_month()], [Decimal('6000.00')])
+
+    def test_allocation_by_category(self):
+        budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 5, 1), total_amount=Decimal('1000.00'))
+        for category, amount in [('Food', '100.00'), ('Rent', '400.00'), ('Food', '50.00')]:
+            Allocation.objects.create(budget=budget, category=category_named(category), amount=Decimal(amount))
+
+        with self.assertNumQueries(1):
+            rows = list(budget.allocations.by_category())
+        self.assertEqual([(row['category_id'], row['total'], row['count']) for row in rows],
+                         [(category_named('Rent').pk, Decimal('400.00'), 1), (category_named('Food').pk, Decimal('150.00'), 2)])
+        self.assertEqual(Budget.objects.filter(user=self.user).totals()['allocated'], Decimal('550.00'))
+
+
+class BudgetMonthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='esther', email='esther@example.com', password='pass12345')
+
+    def test_form_stores_first_of_month_and_rejects_duplicates(self):
+        data = {'month_choice': '03', 'year_choice': '2025', 'total_amount': '2500.00'}
+        form = BudgetForm(data, user=self.user)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.instance.user = self.user
+        self.assertEqual(form.save().month, datetime.date(2025, 3, 1))
+
+        duplicate = BudgetForm(data, user=self.user)
+        self.assertFalse(duplicate.is_valid())
+
+    def test_month_range_filters(self):
+        for month in (1, 2, 3, 4):
+            Budget.objects.create(user=self.user, month=datetime.date(2024, month, 1), total_amount=Decimal('100.00'))
+        in_range = Budget.objects.filter(user=self.user).for_months(datetime.date(2024, 2, 1), datetime.date(2024, 3, 1))
+        self.assertEqual([b.month.month for b in in_range.order_by('month')], [2, 3])
+        IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('10.00'))
+        this_month = timezone.localdate().replace(day=1)
+        self.assertEqual(IncomeSource.objects.for_months(this_month, this_month).count(), 1)
+        self.assertEqual(IncomeSource.objects.for_months(add_months(this_month, 1), add_months(this_month, 2)).count(), 0)
+
+
+class DashboardQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dan', email='dan@example.com', password='pass12345')
+        self.client.force_login(self.user)
+
+    def _add_budgets(self, count, allocations_each):
+        offset = Budget.objects.filter(user=self.user).count()
+        for i in range(offset, offset + count):
+            month = add_months(datetime.date(2020, 1, 1), i)
+            budget = Budget.objects.create(user=self.user, month=month, total_amount=Decimal('1000.00'))
+            for _ in range(allocations_each):
+                Allocation.objects.create(budget=budget, category=category_named('Food'), amount=Decimal('10.00'))
+
+    def _dashboard_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('finance:dashboard'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_is_constant_as_data_grows(self):
+        self._add_budgets(1, 1)
+        _, small = self._dashboard_queries()
+        self._add_budgets(30, 8)
+        response, large = self._dashboard_queries()
+
+        # session + user + one budget page query
+        self.assertEqual(small, 3)
+        self.assertEqual(large, small)
+        self.assertEqual(len(response.context['budgets']), 12)
+        self.assertEqual(response.context['budgets'][0].remaining, response.context['savings'])
+
+    def test_keyset_pages_cover_every_budget_once(self):
+        self._add_budgets(30, 0)
+        seen, cursor = [], None
+        while True:
+            response, _ = self._dashboard_queries(**({'after': cursor} if cursor else {}))
+            seen.extend(budget.pk for budget in response.context['budgets'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(Budget.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+class CategoryRegistryTests(TestCase):
+    def setUp(self):
+        # These tests run commit callbacks, so the registry caches rows the
+        # test rollback then removes; start and finish with a fresh one
+        invalidate_categories()
+        self.addCleanup(invalidate_categories)
+        self.user = User.objects.create_user(username='akinyi', email='akinyi@example.com', password='pass12345')
+        self.other = User.objects.create_user(username='baraka', email='baraka@example.com', password='pass12345')
+
+    def test_resolve_matches_names_case_insensitively(self):
+        registry = get_registry()
+        food = Category.objects.get(user=None, name='Food')
+        self.assertEqual(registry.resolve(self.user.pk, ' food '), food.pk)
+        self.assertEqual(registry.lookup(None, 'FOOD'), food.pk)
+
+        chama = registry.resolve(self.user.pk, 'Chama')
+        self.assertEqual(Category.objects.get(pk=chama).user, self.user)
+        self.assertEqual(get_registry().resolve(self.user.pk, 'chama'), chama)
+        self.assertNotEqual(get_registry().resolve(self.other.pk, 'Chama'), chama)
+        self.assertIsNone(get_registry().lookup(None, 'Chama'))
+
+    def test_resolve_many_creates_new_names_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            found = get_registry().resolve_many(self.user.pk, ['Rent', 'Chama', 'Fees', 'chama'])
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(found['Chama'], found['chama'])
+        self.assertEqual(get_registry().names([found['Rent'], found['Fees']]), {found['Rent']: 'Rent', found['Fees']: 'Fees'})
+
+        registry = get_registry()
+        # Rows are only cached once the transaction that read them commits
+        with self.captureOnCommitCallbacks(execute=True):
+            registry.resolve_many(self.user.pk, ['Rent'])
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.resolve_many(self.user.pk, ['rent', 'CHAMA']), {'rent': found['Rent'], 'CHAMA': found['Chama']})
+        with self.assertRaises(ValueError):
+            registry.resolve_many(None, ['Chama'])
+
+    def test_choices_list_defaults_then_own_categories(self):
+        for name in ('Fees', 'chama'):
+            get_registry().resolve(self.user.pk, name)
+        self.assertEqual(
+            get_registry().choices(self.user.pk), ['Food', 'Transport', 'Rent', 'Entertainment', 'Other', 'chama', 'Fees'],
+        )
+        self.assertEqual(get_registry().choices(self.other.pk), ['Food', 'Transport', 'Rent', 'Entertainment', 'Other'])
+
+    def test_changes_retire_registries_other_processes_hold(self):
+        # Stands in for another worker's registry, warmed before the changes
+        elsewhere = get_registry()
+        self.assertNotIn('Chama', elsewhere.choices(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            chama = Category.objects.create(user=self.user, name='Chama')
+        self.assertIsNot(get_registry(), elsewhere)
+        self.assertIn('Chama', get_registry().choices(self.user.pk))
+
+        warm = get_registry()
+        warm.name(chama.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            chama.name = 'Merry-go-round'
+            chama.save()
+        self.assertIsNot(get_registry(), warm)
+        self.assertEqual(get_registry().name(chama.pk), 'Merry-go-round')
+
+        with self.settings(WORKER_PROCESSES=4, FINANCE_SUMMARY_CACHE='finance_files'):
+            self.assertEqual([error.id for error in check_shared_caches(None)], ['finance.E001'])
+
+
+class SummaryCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='faith', email='faith@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 9, 1), total_amount=Decimal('800.00'))
+        Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('200.00'))
+        get_summary_cache().reset_stats()
+
+    def _detail(self):
+        return self.client.get(reverse('finance:budget_detail', args=[self.budget.pk]))
+
+    def test_repeat_loads_skip_allocation_queries(self):
+        self._detail()
+        with CaptureQueriesContext(connection) as queries:
+            response = self._detail()
+        self.assertFalse([q for q in queries.captured_queries if 'finance_allocation' in q['sql']])
+        self.assertEqual(response.context['total_allocated'], Decimal('200.00'))
+        self.assertEqual(get_summary_cache().stats()['hits'], 1)
+
+    def test_writes_invalidate_cached_summaries(self):
+        self.client.get(reverse('finance:dashboard'))
+        self._detail()
+        Allocation.objects.create(budget=self.budget, category=category_named('Rent'), amount=Decimal('300.00'))
+
+        self.assertEqual(self._detail().context['total_allocated'], Decimal('500.00'))
+        response = self.client.get(reverse('finance:dashboard'))
+        self.assertEqual(response.context['savings'], Decimal('300.00'))
+        self.assertEqual(get_summary_cache().stats()['misses'], 4)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'finance_files': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+            }
+            with self.settings(CACHES=caches, FINANCE_SUMMARY_CACHE='finance_files'):
+                self._detail()
+                response = self._detail()
+                self.assertEqual(get_summary_cache().stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+                self.assertEqual(response.context['chart_data']['labels'], ['Food', 'Savings'])
+
+    def test_per_process_backend_is_refused_with_several_workers(self):
+        with self.settings(WORKER_PROCESSES=1, FINANCE_SUMMARY_CACHE='lru'):
+            self.assertEqual(check_shared_caches(None), [])
+        with self.settings(WORKER_PROCESSES=4, FINANCE_SUMMARY_CACHE='lru', FINANCE_CATEGORY_CACHE='finance_files'):
+            self.assertEqual([error.id for error in check_shared_caches(None)], ['finance.E001'])
+        with self.settings(WORKER_PROCESSES=4, FINANCE_SUMMARY_CACHE='finance_files', FINANCE_CATEGORY_CACHE='finance_files'):
+            self.assertEqual(check_shared_caches(None), [])
+
+
+class SummaryApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='george', email='george@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 10, 1), total_amount=Decimal('900.00'))
+        Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('250.50'))
+        self.url = reverse('finance:api_budget_summary', args=[self.budget.pk])
+
+    def test_summary_payload_uses_decimal_strings(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['allocated_total'], '250.50')
+        self.assertEqual(data['savings'], '649.50')
+        self.assertEqual(data['chart'], {'labels': ['Food', 'Savings'], 'data': [250.5, 649.5]})
+
+        allocations = self.client.get(reverse('finance:api_budget_allocations', args=[self.budget.pk])).json()
+        self.assertEqual([a['amount'] for a in allocations['allocations']], ['250.50'])
+
+    def test_conditional_get_returns_304_until_budget_changes(self):
+        first = self.client.get(self.url)
+        etag = first['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('Last-Modified', first)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertFalse([q for q in queries.captured_queries if 'finance_allocation' in q['sql']])
+
+        Allocation.objects.create(budget=self.budget, category=category_named('Rent'), amount=Decimal('100.00'))
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(changed.json()['allocated_total'], '350.50')
+
+    def test_income_total_conditional_get(self):
+        IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('1200.00'))
+        response = self.client.get(reverse('finance:get_total_income'))
+        self.assertEqual(response.json(), {'total': '1200.00'})
+        self.assertEqual(self.client.get(reverse('finance:get_total_income'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        IncomeSource.objects.create(user=self.user, source='Mom', amount=Decimal('300.00'))
+        data = self.client.get(reverse('finance:api_income_total'), HTTP_IF_NONE_MATCH=response['ETag']).json()
+        self.assertEqual(data['total'], '1500.00')
+        self.assertEqual([row['source'] for row in data['by_source']], ['Job', 'Mom'])
+
+    def test_income_validators_do_not_depend_on_the_summary_cache(self):
+        job = IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('1200.00'))
+        url = reverse('finance:api_income_total')
+        etag = self.client.get(url)['ETag']
+        # Another worker, with nothing cached, must agree on the validator
+        get_summary_cache().backend.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        job.amount = Decimal('1300.00')
+        job.save()
+        get_summary_cache().backend.clear()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['total'], '1300.00')
+
+    def test_category_only_edit_changes_the_allocations_etag(self):
+        url = reverse('finance:api_budget_allocations', args=[self.budget.pk])
+        etag = self.client.get(url)['ETag']
+        allocation = Allocation.objects.get(budget=self.budget)
+        allocation.category = category_named('Rent')
+        allocation.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([a['category'] for a in changed.json()['allocations']], ['Rent'])
+
+    def test_other_users_budget_is_not_found(self):
+        other = User.objects.create_user(username='hawa', email='hawa@example.com', password='pass12345')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    async def test_read_endpoints_serve_async_clients(self):
+        dashboard = reverse('finance:api_dashboard')
+        self.assertEqual((await self.async_client.get(dashboard)).status_code, 302)
+        await self.async_client.aforce_login(self.user)
+
+        data = (await self.async_client.get(dashboard)).json()
+        self.assertEqual([b['allocated_total'] for b in data['budgets']], ['250.50'])
+        self.assertEqual(data['latest_budget']['savings'], '649.50')
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual((await self.async_client.get(dashboard, {'after': 'junk'})).status_code, 400)
+
+        first = await self.async_client.get(self.url)
+        cached = await self.async_client.get(self.url, headers={'if-none-match': first['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_dashboard_and_budget_pages_serve_async_clients(self):
+        detail = reverse('finance:budget_detail', args=[self.budget.pk])
+        self.assertEqual((await self.async_client.get(detail)).status_code, 302)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('finance:dashboard'))
+        self.assertContains(response, '649.50')
+        response = await self.async_client.get(detail)
+        self.assertContains(response, '250.50')
+        self.assertEqual(response.context['budget'], self.budget)
+        missing = reverse('finance:budget_detail', args=[self.budget.pk + 1000])
+        self.assertEqual((await self.async_client.get(missing)).status_code, 404)
+
+
+class BulkAllocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='irene', email='irene@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 11, 1), total_amount=Decimal('5000.00'))
+
+    def _formset_data(self, rows, total_forms=25):
+        data = {'form-TOTAL_FORMS': str(total_forms), 'form-INITIAL_FORMS': '0'}
+        for i in range(total_forms):
+            category, custom, amount = rows[i] if i < len(rows) else ('Food', '', '')
+            data.update({f'form-{i}-category': category, f'form-{i}-custom_category': custom, f'form-{i}-amount': amount})
+        return data
+
+    def test_formset_creates_a_monthly_plan_in_one_request(self):
+        rows = [('Other', f'Item {i}', '100.00') for i in range(20)]
+        url = reverse('finance:allocation_bulk_create', args=[self.budget.pk])
+        self.assertContains(self.client.get(url), 'form-TOTAL_FORMS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, self._formset_data(rows))
+        self.assertRedirects(response, reverse('finance:budget_detail', args=[self.budget.pk]), fetch_redirect_response=False)
+        # Includes queueing a snapshot rebuild, since the budget's month has ended, creating the
+        # 20 new categories in one insert and appending their ledger entries in another. The test's
+        # transaction keeps the user's categories from being cached, so they are read three times
+        # here rather than once.
+        self.assertLessEqual(len(queries), 19)
+        self.assertEqual(sum('FROM "finance_budget"' in q['sql'] for q in queries.captured_queries), 1)
+
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocation_count, 20)
+        self.assertEqual(self.budget.allocated_total, Decimal('2000.00'))
+        self.assertEqual(Allocation.objects.filter(budget=self.budget, category__name='Item 7', category__user=self.user).count(), 1)
+
+    def test_formset_rejects_batch_over_budget(self):
+        rows = [('Rent', '', '3000.00'), ('Food', '', '2500.00')]
+        response = self.client.post(reverse('finance:allocation_bulk_create', args=[self.budget.pk]), self._formset_data(rows))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_form_errors())
+        self.assertFalse(Allocation.objects.exists())
+
+    def test_json_endpoint_is_all_or_nothing(self):
+        url = reverse('finance:api_bulk_allocations', args=[self.budget.pk])
+        payload = {'allocations': [{'category': 'Food', 'amount': '1200'}, {'category': 'Transport', 'amount': '300.50'}]}
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([a['amount'] for a in response.json()['allocations']], ['1200.00', '300.50'])
+
+        invalid = {'allocations': [{'category': 'Food', 'amount': '10'}, {'category': 'Other', 'amount': '5'}]}
+        response = self.client.post(url, json.dumps(invalid), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['1'])
+
+        too_much = {'allocations': [{'category': 'Rent', 'amount': '4000'}]}
+        self.assertEqual(self.client.post(url, json.dumps(too_much), content_type='application/json').status_code, 409)
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('1500.50'))
+        self.assertEqual(Allocation.objects.count(), 2)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='james', email='james@example.com', password='pass12345')
+        budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 12, 1), total_amount=Decimal('700.00'))
+        Allocation.objects.create(budget=budget, category=category_named('Food'), amount=Decimal('70.00'))
+        IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('900.00'))
+        other = User.objects.create_user(username='kevin', email='kevin@example.com', password='pass12345')
+        IncomeSource.objects.create(user=other, source='Gift', amount=Decimal('5.00'))
+
+    def test_streaming_csv_and_jsonl_are_scoped_to_the_user(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('finance:export', args=['allocations', 'csv']))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,budget_id,user_id,month,category,custom_category,amount')
+        self.assertEqual(lines[1].split(',')[3:], ['2024-12-01', 'Food', '', '70.00'])
+
+        response = self.client.get(reverse('finance:export', args=['income', 'jsonl']))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['source'], row['amount']) for row in rows], [('Job', '900.00')])
+        self.assertEqual(self.client.get(reverse('finance:export', args=['income', 'xml'])).status_code, 404)
+
+    def test_command_exports_every_account(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('export_finance', '--format', 'jsonl', '--output-dir', directory, '--chunk-size', '1', stdout=StringIO())
+            with open(f"{directory}/income.jsonl") as handle:
+                self.assertEqual(len(handle.readlines()), 2)
+            with open(f"{directory}/budgets.jsonl") as handle:
+                self.assertEqual(json.loads(handle.readline())['allocated_total'], '70.00')
+
+
+MPESA_STATEMENT = """Receipt No,Completion Time,Details,Transaction Status,Paid In,Withdrawn,Balance
+QA1,2025-01-03 09:00:00,Funds received from MOM,Completed,"2,500.00",,2500.00
+QA2,2025-01-04 12:30:00,Merchant Payment to NAIVAS SUPERMARKET,Completed,,450.00,2050.00
+QA3,2025-01-05 08:15:00,Pay Bill to LANDLORD LTD,Completed,,1200.00,850.00
+QA4,2025-01-05 08:16:00,Pay Bill to LANDLORD LTD,Failed,,1200.00,850.00
+QA5,2025-02-01 10:00:00,Customer Transfer to JOHN,Completed,,100.00,750.00
+QA6,not-a-date,Funds received,Completed,10.00,,760.00
+"""
+
+
+class StatementImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lucy', email='lucy@example.com', password='pass12345')
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2025, 1, 1), total_amount=Decimal('3000.00'))
+
+    def test_import_maps_rows_and_dedupes_on_reimport(self):
+        reports = list(StatementImporter(self.user, chunk_size=2).run(StringIO(MPESA_STATEMENT)))
+        self.assertEqual([report.rows for report in reports], [2, 2, 2])
+        self.assertEqual(sum(report.incomes for report in reports), 1)
+        self.assertEqual(sum(report.allocations for report in reports), 2)
+        errors = [message for report in reports for _, message in report.errors]
+        self.assertEqual(len(errors), 2)  # February has no budget, one bad date
+
+        income = IncomeSource.objects.get(user=self.user)
+        self.assertEqual((income.amount, income.created_at.date()), (Decimal('2500.00'), datetime.date(2025, 1, 3)))
+        self.assertEqual(sorted(self.budget.allocations.values_list('category__name', flat=True)), ['Food', 'Rent'])
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.allocated_total, Decimal('1650.00'))
+
+        again = list(StatementImporter(self.user).run(StringIO(MPESA_STATEMENT)))
+        self.assertEqual(again[0].duplicates, 3)
+        self.assertEqual(IncomeSource.objects.count() + Allocation.objects.count(), 3)
+
+    def test_identical_lines_in_generic_statement_are_kept(self):
+        statement = "Date,Description,Amount\n2025-01-10,Uber trip,-300\n2025-01-10,Uber trip,-300\n"
+        report, = StatementImporter(self.user).run(StringIO(statement))
+        self.assertEqual(report.allocations, 2)
+        self.assertEqual(self.budget.allocations.filter(category__name='Transport').count(), 2)
+
+    def test_identical_lines_are_kept_when_dates_are_unsorted(self):
+        statement = (
+            "Date,Description,Amount\n2025-01-10,Uber trip,-300\n2025-01-11,Naivas,-80\n"
+            "2025-01-10,Uber trip,-300\n"
+        )
+        report, = StatementImporter(self.user).run(StringIO(statement))
+        self.assertEqual(report.allocations, 3)
+        again, = StatementImporter(self.user).run(StringIO(statement))
+        self.assertEqual((again.allocations, again.duplicates), (0, 3))
+
+    def test_upload_view(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('statement.csv', MPESA_STATEMENT.encode(), content_type='text/csv')
+        response = self.client.post(reverse('finance:statement_import'), {'statement': upload})
+        self.assertRedirects(response, reverse('finance:dashboard'), fetch_redirect_response=False)
+        self.assertEqual(IncomeSource.objects.filter(user=self.user).total(), Decimal('2500.00'))
+
+        bad = SimpleUploadedFile('statement.csv', b"foo,bar\n1,2\n", content_type='text/csv')
+        response = self.client.post(reverse('finance:statement_import'), {'statement': bad})
+        self.assertTrue(response.context['form'].errors)
+
+        # Undecodable bytes late in the file are caught before anything is committed
+        garbled = MPESA_STATEMENT.replace('2025-01-', '2025-03-').encode() + b"\xff\xfe,broken\n"
+        upload = SimpleUploadedFile('statement.csv', garbled, content_type='text/csv')
+        response = self.client.post(reverse('finance:statement_import'), {'statement': upload})
+        self.assertIn('not UTF-8', str(response.context['form'].errors))
+        self.assertEqual(IncomeSource.objects.filter(user=self.user).count(), 1)
+
+
+class TrendReportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mary', email='mary@example.com', password='pass12345')
+        self.other = User.objects.create_user(username='nick', email='nick@example.com', password='pass12345')
+        for month, food, rent in [(1, '100.00', '300.00'), (2, '200.00', '300.00'), (4, '50.00', '0')]:
+            budget = Budget.objects.create(user=self.user, month=datetime.date(2024, month, 1), total_amount=Decimal('1000.00'))
+            Allocation.objects.create(budget=budget, category=category_named('Food'), amount=Decimal(food))
+            if Decimal(rent):
+                Allocation.objects.create(budget=budget, category=category_named('Rent'), amount=Decimal(rent))
+        for month in (1, 2):
+            IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('1000.00'),
+                                        created_at=datetime.datetime(2024, month, 10, tzinfo=datetime.timezone.utc))
+        other_budget = Budget.objects.create(user=self.other, month=datetime.date(2024, 1, 1), total_amount=Decimal('90.00'))
+        Allocation.objects.create(budget=other_budget, category=category_named('Food'), amount=Decimal('90.00'))
+
+    def test_single_query_feeds_a_batch_report(self):
+        # The snapshot watermark lookup, then one union for every user
+        with self.assertNumQueries(2):
+            rows = monthly_totals()
+        report = TrendReport(rows)
+        self.assertEqual(report.allocated.shape, (2, 4))
+
+        mine = report.for_user(self.user.pk)
+        self.assertEqual([m['month'] for m in mine['months']], ['2024-01', '2024-02', '2024-03', '2024-04'])
+        self.assertEqual(mine['categories'], ['Food', 'Rent'])
+        january, february, march, april = mine['months']
+        self.assertEqual((january['allocated'], january['savings'], january['savings_rate']), (400.0, 600.0, 0.6))
+        self.assertEqual(february['drift'], -0.5)
+        self.assertIsNone(march['savings_rate'])
+        self.assertEqual(april['rolling_allocated'], round((500 + 0 + 50) / 3, 2))
+        self.assertEqual(april['by_category'], {'Food': 50.0, 'Rent': 0.0})
+        self.assertEqual(report.for_user(self.other.pk)['months'][0]['allocated'], 90.0)
+
+    def test_requested_range_keeps_empty_months_at_both_ends(self):
+        report = TrendReport.build([self.user.pk], datetime.date(2023, 12, 1), datetime.date(2024, 5, 1))
+        months = report.for_user(self.user.pk)['months']
+        self.assertEqual([m['month'] for m in months][::5], ['2023-12', '2024-05'])
+        self.assertEqual(len(months), 6)
+        self.assertEqual(months[1]['rolling_allocated'], 200.0)  # December counts as an empty month
+        self.assertEqual(months[5]['rolling_allocated'], round(50 / 3, 2))
+
+    def test_report_endpoints(self):
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('finance:api_trend_report'), {'start': '2024-02', 'end': '2024-03'}).json()
+        self.assertEqual([m['month'] for m in data['months']], ['2024-02', '2024-03'])
+        self.assertEqual(self.client.get(reverse('finance:api_trend_report'), {'start': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('finance:reports')).status_code, 200)
+
+
+class BudgetSuggestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='otieno', email='otieno@example.com', password='pass12345')
+        IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('18000.00'))
+        IncomeSource.objects.create(user=self.user, source='Side', amount=Decimal('2000.00'))
+        for month, total in [(1, '15000.00'), (2, '30000.00')]:
+            budget = Budget.objects.create(user=self.user, month=datetime.date(2024, month, 1), total_amount=Decimal(total))
+            Allocation.objects.create(budget=budget, category=category_named('Rent'), amount=Decimal('6000.00'))
+        self.budget = budget
+
+    def stats(self):
+        return {
+            'user': UserFinanceStats.objects.filter(user=self.user).values(
+                'budget_count', 'budget_total', 'income_total', 'income_count', 'allocated_total',
+            ).get(),
+            'categories': set(CategoryStat.objects.filter(user=self.user).values_list('category__name', 'total', 'count')),
+        }
+
+    def test_stats_follow_changes_and_match_rebuild(self):
+        food = Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('3000.00'))
+        food.category, food.amount = category_named('Groceries', self.user), Decimal('4000.00')
+        food.save()
+        admit_allocations(self.budget, [Allocation(category=category_named('Transport'), amount=Decimal('1000.00'))])
+        self.budget.total_amount = Decimal('26000.00')
+        self.budget.save()
+        IncomeSource.objects.filter(source='Side').get().delete()
+        job = IncomeSource.objects.get(source='Job')
+        job.amount = Decimal('21000.00')
+        job.save()
+
+        incremental = self.stats()
+        self.assertEqual(incremental['user']['budget_total'], Decimal('41000.00'))
+        self.assertEqual((incremental['user']['income_total'], incremental['user']['income_count']),
+                         (Decimal('21000.00'), 1))
+        self.assertEqual(incremental['user']['allocated_total'], Decimal('17000.00'))
+        self.assertIn(('Food', Decimal('0.00'), 0), incremental['categories'])
+        rebuild_stats(self.user)
+        rebuilt = self.stats()
+        self.assertEqual(incremental['user'], rebuilt['user'])
+        self.assertEqual({c for c in incremental['categories'] if c[2]}, rebuilt['categories'])
+
+    def test_suggestion_is_capped_by_income_and_split_by_history(self):
+        Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('4000.00'))
+        # Earlier months' income does not raise this month's cap
+        IncomeSource.objects.create(
+            user=self.user, source='Job', amount=Decimal('18000.00'), created_at=timezone.now() - datetime.timedelta(days=62),
+        )
+        with self.assertNumQueries(3):
+            suggestion = suggest_budget(self.user)
+        # Average budget 22500, capped at the 20000 income of the latest month
+        self.assertEqual(suggestion['total'], Decimal('20000'))
+        self.assertEqual((suggestion['income_month'], suggestion['income']), (month_start(timezone.localdate()), Decimal('20000.00')))
+        self.assertEqual(suggestion['split'], [('Rent', Decimal('15000')), ('Food', Decimal('5000'))])
+
+        Budget.objects.filter(total_amount=Decimal('30000.00')).delete()
+        self.assertEqual(suggest_budget(self.user)['total'], Decimal('15000'))
+
+    def test_create_form_is_prefilled(self):
+        response = self.client.get(reverse('finance:budget_create'))
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={reverse('finance:budget_create')}",
+                             fetch_redirect_response=False)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('finance:budget_create'))
+        self.assertEqual(response.context['form'].initial['total_amount'], Decimal('20000'))
+        self.assertContains(response, 'Rent: 20000 KSH')
+        self.assertContains(response, f"(income for {timezone.localdate():%B %Y}: 20000 KSH)")
+
+        url = reverse('finance:budget_create')
+        response = self.client.get(url, {'suggested_amount': '12345.67'})
+        self.assertEqual(response.context['form'].initial['total_amount'], Decimal('12345.67'))
+        for bad in ('abc', 'NaN', '-5'):
+            response = self.client.get(url, {'suggested_amount': bad})
+            self.assertEqual(response.context['form'].initial['total_amount'], Decimal('20000'))
+        self.assertIsNone(suggest_budget(User.objects.create_user(username='new', email='new@example.com', password='x')))
+
+
+class MonthlySnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='wanjiru', email='wanjiru@example.com', password='pass12345')
+        self.current = month_start(timezone.localdate())
+        for offset in (-2, -1, 0):
+            budget = Budget.objects.create(user=self.user, month=add_months(self.current, offset), total_amount=Decimal('1000.00'))
+            Allocation.objects.create(budget=budget, category=category_named('Food'), amount=Decimal('200.00'))
+            Allocation.objects.create(budget=budget, category=category_named('Rent'), amount=Decimal('500.00'))
+        IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('1500.00'),
+                                    created_at=timezone.now().replace(day=1) - datetime.timedelta(days=20))
+        self.last_month = Allocation.objects.get(budget__month=add_months(self.current, -1), category__name='Food')
+
+    def report(self, snapshots=True):
+        return TrendReport(monthly_totals([self.user.pk], snapshots=snapshots)).for_user(self.user.pk)
+
+    def test_closed_months_are_read_from_snapshots(self):
+        live = self.report()
+        SnapshotChange.objects.all().delete()
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.assertEqual(
+            set(MonthlySnapshot.objects.values_list('month', flat=True)),
+            {add_months(self.current, -2), add_months(self.current, -1)},
+        )
+        self.assertEqual(self.report(), live)
+
+        # Bypassing the signals shows which months come from the snapshot
+        Allocation.objects.filter(budget__month__lt=self.current).update(amount=Decimal('1.00'))
+        Allocation.objects.filter(budget__month=self.current).update(amount=Decimal('2.00'))
+        months = self.report()['months']
+        self.assertEqual([m['allocated'] for m in months], [700.0, 700.0, 4.0])
+
+    def test_edits_to_closed_months_are_queued_and_rebuilt(self):
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.last_month.amount = Decimal('300.00')
+        self.last_month.save()
+        self.assertTrue(SnapshotChange.objects.filter(user=self.user, month=add_months(self.current, -1)).exists())
+        self.assertEqual(self.report()['months'][1]['allocated'], 800.0)
+
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.assertFalse(SnapshotChange.objects.exists())
+        snapshot = MonthlySnapshot.objects.get(user=self.user, month=add_months(self.current, -1))
+        self.assertEqual((snapshot.allocated, snapshot.income, snapshot.savings), (Decimal('800.00'), Decimal('1500.00'), Decimal('700.00')))
+        self.assertEqual(self.report(), self.report(snapshots=False))
+
+        Allocation.objects.create(budget=Budget.objects.get(month=self.current), category=category_named('Fun', self.user), amount=Decimal('5.00'))
+        self.assertFalse(SnapshotChange.objects.exists())
+
+    def test_changes_past_the_watermark_stay_queued_until_rebuilt(self):
+        call_command('rollup_snapshots', stdout=StringIO())
+        last_month = add_months(self.current, -1)
+        MonthlySnapshot.objects.filter(month=last_month).delete()
+        self.last_month.amount = Decimal('300.00')
+        self.last_month.save()
+
+        self.assertEqual(drain_changes(), 0)
+        self.assertTrue(SnapshotChange.objects.filter(user=self.user, month=last_month).exists())
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.assertFalse(SnapshotChange.objects.exists())
+        self.assertEqual(MonthlySnapshot.objects.get(user=self.user, month=last_month).allocated, Decimal('800.00'))
+
+    def test_deleting_a_user_does_not_queue_rebuilds(self):
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.user.delete()
+        self.assertFalse(SnapshotChange.objects.exists())
+        self.assertFalse(MonthlySnapshot.objects.exists())
+
+
+@override_settings(FINANCE_LEDGER_CHECKPOINT_EVERY=4)
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='kamau', email='kamau@example.com', password='pass12345')
+
+    def test_balance_follows_changes_from_the_nearest_checkpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('5000.00'))
+            budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 3, 1), total_amount=Decimal('4000.00'))
+            rent = Allocation.objects.create(budget=budget, category=category_named('Rent'), amount=Decimal('1500.00'))
+            admit_allocations(budget, [Allocation(category=category_named('Food'), amount=Decimal('100.00')) for _ in range(5)])
+            rent.amount = Decimal('1800.00')
+            rent.save()
+            Allocation.objects.filter(pk=rent.pk).get().delete()
+            job.amount = Decimal('6000.00')
+            job.save()
+            # Unchanged, so nothing to record
+            job.save()
+
+        self.assertEqual(list(LedgerEntry.objects.filter(user=self.user).values_list('seq', flat=True)), list(range(1, 12)))
+        self.assertEqual(list(LedgerCheckpoint.objects.filter(user=self.user).values_list('seq', flat=True)), [4, 8])
+        with self.assertNumQueries(2):
+            current = balance(self.user.pk)
+        self.assertEqual(current, replay(self.user.pk))
+        self.assertEqual((current.seq, current.income, current.allocated, current.budgeted),
+                         (11, Decimal('6000.00'), Decimal('500.00'), Decimal('4000.00')))
+        self.assertEqual(current.savings, Decimal('5500.00'))
+        call_command('rebuild_ledger_checkpoints', '--check', stdout=StringIO())
+
+        # Bypassing the signals leaves the ledger behind the rows
+        IncomeSource.objects.filter(user=self.user).update(amount=Decimal('1.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ledger_checkpoints', '--check', stdout=StringIO())
+
+    def test_past_balances_read_the_checkpoint_before_them(self):
+        times = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for amount in range(1, 11):
+                IncomeSource.objects.create(user=self.user, source='Gig', amount=Decimal(amount))
+                times.append(timezone.now())
+        with self.assertNumQueries(2):
+            past = balance(self.user.pk, at=times[5])
+        self.assertEqual((past.seq, past.income), (6, Decimal('21.00')))
+        self.assertEqual(past, replay(self.user.pk, upto=6))
+        self.assertEqual(balance(self.user.pk, at=times[0] - datetime.timedelta(seconds=1)).income, 0)
+
+        LedgerCheckpoint.objects.all().delete()
+        self.assertEqual(balance(self.user.pk, at=times[5]), past)
+        out = StringIO()
+        call_command('rebuild_ledger_checkpoints', user=self.user.pk, stdout=out)
+        self.assertIn('Wrote 2 ledger checkpoint(s)', out.getvalue())
+
+
+class RolloverTests(TestCase):
+    month = datetime.date(2024, 7, 1)
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'roll{i}', email=f'roll{i}@example.com', password='pass12345') for i in range(3)
+        ]
+        june = Budget.objects.create(user=self.users[0], month=datetime.date(2024, 6, 1), total_amount=Decimal('9000.00'))
+        Allocation.objects.create(budget=june, category=category_named('Rent'), amount=Decimal('4000.00'))
+        Allocation.objects.create(budget=june, category=category_named('Airtime', self.users[0]), amount=Decimal('300.00'))
+        template_from_budget(june)
+        RecurringIncome.objects.create(user=self.users[0], source='Job', amount=Decimal('10000.00'))
+        RecurringIncome.objects.create(user=self.users[1], source='HELB', amount=Decimal('4000.00'))
+        RecurringBudget.objects.create(user=self.users[2], total_amount=Decimal('100.00'))
+        # Entered by hand before the job ran
+        Budget.objects.create(user=self.users[2], month=self.month, total_amount=Decimal('500.00'))
+
+    def rollover(self, *args):
+        out = StringIO()
+        call_command('rollover', '--month', f'{self.month:%Y-%m}', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rollover_creates_the_month_once(self):
+        self.assertIn('for 3 user(s): 1 budget(s), 2 allocation(s), 2 income(s)', self.rollover())
+        budget = Budget.objects.get(user=self.users[0], month=self.month)
+        self.assertEqual((budget.total_amount, budget.allocated_total, budget.allocation_count),
+                         (Decimal('9000.00'), Decimal('4300.00'), 2))
+        self.assertEqual(
+            set(budget.allocations.values_list('category__name', 'amount')),
+            {('Rent', Decimal('4000.00')), ('Airtime', Decimal('300.00'))},
+        )
+        self.assertEqual(Budget.objects.get(user=self.users[2], month=self.month).total_amount, Decimal('500.00'))
+        income = IncomeSource.objects.get(user=self.users[1])
+        self.assertEqual((income.source, timezone.localtime(income.created_at).date()), ('HELB', self.month))
+
+        self.assertEqual(list(find_drift()), [])
+        self.assertEqual(UserFinanceStats.objects.get(user=self.users[0]).budget_count, 2)
+        for user in self.users:
+            self.assertEqual(find_ledger_drift(user.pk), {})
+
+        self.assertIn('for 3 user(s): 0 budget(s), 0 allocation(s), 0 income(s)', self.rollover())
+        self.assertEqual(IncomeSource.objects.count(), 2)
+
+    def test_shards_and_batches_cover_disjoint_users(self):
+        first, second, third = (user.pk for user in self.users)
+        self.assertIn('for 1 user(s): 0 budget(s), 0 allocation(s), 1 income(s)', self.rollover('--from-user', second, '--to-user', second))
+        batches = list(roll_over(self.month, batch_size=2))
+        self.assertEqual([(batch.users, batch.last_user_id) for batch in batches], [(2, second), (1, third)])
+        self.assertEqual(sum(batch.incomes for batch in batches), 1)
+        self.assertEqual(list(roll_over(self.month, after=third)), [])
+
+    def test_templates_are_set_up_from_the_forms(self):
+        self.client.force_login(self.users[1])
+        self.client.post(reverse('finance:income_create'), {'source': 'Tutoring', 'amount': '1500.00', 'recurring': 'on'})
+        template = RecurringIncome.objects.get(source='Tutoring')
+        with mock.patch.object(IncomeSource, 'save', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('finance:income_create'), {'source': 'Gig', 'amount': '90.00', 'recurring': 'on'})
+        self.assertFalse(RecurringIncome.objects.filter(source='Gig').exists())
+        current = month_start(timezone.localdate())
+        self.assertEqual(IncomeSource.objects.get(source='Tutoring').recurring_month, current)
+        budget = Budget.objects.create(user=self.users[1], month=current, total_amount=Decimal('800.00'))
+        Allocation.objects.create(budget=budget, category=category_named('Food'), amount=Decimal('600.00'))
+        self.client.post(reverse('finance:budget_repeat', args=[budget.pk]))
+
+        RecurringIncome.objects.filter(source='HELB').update(active=False)
+        user_id = self.users[1].pk
+        self.assertEqual([(b.budgets, b.incomes) for b in roll_over(current, user_id, user_id)], [(0, 0)])
+        self.assertEqual([(b.budgets, b.incomes) for b in roll_over(add_months(current, 1), user_id, user_id)], [(1, 1)])
+        self.assertEqual(IncomeSource.objects.filter(recurring=template).count(), 2)
+        self.assertEqual(Budget.objects.get(user=self.users[1], month=add_months(current, 1)).allocated_total, Decimal('600.00'))
+        self.assertEqual(self.client.get(reverse('finance:budget_repeat', args=[budget.pk])).status_code, 405)
+
+    def test_templates_can_be_stopped(self):
+        self.client.force_login(self.users[0])
+        job = RecurringIncome.objects.get(source='Job')
+        helb = RecurringIncome.objects.get(source='HELB')
+        response = self.client.get(reverse('finance:recurring'))
+        self.assertContains(response, 'Rent - 4000.00 KSH monthly')
+        self.assertNotContains(response, 'HELB')
+
+        self.assertEqual(self.client.get(reverse('finance:recurring_income_stop', args=[job.pk])).status_code, 405)
+        # Someone else's template is not theirs to stop
+        self.assertEqual(self.client.post(reverse('finance:recurring_income_stop', args=[helb.pk])).status_code, 404)
+        self.assertRedirects(self.client.post(reverse('finance:recurring_income_stop', args=[job.pk])), reverse('finance:recurring'))
+        self.client.post(reverse('finance:recurring_budget_stop'))
+        response = self.client.get(reverse('finance:recurring'))
+        self.assertContains(response, 'No income repeats')
+        self.assertContains(response, 'No budget repeats')
+
+        user_id = self.users[0].pk
+        self.assertEqual([(b.budgets, b.incomes) for b in roll_over(self.month, user_id, user_id)], [])
+        self.assertIn('0 budget(s), 0 allocation(s), 1 income(s)', self.rollover())
+        self.assertFalse(Budget.objects.filter(user=self.users[0], month=self.month).exists())
+
+
+@override_settings(FINANCE_ARCHIVE_DIR=tempfile.mkdtemp(), FINANCE_ARCHIVE_AFTER_MONTHS=24)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='atieno', email='atieno@example.com', password='pass12345')
+        current = month_start(timezone.localdate())
+        self.old = add_months(current, -30)
+        for offset in (-30, -29, -1):
+            month = add_months(current, offset)
+            budget = Budget.objects.create(user=self.user, month=month, total_amount=Decimal('1000.00'))
+            Allocation.objects.create(budget=budget, category=category_named('Rent'), amount=Decimal('600.00'))
+            Allocation.objects.create(budget=budget, category=category_named('Chama', self.user), amount=Decimal('100.00'))
+            IncomeSource.objects.create(user=self.user, source='Job', amount=Decimal('1500.00'), created_at=self.day_in(month))
+        call_command('rollup_snapshots', stdout=StringIO())
+
+    def day_in(self, month):
+        return timezone.make_aware(datetime.datetime(month.year, month.month, 10))
+
+    def report(self):
+        return TrendReport(monthly_totals([self.user.pk])).for_user(self.user.pk)
+
+    def stats(self):
+        rebuild_stats(self.user)
+        stats = UserFinanceStats.objects.filter(user=self.user).values(
+            'budget_count', 'budget_total', 'income_count', 'income_total', 'allocated_total',
+        ).get()
+        return stats, set(CategoryStat.objects.filter(user=self.user).values_list('category_id', 'total', 'count'))
+
+    def test_old_months_leave_the_hot_tables_but_still_count(self):
+        report, stats = self.report(), self.stats()
+        out = StringIO()
+        call_command('archive_history', stdout=out)
+        self.assertIn('Archived 2 month(s)', out.getvalue())
+        self.assertEqual((Budget.objects.count(), Allocation.objects.count(), IncomeSource.objects.count()), (1, 2, 1))
+
+        archived = ArchivedMonth.objects.get(user=self.user, month=self.old)
+        self.assertTrue((archive_dir() / archived.file).exists())
+        self.assertEqual((archived.budgeted, archived.allocated, archived.income, archived.allocation_count),
+                         (Decimal('1000.00'), Decimal('700.00'), Decimal('1500.00'), 2))
+        self.assertEqual({row['category'] for row in load_month(archived)['allocations']}, {'Rent', 'Chama'})
+
+        self.assertEqual(self.report(), report)
+        self.assertEqual(self.stats(), stats)
+        self.assertEqual(list(find_drift()), [])
+        self.assertEqual(find_ledger_drift(self.user.pk), {})
+        call_command('rollup_snapshots', '--rebuild', stdout=StringIO())
+        self.assertEqual(self.report(), report)
+        self.assertEqual(archive_user(self.user.pk), 0)
+
+        self.assertEqual(len(list(export_lines('allocations', 'jsonl', user=self.user))), 2)
+        lines = list(export_lines('allocations', 'jsonl', user=self.user, archived=True))
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[2])['month'], self.old.isoformat())
+
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('finance:archive')), f"{self.old:%B %Y}")
+        self.assertContains(self.client.get(reverse('finance:archived_month', args=[self.old.year, self.old.month])), 'Chama')
+        form = BudgetForm(
+            data={'month_choice': f"{self.old.month:02d}", 'year_choice': str(self.old.year), 'total_amount': '500.00'},
+            user=self.user,
+        )
+        self.assertFalse(form.is_valid())
+
+    def test_late_rows_are_merged_into_the_archived_month(self):
+        archive_user(self.user.pk)
+        first = ArchivedMonth.objects.get(user=self.user, month=self.old)
+        IncomeSource.objects.create(user=self.user, source='Bonus', amount=Decimal('200.00'), created_at=self.day_in(self.old))
+        # Queued for a snapshot rebuild, so it stays hot until then
+        self.assertEqual(archive_user(self.user.pk), 0)
+        self.assertEqual(self.report()['months'][0]['income'], 1500.0)
+
+        call_command('rollup_snapshots', stdout=StringIO())
+        self.assertEqual(self.report()['months'][0]['income'], 1700.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_user(self.user.pk), 1)
+        merged = ArchivedMonth.objects.get(user=self.user, month=self.old)
+        self.assertEqual((merged.income, merged.income_count), (Decimal('1700.00'), 2))
+        self.assertNotEqual(merged.file, first.file)
+        self.assertFalse((archive_dir() / first.file).exists())
+        self.assertEqual(self.report()['months'][0]['income'], 1700.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse((archive_dir() / merged.file).exists())
+
+    def test_archived_month_takes_no_new_budget(self):
+        entries = LedgerEntry.objects.count()
+        archive_user(self.user.pk)
+        # Moved, not deleted: nothing is queued or recorded for the archived rows
+        self.assertEqual(LedgerEntry.objects.count(), entries)
+        self.assertFalse(SnapshotChange.objects.exists())
+
+        with self.assertRaisesMessage(ValidationError, 'has been archived'):
+            Budget.objects.create(user=self.user, month=self.old, total_amount=Decimal('500.00'))
+        budget = Budget.objects.get(user=self.user)
+        budget.month = self.old
+        with self.assertRaises(ValidationError):
+            budget.save()
+
+        RecurringBudget.objects.create(user=self.user, total_amount=Decimal('500.00'))
+        self.assertEqual([batch.budgets for batch in roll_over(self.old)], [0])
+        self.assertFalse(Budget.objects.filter(month=self.old).exists())
+
+
+class ChartAssetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='wanjiru', email='wanjiru@example.com', password='pass12345')
+        self.budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 5, 1), total_amount=Decimal('1000.00'))
+        self.client.force_login(self.user)
+
+    def test_chart_script_only_loads_on_a_budget_with_a_chart(self):
+        detail = reverse('finance:budget_detail', args=[self.budget.pk])
+        self.assertNotContains(self.client.get(reverse('finance:dashboard')), 'budget_chart.js')
+        self.assertNotContains(self.client.get(detail), 'budget_chart.js')
+
+        Allocation.objects.create(budget=self.budget, category=category_named('Food'), amount=Decimal('300.00'))
+        response = self.client.get(detail)
+        self.assertContains(response, '<script defer src="/static/js/budget_chart.js"></script>', html=True)
+        # Every script comes from our own static files
+        self.assertNotRegex(response.content.decode(), r'<script[^>]+src="(https?:)?//')
+
+
+class BenchmarkTests(TestCase):
+    def test_seeded_dataset_is_consistent(self):
+        users = seed_dataset(users=3, budgets=4, allocations=5, incomes=6, seed=7)
+        self.assertEqual([len(user.budget_ids) for user in users], [4, 4, 4])
+        self.assertEqual(Allocation.objects.count(), 3 * 4 * 5)
+        self.assertEqual(list(find_drift()), [])
+        stats = UserFinanceStats.objects.get(user_id=users[0].pk)
+        self.assertEqual(stats.income_count, 6)
+        self.assertEqual(stats.budget_count, 4)
+        for budget in Budget.objects.all():
+            self.assertLess(budget.allocated_total, budget.total_amount)
+
+    def test_scenario_reports_latency_and_queries(self):
+        users = seed_dataset(users=1, budgets=2, allocations=2, incomes=2)
+        row = run_scenario(SCENARIOS['budget_detail'], users, requests=6)
+        self.assertEqual((row['requests'], row['errors']), (6, 0))
+        self.assertLessEqual(row['latency_ms']['p50'], row['latency_ms']['p99'])
+        self.assertGreater(row['queries']['mean'], 0)
+
+        worse = {**row, 'queries': {'mean': row['queries']['mean'] + 1, 'max': 0}}
+        changes = {field: regressed for _, field, _, _, regressed in compare({'results': [row]}, {'results': [worse]})}
+        self.assertEqual(changes, {'p95_ms': False, 'throughput_rps': False, 'queries': True})
+
+
+class AllocationAdmissionTests(TransactionTestCase):
+    threads = 16
+    attempts_per_thread = 10
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='brian', email='brian@example.com', password='pass12345')
+
+    def _hammer(self, budget, insert):
+        food = category_named('Food')
+        start = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.attempts_per_thread):
+                    try:
+                        insert(Allocation(budget=budget, category=food, amount=Decimal('10.00')))
+                    except BudgetExceeded:
+                        pass
+            except Exception as exc:  # surfaced in the main thread below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        # Lock contention never escapes the retries
+        self.assertEqual(errors, [])
+
+    def test_concurrent_admission_never_overcommits(self):
+        budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 6, 1), total_amount=Decimal('500.00'))
+        self._hammer(budget, admit_allocation)
+
+        budget.refresh_from_db()
+        self.assertEqual(Allocation.objects.filter(budget=budget).count(), 50)
+        self.assertEqual(budget.allocated_total, Decimal('500.00'))
+        self.assertEqual(budget.allocation_count, 50)
+
+    def test_every_admission_that_fits_lands_once(self):
+        # Timing against unlocked inserts is left to the allocation_create scenario of manage.py benchmark
+        budget = Budget.objects.create(user=self.user, month=datetime.date(2024, 7, 1), total_amount=Decimal('100000.00'))
+        self._hammer(budget, admit_allocation)
+
+        budget.refresh_from_db()
+        rows = Allocation.objects.filter(budget=budget).aggregate(total=Sum('amount'), count=Count('id'))
+        self.assertEqual(rows['count'], self.threads * self.attempts_per_thread)
+        self.assertEqual((budget.allocated_total, budget.allocation_count), (rows['total'], rows['count']))
+
+    def test_lock_contention_is_retried_a_bounded_number_of_times(self):
+        locked = OperationalError('database is locked')
+        admit = mock.Mock(side_effect=[locked, locked, 'admitted'])
+        with mock.patch('finance.rollups.time.sleep') as sleep:
+            self.assertEqual(with_lock_retries(admit, retries=3), 'admitted')
+        self.assertEqual((admit.call_count, sleep.call_count), (3, 2))
+
+        admit = mock.Mock(side_effect=locked)
+        with mock.patch('finance.rollups.time.sleep'), self.assertRaises(OperationalError):
+            with_lock_retries(admit, retries=3)
+        self.assertEqual(admit.call_count, 3)
+
+        # Only lock contention is retried
+        admit = mock.Mock(side_effect=OperationalError('no such table'))
+        with self.assertRaises(OperationalError):
+            with_lock_retries(admit)
+        self.assertEqual(admit.call_count, 1)
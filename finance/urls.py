@@ -1,13 +1,29 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'finance'
 
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
     path('income/create/', views.IncomeCreateView.as_view(), name='income_create'),
+    path('import/', views.statement_import_view, name='statement_import'),
+    path('reports/', views.reports_view, name='reports'),
+    path('archive/', views.archive_view, name='archive'),
+    path('archive/<int:year>/<int:month>/', views.archived_month_view, name='archived_month'),
     path('budget/create/', views.BudgetCreateView.as_view(), name='budget_create'),
-    path('budget/<int:pk>/', views.BudgetDetailView.as_view(), name='budget_detail'),
+    path('budget/<int:pk>/', views.budget_detail_view, name='budget_detail'),
+    path('budget/<int:pk>/repeat/', views.budget_repeat_view, name='budget_repeat'),
+    path('recurring/', views.recurring_view, name='recurring'),
+    path('recurring/income/<int:pk>/stop/', views.recurring_income_stop_view, name='recurring_income_stop'),
+    path('recurring/budget/stop/', views.recurring_budget_stop_view, name='recurring_budget_stop'),
     path('budget/<int:budget_id>/allocate/', views.AllocationCreateView.as_view(), name='allocation_create'),
+    path('budget/<int:budget_id>/allocate/bulk/', views.AllocationBulkCreateView.as_view(), name='allocation_bulk_create'),
+    path('export/<str:dataset>.<str:fmt>', views.export_view, name='export'),
     path('get-total-income/', views.get_total_income, name='get_total_income'),
+    path('api/dashboard/', api.dashboard_api, name='api_dashboard'),
+    path('api/budgets/<int:pk>/', api.budget_summary_api, name='api_budget_summary'),
+    path('api/budgets/<int:pk>/allocations/', api.budget_allocations_api, name='api_budget_allocations'),
+    path('api/budgets/<int:pk>/allocations/bulk/', api.bulk_allocations_api, name='api_bulk_allocations'),
+    path('api/income/total/', api.income_total_api, name='api_income_total'),
+    path('api/reports/trends/', api.trend_report_api, name='api_trend_report'),
 ]
\ No newline at end of file
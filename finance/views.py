@@ -1,31 +1,57 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.views.generic import CreateView, DetailView
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.decorators.http import require_POST
+from django.views.generic import CreateView, FormView
 from django.contrib import messages
+from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.template.response import TemplateResponse
+import datetime
+import io
 import logging
+from decimal import Decimal, InvalidOperation
 
-from .models import Budget, IncomeSource, Allocation  # Add Allocation to the import
-from .forms import IncomeForm, BudgetForm, AllocationForm  # Import IncomeForm, BudgetForm, and AllocationForm
+from .models import ArchivedMonth, Budget, IncomeSource, Allocation, RecurringBudget, RecurringIncome
+from .forms import IncomeForm, BudgetForm, AllocationForm, AllocationFormSet, StatementImportForm
+from .api import abudget_for, aincome_etag, aincome_last_modified, cached_income_totals, money
+from .archive import load_month
+from .cache import get_summary_cache
+from .decorators import async_condition, async_login_required
+from .exports import DATASETS, FORMATS, export_lines
+from .imports import StatementFormatError, StatementImporter
+from .pagination import decode_cursor
+from .periods import add_months, month_start
+from .reports import TrendReport
+from .rollover import template_from_budget
+from .rollups import BudgetExceeded, admit_allocation, admit_allocations
+from .suggestions import suggest_budget
+from .summaries import adashboard_page
 
 logger = logging.getLogger(__name__)
 
-@login_required
-def dashboard_view(request):
-    budgets = Budget.objects.filter(user=request.user).order_by('-created_at')
-    latest_budget = budgets.first() if budgets.exists() else None
-    context = {'budgets': budgets}
+@async_login_required
+async def dashboard_view(request):
+    user = await request.auser()
+    cursor = request.GET.get('after')
+    if cursor and decode_cursor(cursor) is None:
+        cursor = None
+    page = await get_summary_cache().aget_or_compute(
+        user.pk, 'dashboard', cursor or 'first', lambda: adashboard_page(user, cursor),
+    )
+    latest_budget = page['latest_budget']
+    context = {'budgets': page['budgets'], 'next_cursor': page['next_cursor'], 'is_first_page': not cursor}
     if latest_budget:
-        total_allocated = sum(alloc.amount for alloc in latest_budget.allocations.all())
-        savings = latest_budget.total_amount - total_allocated
-        over_budget_amount = abs(savings) if savings < 0 else 0
         context.update({
             'latest_budget': latest_budget,
-            'total_allocated': total_allocated,
-            'savings': savings,
-            'over_budget_amount': over_budget_amount,
+            'total_allocated': latest_budget.allocated_total,
+            'savings': latest_budget.savings,
+            'over_budget_amount': latest_budget.over_budget_amount,
         })
-    return render(request, 'finance/dashboard.html', context)
+    # Rendered by the handler, off the event loop, like any TemplateResponse
+    return TemplateResponse(request, 'finance/dashboard.html', context)
 
 class IncomeCreateView(CreateView):
     model = IncomeSource
@@ -34,92 +60,227 @@ class IncomeCreateView(CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        response = super().form_valid(form)
+        # A template without its first income would still roll over every month
+        with transaction.atomic():
+            if form.cleaned_data['recurring']:
+                # This month's row counts as the template's, so the rollover skips it
+                form.instance.recurring = RecurringIncome.objects.create(
+                    user=self.request.user, source=form.instance.source, amount=form.instance.amount,
+                )
+                form.instance.recurring_month = month_start(timezone.localdate())
+            response = super().form_valid(form)
         messages.success(self.request, f"Added income from {form.instance.source} of {form.instance.amount} KSH.")
         return response
 
     def get_success_url(self):
-        # Calculate total income for this user and redirect to budget creation
-        total_income = sum(income.amount for income in IncomeSource.objects.filter(user=self.request.user))
-        return reverse('finance:budget_create') + f'?suggested_amount={total_income}'
+        # The budget form pre-fills itself from the user's suggestion stats
+        return reverse('finance:budget_create')
 
-class BudgetCreateView(CreateView):
+class BudgetCreateView(LoginRequiredMixin, CreateView):
     model = Budget
     form_class = BudgetForm
     template_name = 'finance/budget_create.html'
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def get_suggestion(self):
+        if not hasattr(self, '_suggestion'):
+            self._suggestion = suggest_budget(self.request.user)
+        return self._suggestion
+
     def get_initial(self):
         initial = super().get_initial()
-        suggested_amount = self.request.GET.get('suggested_amount')
-        if suggested_amount:
-            initial['total_amount'] = float(suggested_amount)
+        try:
+            suggested_amount = Decimal(self.request.GET.get('suggested_amount', ''))
+        except InvalidOperation:
+            suggested_amount = None
+        if suggested_amount is not None and suggested_amount.is_finite() and suggested_amount > 0:
+            initial['total_amount'] = suggested_amount
+        elif self.get_suggestion():
+            initial['total_amount'] = self.get_suggestion()['total']
         return initial
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['suggestion'] = self.get_suggestion()
+        return context
+
     def form_valid(self, form):
         form.instance.user = self.request.user
         response = super().form_valid(form)
         messages.success(self.request, "Budget created! Now add allocations.")
-        logger.info(f"User {self.request.user.username} created budget for {form.instance.month}")
+        logger.info(f"User {self.request.user.username} created budget for {form.instance.month:%Y-%m}")
         return response
 
     def get_success_url(self):
         return reverse('finance:budget_detail', kwargs={'pk': self.object.pk})
 
-class AllocationCreateView(CreateView):
+class BudgetAllocationMixin:
+    """Loads the URL's budget once per request for the allocation views."""
+
+    def get_budget(self):
+        if not hasattr(self, '_budget'):
+            self._budget = get_object_or_404(Budget, pk=self.kwargs['budget_id'], user=self.request.user)
+        return self._budget
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['budget'] = self.get_budget()
+        return context
+
+    def get_success_url(self):
+        return reverse('finance:budget_detail', kwargs={'pk': self.kwargs['budget_id']})
+
+class AllocationCreateView(BudgetAllocationMixin, CreateView):
     model = Allocation
     form_class = AllocationForm
     template_name = 'finance/allocation_create.html'
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        kwargs['budget'] = get_object_or_404(Budget, pk=self.kwargs['budget_id'], user=self.request.user)
+        kwargs['budget'] = self.get_budget()
         return kwargs
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['budget'] = get_object_or_404(Budget, pk=self.kwargs['budget_id'], user=self.request.user)
-        return context
-
     def form_valid(self, form):
-        form.instance.budget = get_object_or_404(Budget, pk=self.kwargs['budget_id'], user=self.request.user)
-        response = super().form_valid(form)
-        messages.success(self.request, f"Allocated {form.instance.amount} KSH to {form.instance.category}")
-        logger.info(f"User {self.request.user.username} allocated {form.instance.amount} KSH to {form.instance.category}")
+        form.instance.budget = self.get_budget()
+        try:
+            self.object = admit_allocation(form.save(commit=False))
+        except BudgetExceeded as exc:
+            # Another request used up the remaining budget after form.clean ran
+            form.add_error(None, str(exc))
+            return self.form_invalid(form)
+        response = HttpResponseRedirect(self.get_success_url())
+        messages.success(self.request, f"Allocated {form.instance.amount} KSH to {form.instance.category_name}")
+        logger.info(f"User {self.request.user.username} allocated {form.instance.amount} KSH to {form.instance.category_name}")
         return response
 
-    def get_success_url(self):
-        return reverse('finance:budget_detail', kwargs={'pk': self.kwargs['budget_id']})
+class AllocationBulkCreateView(BudgetAllocationMixin, FormView):
+    form_class = AllocationFormSet
+    template_name = 'finance/allocation_bulk_create.html'
 
-class BudgetDetailView(DetailView):
-    model = Budget
-    template_name = 'finance/budget_detail.html'
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['budget'] = self.get_budget()
+        kwargs['form_kwargs'] = {'user': self.request.user}
+        return kwargs
 
-    def get_object(self):
-        return get_object_or_404(Budget, pk=self.kwargs['pk'], user=self.request.user)
+    def form_valid(self, formset):
+        try:
+            created = admit_allocations(self.get_budget(), formset.allocations())
+        except BudgetExceeded as exc:
+            formset.non_form_errors().append(str(exc))
+            return self.form_invalid(formset)
+        messages.success(self.request, f"Added {len(created)} allocations.")
+        logger.info(f"User {self.request.user.username} bulk-allocated {len(created)} items to budget {self.get_budget().pk}")
+        return HttpResponseRedirect(self.get_success_url())
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        allocations = self.object.allocations.all()
-        total_allocated = sum(alloc.amount for alloc in allocations)
-        savings = self.object.total_amount - total_allocated
-        context['allocations'] = allocations
-        context['total_allocated'] = total_allocated
-        context['savings'] = savings
-        context['over_budget'] = total_allocated > self.object.total_amount
-        context['near_limit'] = total_allocated / self.object.total_amount > 0.8 if self.object.total_amount > 0 else False
-        context['over_budget_amount'] = abs(savings) if savings < 0 else 0
-        context['chart_data'] = {
-            'labels': [alloc.category for alloc in allocations] + (['Savings'] if savings > 0 else []),
-            'data': [float(alloc.amount) for alloc in allocations] + ([float(savings)] if savings > 0 else []),
-        }
-        return context
+@async_login_required
+async def budget_detail_view(request, pk):
+    budget, summary = await abudget_for(request, pk)
+    return TemplateResponse(request, 'finance/budget_detail.html', {'budget': budget, 'object': budget, **summary})
+
+@login_required
+@require_POST
+def budget_repeat_view(request, pk):
+    budget = get_object_or_404(Budget, pk=pk, user=request.user)
+    template_from_budget(budget)
+    messages.success(request, f"Your budget and allocations for {budget.month:%B %Y} will be created again every month.")
+    return redirect('finance:budget_detail', pk=budget.pk)
+
+@login_required
+def recurring_view(request):
+    incomes = RecurringIncome.objects.filter(user=request.user, active=True).order_by('source', 'pk')
+    budget = RecurringBudget.objects.filter(user=request.user, active=True).prefetch_related('allocations').first()
+    return render(request, 'finance/recurring.html', {'incomes': incomes, 'budget': budget})
+
+@login_required
+@require_POST
+def recurring_income_stop_view(request, pk):
+    template = get_object_or_404(RecurringIncome, pk=pk, user=request.user, active=True)
+    template.active = False
+    template.save(update_fields=['active'])
+    messages.success(request, f"Income from {template.source} will no longer be added every month.")
+    return redirect('finance:recurring')
+
+@login_required
+@require_POST
+def recurring_budget_stop_view(request):
+    if RecurringBudget.objects.filter(user=request.user, active=True).update(active=False):
+        messages.success(request, "Your budget will no longer be created every month.")
+    return redirect('finance:recurring')
     
     
     
     
 from django.http import JsonResponse
 
+@async_login_required
+@async_condition(etag_func=aincome_etag, last_modified_func=aincome_last_modified)
+async def get_total_income(request):
+    totals = await cached_income_totals(await request.auser())
+    return JsonResponse({'total': money(totals['total'])})
+
+@login_required
+def export_view(request, dataset, fmt):
+    if dataset not in DATASETS or fmt not in FORMATS:
+        raise Http404("Unknown export")
+    archived = request.GET.get('archived') == '1'
+    response = StreamingHttpResponse(
+        export_lines(dataset, fmt, user=request.user, archived=archived), content_type=FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="pesaplan-{dataset}.{fmt}"'
+    logger.info(f"User {request.user.username} exported {dataset} as {fmt}")
+    return response
+
+@login_required
+def statement_import_view(request):
+    if request.method == 'POST':
+        form = StatementImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            stream = io.TextIOWrapper(form.cleaned_data['statement'].file, encoding='utf-8-sig', newline='')
+            try:
+                reports = list(StatementImporter(request.user).run(stream))
+            except StatementFormatError as exc:
+                form.add_error('statement', str(exc))
+            else:
+                incomes = sum(report.incomes for report in reports)
+                allocations = sum(report.allocations for report in reports)
+                duplicates = sum(report.duplicates for report in reports)
+                errors = [error for report in reports for error in report.errors]
+                messages.success(request, f"Imported {incomes} income and {allocations} allocation entries ({duplicates} already imported).")
+                for line, message in errors[:5]:
+                    messages.warning(request, f"Line {line}: {message}")
+                if len(errors) > 5:
+                    messages.warning(request, f"{len(errors) - 5} more lines could not be imported.")
+                logger.info(f"User {request.user.username} imported a statement: {incomes} income, {allocations} allocations, {len(errors)} errors")
+                return redirect('finance:dashboard')
+    else:
+        form = StatementImportForm()
+    return render(request, 'finance/statement_import.html', {'form': form})
+
+REPORT_MONTHS = 24
+
+@login_required
+def reports_view(request):
+    end = month_start(timezone.localdate())
+    start = add_months(end, -(REPORT_MONTHS - 1))
+    report = get_summary_cache().get_or_compute(
+        request.user.pk, 'report', f"{start:%Y%m}", lambda: TrendReport.build([request.user.pk], start, end).for_user(request.user.pk),
+    )
+    return render(request, 'finance/reports.html', {'report': report, 'months': list(reversed(report['months']))})
+
+@login_required
+def archive_view(request):
+    months = ArchivedMonth.objects.filter(user=request.user).order_by('-month')
+    return render(request, 'finance/archive.html', {'months': months})
+
 @login_required
-def get_total_income(request):
-    total = sum(income.amount for income in IncomeSource.objects.filter(user=request.user))
-    return JsonResponse({'total': total if total > 0 else 0})
\ No newline at end of file
+def archived_month_view(request, year, month):
+    if not 1 <= month <= 12:
+        raise Http404("No such month")
+    archived = get_object_or_404(ArchivedMonth, user=request.user, month=datetime.date(year, month, 1))
+    data = load_month(archived)
+    return render(request, 'finance/archived_month.html', {'archived': archived, **data})
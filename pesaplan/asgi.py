@@ -2,6 +2,9 @@
 ASGI config for pesaplan project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn pesaplan.asgi:application``) so
+the async finance API views run on the event loop; ``manage.py loadtest_api``
+compares this path against WSGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -0,0 +1,32 @@
+"""
+SQLite backend with per-connection PRAGMAs and immediate write transactions.
+
+``OPTIONS['pragmas']`` is applied to every new connection, e.g. WAL
+journaling and a busy timeout so writers wait for the lock instead of
+failing with "database is locked". ``OPTIONS['transaction_mode']`` set to
+``'IMMEDIATE'`` makes ``atomic()`` take the write lock when it begins. A
+deferred transaction that reads first and writes later cannot wait out a
+concurrent writer, so it fails immediately whatever the busy timeout.
+Django 5.1 grows the same ``transaction_mode`` option natively.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
+        else:
+            super()._start_transaction_under_autocommit()
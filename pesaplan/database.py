@@ -0,0 +1,96 @@
+"""
+Environment-driven database profiles for ``settings.DATABASES``.
+
+``PESAPLAN_DB`` picks the profile:
+
+``sqlite`` (default)
+    The file at ``PESAPLAN_DB_NAME`` (``db.sqlite3`` in the project). The
+    database runs in WAL mode so readers never block the writer, with a
+    busy timeout (``PESAPLAN_SQLITE_BUSY_TIMEOUT`` ms) and
+    ``synchronous=NORMAL``. Write transactions start ``IMMEDIATE``.
+``postgres``
+    ``PESAPLAN_DB_NAME/USER/PASSWORD/HOST/PORT``. By default connections
+    are persistent (``PESAPLAN_DB_CONN_MAX_AGE`` seconds). With
+    ``PESAPLAN_DB_POOL=1`` they come from psycopg's pool instead; that
+    needs Django 5.1+ and ``psycopg[pool]``. On older Django, put PgBouncer
+    in front and keep persistent connections.
+
+Both profiles turn on ``CONN_HEALTH_CHECKS``, so a persistent connection
+the server dropped is replaced at the start of the next request instead
+of failing it.
+"""
+import os
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -16000,  # KiB, i.e. 16 MB per connection
+}
+
+
+def _flag(environ, name, default=False):
+    return environ.get(name, '1' if default else '0').lower() in ('1', 'true', 'yes', 'on')
+
+
+def sqlite_profile(base_dir, environ):
+    pragmas = dict(SQLITE_PRAGMAS)
+    pragmas['busy_timeout'] = int(environ.get('PESAPLAN_SQLITE_BUSY_TIMEOUT', 5000))
+    pragmas['synchronous'] = environ.get('PESAPLAN_SQLITE_SYNCHRONOUS', pragmas['synchronous'])
+    return {
+        'ENGINE': 'pesaplan.backends.sqlite3',
+        'NAME': environ.get('PESAPLAN_DB_NAME', base_dir / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(environ.get('PESAPLAN_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        # A file rather than the in-memory default: shared-cache memory
+        # databases fail on lock contention at once instead of waiting out
+        # busy_timeout, which makes the concurrency tests flaky
+        'TEST': {'NAME': environ.get('PESAPLAN_TEST_DB_NAME', str(base_dir / 'test_db.sqlite3'))},
+        'OPTIONS': {
+            'pragmas': pragmas,
+            'transaction_mode': 'IMMEDIATE' if _flag(environ, 'PESAPLAN_SQLITE_IMMEDIATE', True) else None,
+        },
+    }
+
+
+def postgres_profile(environ):
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('PESAPLAN_DB_NAME', 'pesaplan'),
+        'USER': environ.get('PESAPLAN_DB_USER', ''),
+        'PASSWORD': environ.get('PESAPLAN_DB_PASSWORD', ''),
+        'HOST': environ.get('PESAPLAN_DB_HOST', ''),
+        'PORT': environ.get('PESAPLAN_DB_PORT', ''),
+        'CONN_MAX_AGE': int(environ.get('PESAPLAN_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(environ.get('PESAPLAN_DB_CONNECT_TIMEOUT', 5)),
+        },
+    }
+    if _flag(environ, 'PESAPLAN_DB_POOL'):
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured(
+                "PESAPLAN_DB_POOL needs Django 5.1 or newer; use PgBouncer with persistent connections instead."
+            )
+        # Pooled connections are returned after every request, so Django
+        # must not also keep them open
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {
+            'min_size': int(environ.get('PESAPLAN_DB_POOL_MIN', 2)),
+            'max_size': int(environ.get('PESAPLAN_DB_POOL_MAX', 10)),
+            'timeout': int(environ.get('PESAPLAN_DB_POOL_TIMEOUT', 10)),
+        }
+    return config
+
+
+def database_config(base_dir, environ=os.environ):
+    """Return the ``DATABASES['default']`` dict for the ``PESAPLAN_DB`` profile."""
+    profile = environ.get('PESAPLAN_DB', 'sqlite')
+    if profile == 'sqlite':
+        return sqlite_profile(base_dir, environ)
+    if profile == 'postgres':
+        return postgres_profile(environ)
+    raise ImproperlyConfigured(f"Unknown PESAPLAN_DB profile {profile!r}; expected 'sqlite' or 'postgres'.")
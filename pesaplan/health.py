@@ -0,0 +1,35 @@
+"""
+Liveness endpoint for load balancers and uptime checks.
+
+Each configured database is asked for ``SELECT 1``. A persistent
+connection that has gone stale is first closed and reopened, which is the
+same replacement ``CONN_HEALTH_CHECKS`` performs at the start of a request.
+"""
+import time
+
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+
+
+def check_database(alias):
+    connection = connections[alias]
+    started = time.perf_counter()
+    try:
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except DatabaseError as exc:
+        return {'ok': False, 'error': str(exc)}
+    return {'ok': True, 'vendor': connection.vendor, 'ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+@never_cache
+@require_GET
+def health_view(request):
+    databases = {alias: check_database(alias) for alias in connections}
+    healthy = all(result['ok'] for result in databases.values())
+    return JsonResponse({'status': 'ok' if healthy else 'unavailable', 'databases': databases}, status=200 if healthy else 503)
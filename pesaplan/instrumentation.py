@@ -0,0 +1,304 @@
+"""
+Per-request performance instrumentation.
+
+``PerformanceMiddleware`` samples ``PERF_SAMPLE_RATE`` of requests. For
+each sampled request it records wall time, the number and total time of
+SQL queries, template render time and response size. The result is
+logged to ``pesaplan.instrumentation`` and added to in-process counters.
+
+- A request slower than ``PERF_SLOW_REQUEST_MS`` is logged as a warning.
+- So is one that repeats a statement ``PERF_N_PLUS_ONE_THRESHOLD`` times
+  or more, which is the usual sign of an N+1 query.
+- With ``PERF_METRICS_ENABLED``, ``metrics_view`` serves the counters in
+  the Prometheus text format, together with the summary cache hit rate.
+  The counters are per process, so scrape each worker.
+
+Queries are timed by a database execute wrapper. The recorder is
+installed once on every connection and finds the current request through
+a context variable, not through a per-request ``execute_wrapper`` block.
+Async views run their ORM calls on another thread with its own
+connection, and the context variable follows them there. Templates are
+timed by the ``DjangoTemplates`` backend below, which only measures
+top-level renders, so ``{% include %}`` is not counted twice.
+
+An unsampled request costs one ``random()`` call, plus one context
+variable lookup per query.
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template.backends import django as django_backend
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_current = ContextVar('pesaplan_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.statements[sql] += 1
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def _install_recorder(connection, **kwargs):
+    # Put it first: execute_wrapper() blocks pop the last wrapper on exit,
+    # which must stay theirs even if this connection was opened inside one
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def install_query_recorder():
+    connection_created.connect(_install_recorder, dispatch_uid='pesaplan.instrumentation')
+    for connection in connections.all(initialized_only=True):
+        _install_recorder(connection)
+
+
+@contextmanager
+def measure():
+    """Yield a ``RequestMetrics`` that collects the queries and renders of the block."""
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+class Template:
+    """Times ``render`` and defers everything else to the wrapped template."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self._template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock template backend, with render time reported to the middleware."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
+
+
+class Registry:
+    """Aggregated request metrics for the Prometheus endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.sums = defaultdict(float)
+            self.slow = Counter()
+            self.n_plus_one = Counter()
+
+    def observe(self, record):
+        view = record['view']
+        with self._lock:
+            self.requests[view, record['method'], record['status']] += 1
+            buckets = self.buckets[view]
+            duration = record['duration_ms'] / 1000
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            self.sums[view, 'duration'] += duration
+            self.sums[view, 'db'] += record['db_ms'] / 1000
+            self.sums[view, 'queries'] += record['queries']
+            self.sums[view, 'template'] += record['template_ms'] / 1000
+            self.sums[view, 'bytes'] += record['bytes'] or 0
+            self.slow[view] += record['slow']
+            self.n_plus_one[view] += bool(record['repeated_query'])
+
+    def render(self):
+        with self._lock:
+            counts = Counter()
+            for (view, method, status), count in self.requests.items():
+                counts[view] += count
+            lines = [
+                '# HELP pesaplan_requests_total Sampled requests by view, method and status.',
+                '# TYPE pesaplan_requests_total counter',
+            ]
+            lines += [
+                f'pesaplan_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}'
+                for (view, method, status), count in sorted(self.requests.items())
+            ]
+            lines += [
+                '# HELP pesaplan_request_duration_seconds Wall time of sampled requests.',
+                '# TYPE pesaplan_request_duration_seconds histogram',
+            ]
+            for view, buckets in sorted(self.buckets.items()):
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f'pesaplan_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'pesaplan_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {counts[view]}')
+                lines.append(f'pesaplan_request_duration_seconds_sum{{view="{view}"}} {self.sums[view, "duration"]:.6f}')
+                lines.append(f'pesaplan_request_duration_seconds_count{{view="{view}"}} {counts[view]}')
+            for name, key, help_text in (
+                ('db_queries_total', 'queries', 'SQL queries run by sampled requests.'),
+                ('db_duration_seconds_total', 'db', 'Time spent in SQL by sampled requests.'),
+                ('template_render_seconds_total', 'template', 'Time spent rendering templates.'),
+                ('response_bytes_total', 'bytes', 'Response body bytes of sampled requests.'),
+            ):
+                lines += [f'# HELP pesaplan_{name} {help_text}', f'# TYPE pesaplan_{name} counter']
+                lines += [
+                    f'pesaplan_{name}{{view="{view}"}} {self.sums[view, key]:g}' for view in sorted(counts)
+                ]
+            for name, counter, help_text in (
+                ('slow_requests_total', self.slow, 'Sampled requests over PERF_SLOW_REQUEST_MS.'),
+                ('n_plus_one_total', self.n_plus_one, 'Sampled requests that repeated one statement too often.'),
+            ):
+                lines += [f'# HELP pesaplan_{name} {help_text}', f'# TYPE pesaplan_{name} counter']
+                lines += [f'pesaplan_{name}{{view="{view}"}} {counter[view]}' for view in sorted(counts)]
+        return lines
+
+
+registry = Registry()
+
+
+def _sampled():
+    rate = settings.PERF_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_query_recorder()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not _sampled():
+            return self.get_response(request)
+        with measure() as metrics:
+            response = self.get_response(request)
+        report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not _sampled():
+            return await self.get_response(request)
+        with measure() as metrics:
+            response = await self.get_response(request)
+        report(request, response, metrics)
+        return response
+
+
+def report(request, response, metrics):
+    """Log one sampled request and add it to the registry; returns the record."""
+    duration = time.perf_counter() - metrics.started
+    if response.streaming:
+        size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+    else:
+        size = len(response.content)
+    match = request.resolver_match
+    repeated_sql, repeats = metrics.statements.most_common(1)[0] if metrics.statements else ('', 0)
+    record = {
+        'view': match.view_name if match else '<unresolved>',
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': metrics.queries,
+        'db_ms': round(metrics.db_time * 1000, 2),
+        'template_ms': round(metrics.template_time * 1000, 2),
+        'bytes': size,
+        'slow': duration * 1000 >= settings.PERF_SLOW_REQUEST_MS,
+        'repeated_query': repeats if repeats >= settings.PERF_N_PLUS_ONE_THRESHOLD else 0,
+    }
+    registry.observe(record)
+
+    summary = (
+        f"{record['method']} {record['path']} {record['status']} view={record['view']} "
+        f"{record['duration_ms']:.1f}ms queries={record['queries']} db={record['db_ms']:.1f}ms "
+        f"templates={record['template_ms']:.1f}ms bytes={record['bytes']}"
+    )
+    if record['slow']:
+        logger.warning(f"Slow request: {summary}", extra={'perf': record})
+    if record['repeated_query']:
+        logger.warning(
+            f"Possible N+1: {summary}; ran {repeats}x: {repeated_sql[:200]}",
+            extra={'perf': record, 'sql': repeated_sql},
+        )
+    if not (record['slow'] or record['repeated_query']):
+        logger.info(summary, extra={'perf': record})
+    return record
+
+
+@never_cache
+@require_GET
+def metrics_view(request):
+    """Prometheus exposition of the sampled request metrics and the summary cache."""
+    if not settings.PERF_METRICS_ENABLED:
+        raise Http404
+    token = settings.PERF_METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    from finance.cache import get_summary_cache
+
+    lines = registry.render()
+    stats = get_summary_cache().stats()
+    lines += [
+        '# HELP pesaplan_summary_cache_requests_total Summary cache lookups by result.',
+        '# TYPE pesaplan_summary_cache_requests_total counter',
+        f'pesaplan_summary_cache_requests_total{{result="hit"}} {stats["hits"]}',
+        f'pesaplan_summary_cache_requests_total{{result="miss"}} {stats["misses"]}',
+    ]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
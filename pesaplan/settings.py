@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,11 +46,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pesaplan.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,7 +62,8 @@ AUTH_USER_MODEL = 'accounts.User'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The stock backend, with render time reported to PerformanceMiddleware
+        'BACKEND': 'pesaplan.instrumentation.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -77,12 +82,78 @@ WSGI_APPLICATION = 'pesaplan.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+# Profile chosen by PESAPLAN_DB ('sqlite' or 'postgres'); see pesaplan/database.py
 
 DATABASES = {
+    'default': database_config(BASE_DIR),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# PESAPLAN_REDIS_URL puts the default cache in Redis (needs the redis
+# package), shared by every worker. Without it the default cache lives in
+# each process, which is only right for a single worker
+_REDIS_URL = os.environ.get('PESAPLAN_REDIS_URL')
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': _REDIS_URL,
+    } if _REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'finance_files': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('PESAPLAN_CACHE_DIR', BASE_DIR / 'var' / 'cache'),
+    },
+}
+
+# Worker processes serving the app (gunicorn reads the same variable).
+# With more than one, caches that hold invalidation state must be shared,
+# and the finance.E001 system check refuses per-process ones
+WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Budget/dashboard summary cache: the alias of a cache above ('default',
+# 'finance_files'), or 'lru' for a bounded in-process LRU. Its per-user
+# versions retire stale summaries, so every worker must share it
+FINANCE_SUMMARY_CACHE = os.environ.get('PESAPLAN_SUMMARY_CACHE', 'default')
+FINANCE_SUMMARY_CACHE_SIZE = int(os.environ.get('PESAPLAN_SUMMARY_CACHE_SIZE', 2048))
+FINANCE_SUMMARY_CACHE_TIMEOUT = 60 * 60
+# Holds the category registry version (finance/categories.py); every
+# worker must see the same one for new and renamed categories to reach
+# them all, so finance.E001 refuses a per-process cache here too
+FINANCE_CATEGORY_CACHE = os.environ.get('PESAPLAN_CATEGORY_CACHE', 'default')
+# Write a LedgerCheckpoint every this many ledger entries per user; balance
+# reads sum at most this many entries past the nearest checkpoint
+FINANCE_LEDGER_CHECKPOINT_EVERY = int(os.environ.get('PESAPLAN_LEDGER_CHECKPOINT_EVERY', 256))
+# Months older than this many are moved out of the hot tables into
+# compressed per-user files by `manage.py archive_history` (finance/archive.py)
+FINANCE_ARCHIVE_DIR = os.environ.get('PESAPLAN_ARCHIVE_DIR', BASE_DIR / 'var' / 'archive')
+FINANCE_ARCHIVE_AFTER_MONTHS = int(os.environ.get('PESAPLAN_ARCHIVE_AFTER_MONTHS', 24))
+
+
+# Request instrumentation (pesaplan/instrumentation.py). Sampled requests
+# are logged; slow ones and likely N+1 query patterns as warnings
+PERF_SAMPLE_RATE = float(os.environ.get('PESAPLAN_PERF_SAMPLE_RATE', 0))
+PERF_SLOW_REQUEST_MS = int(os.environ.get('PESAPLAN_PERF_SLOW_MS', 500))
+PERF_N_PLUS_ONE_THRESHOLD = int(os.environ.get('PESAPLAN_PERF_N_PLUS_ONE', 10))
+# Serve the Prometheus metrics at /metrics/, behind a bearer token when set
+PERF_METRICS_ENABLED = os.environ.get('PESAPLAN_PERF_METRICS', '0') == '1'
+PERF_METRICS_TOKEN = os.environ.get('PESAPLAN_PERF_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'pesaplan.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('PESAPLAN_PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
 
 
@@ -104,6 +175,56 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Session storage chosen by PESAPLAN_SESSION_ENGINE: 'db' (the default),
+# 'cached_db' (database-backed, read through the cache), 'cache' or
+# 'signed_cookies'. The cache modes need a SESSION_CACHE_ALIAS shared by
+# every worker, or a logout in one worker leaves the session live in others
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[os.environ.get('PESAPLAN_SESSION_ENGINE', 'db')]
+SESSION_CACHE_ALIAS = os.environ.get('PESAPLAN_SESSION_CACHE', 'default')
+
+# Cache alias EmailBackend reads users through (accounts/cache.py); unset
+# reads the database. Like sessions, it must be shared by every worker
+ACCOUNTS_USER_CACHE = os.environ.get('PESAPLAN_USER_CACHE') or None
+ACCOUNTS_USER_CACHE_TIMEOUT = 300
+
+# Password hashing policy. The first hasher hashes new passwords and, on the
+# next successful login, rehashes any stored with another hasher or work
+# factor; the rest only verify. PESAPLAN_PASSWORD_HASHER picks 'pbkdf2'
+# (the default), 'scrypt' or 'argon2' (needs the argon2-cffi package).
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'accounts.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+}
+_PREFERRED_HASHER = os.environ.get('PESAPLAN_PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[_PREFERRED_HASHER],
+    *(path for name, path in _PASSWORD_HASHERS.items() if name != _PREFERRED_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+# PBKDF2 rounds per login; unset keeps Django's default for this release
+ACCOUNTS_PBKDF2_ITERATIONS = int(os.environ.get('PESAPLAN_PBKDF2_ITERATIONS', 0)) or None
+
+# Login/signup throttling (accounts/ratelimit.py), applied before any
+# password is hashed. Per-IP buckets are generous because a campus network
+# puts many students behind one address; the per-email window caps
+# guessing at one account from many addresses
+ACCOUNTS_RATELIMIT_ENABLED = os.environ.get('PESAPLAN_RATELIMIT', '1') == '1'
+# Use a cache shared by all workers (e.g. Redis) to limit across processes
+ACCOUNTS_RATELIMIT_CACHE = os.environ.get('PESAPLAN_RATELIMIT_CACHE', 'default')
+# Proxies in front of the app whose X-Forwarded-For entries are trusted
+ACCOUNTS_RATELIMIT_PROXY_COUNT = int(os.environ.get('PESAPLAN_RATELIMIT_PROXY_COUNT', 0))
+ACCOUNTS_RATE_LIMITS = {
+    'login_ip': {'algorithm': 'token_bucket', 'capacity': 30, 'per_minute': 30},
+    'login_email': {'algorithm': 'sliding_window', 'limit': 10, 'window': 15 * 60},
+    'signup_ip': {'algorithm': 'token_bucket', 'capacity': 20, 'per_minute': 5},
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -121,6 +242,24 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = os.environ.get('PESAPLAN_STATIC_ROOT', BASE_DIR / 'var' / 'static')
+
+# 'manifest' gives collected files content-hashed names and precompressed
+# .gz/.br variants (pesaplan/staticfiles.py); it needs collectstatic to
+# have run. 'plain' serves files as found, for development
+_STATIC_STORAGES = {
+    'manifest': 'pesaplan.staticfiles.CompressedManifestStaticFilesStorage',
+    'plain': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+}
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': _STATIC_STORAGES[os.environ.get('PESAPLAN_STATIC_STORAGE', 'plain' if DEBUG else 'manifest')],
+    },
+}
+# Serve STATIC_ROOT from Django, with immutable caching for hashed names,
+# when no web server in front of the app does it
+STATIC_SERVE = os.environ.get('PESAPLAN_STATIC_SERVE', '0') == '1'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -0,0 +1,130 @@
+"""
+Static asset pipeline: content-hashed names, precompressed variants and
+far-future caching.
+
+``CompressedManifestStaticFilesStorage`` is Django's manifest storage,
+which copies every file to a name containing a hash of its contents and
+rewrites the ``url()`` references in CSS to match. After that step
+``collectstatic`` also writes a ``.gz`` copy of every text asset next to
+it, and a ``.br`` copy when the ``brotli`` package is installed. A copy
+is only kept when it is meaningfully smaller. Compression happens once
+at deploy time, at the highest level, so no request pays for it.
+
+``serve_static`` serves ``STATIC_ROOT`` when no web server sits in front
+of the app (``STATIC_SERVE``). It picks the smallest variant the client
+accepts. A hashed name never changes its contents, so it is cached for a
+year as ``immutable``. A repeat visit then downloads no static bytes and
+does not even revalidate. Unhashed names must be revalidated.
+"""
+import gzip
+import mimetypes
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.utils._os import safe_join
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.mjs', '.json', '.svg', '.txt', '.html', '.xml', '.ico')
+# Below this, headers outweigh any saving
+MIN_SIZE = 256
+# Keep a variant only if it saves at least 5%
+MAX_RATIO = 0.95
+ONE_YEAR = 60 * 60 * 24 * 365
+
+
+def compress(data):
+    """Yield ``(suffix, content encoding, bytes)`` for each variant worth keeping."""
+    if len(data) < MIN_SIZE:
+        return
+    variants = [('.gz', 'gzip', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', 'br', brotli.compress(data, quality=11)))
+    for suffix, encoding, compressed in variants:
+        if len(compressed) <= len(data) * MAX_RATIO:
+            yield suffix, encoding, compressed
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Unhashed copies are still served, e.g. to anything that builds URLs by hand
+        for name in {*paths, *self.hashed_files.values()}:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = Path(self.path(name))
+            data = path.read_bytes()
+            for suffix, encoding, compressed in compress(data):
+                path.with_name(path.name + suffix).write_bytes(compressed)
+
+    @cached_property
+    def immutable_names(self):
+        """Names whose contents can never change: the hashed copies."""
+        return frozenset(self.hashed_files.values())
+
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _accepted(request):
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.partition(';')
+        quality = params.strip().removeprefix('q=') or '1'
+        try:
+            if float(quality) > 0:
+                accepted.add(coding.strip().lower())
+        except ValueError:
+            continue
+    return accepted
+
+
+@require_safe
+def serve_static(request, path):
+    """Serve ``path`` from ``STATIC_ROOT``, precompressed and with long-lived caching for hashed names."""
+    try:
+        fullpath = Path(safe_join(settings.STATIC_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404
+    if not fullpath.is_file():
+        raise Http404
+
+    stat = fullpath.stat()
+    immutable = path in getattr(staticfiles_storage, 'immutable_names', ())
+    if not immutable and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath.name)
+    served, encoding = fullpath, None
+    accepted = _accepted(request)
+    for coding, suffix in ENCODINGS:
+        variant = fullpath.with_name(fullpath.name + suffix)
+        if coding in accepted and variant.is_file():
+            served, encoding = variant, coding
+            break
+
+    response = FileResponse(
+        served.open('rb'), content_type=content_type or 'application/octet-stream', filename=fullpath.name,
+    )
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if immutable:
+        response['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+        response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
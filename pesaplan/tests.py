@@ -0,0 +1,187 @@
+import gzip
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection
+from django.db.utils import ConnectionHandler
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .database import database_config
+from .instrumentation import RequestMetrics, registry, report
+from .staticfiles import brotli, serve_static
+
+User = get_user_model()
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    def test_sqlite_profile_is_tuned_for_concurrent_writers(self):
+        config = database_config(Path('/srv/pesaplan'), {})
+        self.assertEqual(config['ENGINE'], 'pesaplan.backends.sqlite3')
+        self.assertEqual(config['NAME'], Path('/srv/pesaplan/db.sqlite3'))
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertEqual(config['OPTIONS']['pragmas']['journal_mode'], 'WAL')
+        self.assertEqual(config['OPTIONS']['pragmas']['busy_timeout'], 5000)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+    def test_postgres_profile_keeps_connections_or_pools_them(self):
+        env = {'PESAPLAN_DB': 'postgres', 'PESAPLAN_DB_NAME': 'budgets', 'PESAPLAN_DB_HOST': 'db'}
+        config = database_config(Path('.'), env)
+        self.assertEqual((config['ENGINE'], config['NAME'], config['HOST']), ('django.db.backends.postgresql', 'budgets', 'db'))
+        self.assertEqual(config['CONN_MAX_AGE'], 600)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+
+        env['PESAPLAN_DB_POOL'] = '1'
+        if django.VERSION < (5, 1):
+            with self.assertRaises(ImproperlyConfigured):
+                database_config(Path('.'), env)
+        else:
+            config = database_config(Path('.'), env)
+            self.assertEqual(config['CONN_MAX_AGE'], 0)
+            self.assertEqual(config['OPTIONS']['pool']['max_size'], 10)
+
+        with self.assertRaises(ImproperlyConfigured):
+            database_config(Path('.'), {'PESAPLAN_DB': 'oracle'})
+
+    def test_sqlite_backend_applies_pragmas_and_immediate_transactions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = ConnectionHandler({'default': database_config(Path(directory), {})})
+            connection = handler['default']
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                # What atomic() does on entry; the write lock is held from BEGIN
+                connection.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+                rival = sqlite3.connect(connection.settings_dict['NAME'], timeout=0)
+                with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                    rival.execute('BEGIN IMMEDIATE')
+                rival.close()
+                connection.rollback()
+                connection.set_autocommit(True)
+            finally:
+                connection.close()
+
+
+class HealthCheckTests(TestCase):
+    def test_reports_each_database(self):
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['databases']['default']['ok'])
+        self.assertEqual(response['Cache-Control'], 'max-age=0, no-cache, no-store, must-revalidate, private')
+
+    def test_unreachable_database_returns_503(self):
+        with mock.patch('django.db.backends.base.base.BaseDatabaseWrapper.cursor', side_effect=DatabaseError('gone')):
+            response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['databases']['default'], {'ok': False, 'error': 'gone'})
+
+
+@override_settings(PERF_SAMPLE_RATE=1.0)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='halima', email='halima@example.com', password='pass12345')
+        self.client.force_login(self.user)
+        registry.reset()
+
+    def test_sampled_request_is_measured(self):
+        with self.assertLogs('pesaplan.instrumentation', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('finance:dashboard'))
+        record = logs.records[0].perf
+        self.assertEqual(record['view'], 'finance:dashboard')
+        self.assertEqual(record['queries'], len(queries))
+        self.assertGreater(record['template_ms'], 0)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertFalse(record['slow'] or record['repeated_query'])
+
+    async def test_async_views_count_their_queries(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs('pesaplan.instrumentation', 'INFO') as logs:
+            await self.async_client.get(reverse('finance:api_dashboard'))
+        record = logs.records[0].perf
+        self.assertEqual(record['view'], 'finance:api_dashboard')
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(PERF_SLOW_REQUEST_MS=0, PERF_N_PLUS_ONE_THRESHOLD=3)
+    def test_slow_requests_and_repeated_queries_warn(self):
+        request = RequestFactory().get('/budgets/')
+        request.resolver_match = None
+        metrics = RequestMetrics()
+        for _ in range(3):
+            metrics.add_query('SELECT * FROM finance_allocation WHERE budget_id = %s', 0.001)
+        with self.assertLogs('pesaplan.instrumentation', 'WARNING') as logs:
+            record = report(request, HttpResponse(b'ok'), metrics)
+        self.assertEqual(record['repeated_query'], 3)
+        self.assertEqual([r.getMessage().split(':')[0] for r in logs.records], ['Slow request', 'Possible N+1'])
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        with self.assertNoLogs('pesaplan.instrumentation', 'INFO'):
+            self.client.get(reverse('finance:dashboard'))
+        self.assertEqual(registry.render()[2:3], ['# HELP pesaplan_request_duration_seconds Wall time of sampled requests.'])
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('finance:dashboard'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        with self.settings(PERF_METRICS_ENABLED=True, PERF_METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(reverse('metrics'), headers={'authorization': 'Bearer s3cret'})
+        body = response.content.decode()
+        self.assertIn('pesaplan_requests_total{view="finance:dashboard",method="GET",status="200"} 1', body)
+        self.assertIn('pesaplan_request_duration_seconds_count{view="finance:dashboard"} 1', body)
+        self.assertIn('pesaplan_summary_cache_requests_total{result="hit"}', body)
+
+
+class StaticPipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        storage = {'BACKEND': 'pesaplan.staticfiles.CompressedManifestStaticFilesStorage'}
+        settings_override = override_settings(
+            STATIC_ROOT=self.root, STORAGES={**settings.STORAGES, 'staticfiles': storage},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.css = staticfiles_storage.stored_name('css/styles.css')
+
+    def get(self, name, **headers):
+        return serve_static(RequestFactory().get(f'/static/{name}', headers=headers), name)
+
+    def test_collectstatic_writes_hashed_and_compressed_copies(self):
+        self.assertRegex(self.css, r'^css/styles\.[0-9a-f]{12}\.css$')
+        original = (Path(self.root) / self.css).read_bytes()
+        self.assertEqual(gzip.decompress((Path(self.root) / f'{self.css}.gz').read_bytes()), original)
+        self.assertEqual((Path(self.root) / f'{self.css}.br').exists(), brotli is not None)
+
+    def test_hashed_names_are_served_compressed_and_immutable(self):
+        response = self.get(self.css, accept_encoding='br;q=0, gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), (Path(self.root) / self.css).read_bytes(),
+        )
+
+        self.assertNotIn('Content-Encoding', self.get(self.css))
+
+    def test_unhashed_names_are_revalidated(self):
+        response = self.get('css/styles.css')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.get('css/styles.css', if_modified_since=response['Last-Modified']).status_code, 304)
+        with self.assertRaises(Http404):
+            self.get('../settings.py')
@@ -1,10 +1,20 @@
 
 # pesa_plan/urls.py
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from .health import health_view
+from .instrumentation import metrics_view
+from .staticfiles import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('healthz/', health_view, name='health'),
+    path('metrics/', metrics_view, name='metrics'),
     path('accounts/', include('accounts.urls')),  
     path('', include('finance.urls')),  # Finance app URLs
-]
\ No newline at end of file
+]
+
+if settings.STATIC_SERVE:
+    urlpatterns.insert(0, re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', serve_static))